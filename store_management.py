@@ -1,25 +1,3259 @@
-from datetime import datetime
+import math
+import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from heapq import heapify, heappop, heappush
+from itertools import islice
+from queue import Empty, Full, Queue
+from typing import NamedTuple
+
+
+def _normalize(text: str) -> str:
+    """Return the search form of a name: case-folded with collapsed whitespace."""
+    return " ".join(text.casefold().split())
+
+
+def _trigrams(text: str) -> set:
+    """Return the set of character trigrams of a normalized name, padded at both ends."""
+    padded = f"\x02{text}\x03"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Return the Levenshtein distance between two strings, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _check_skus(registry: dict, products) -> None:
+    """Raise ValueError if registering the products would duplicate a SKU.
+
+    Args:
+        registry (dict): SKU to Product mapping the products are about to join.
+        products (Iterable[Product]): Products being registered.
+    """
+    seen = {}
+    for product in products:
+        if product.sku is None:
+            continue
+        owner = seen.setdefault(product.sku, registry.get(product.sku, product))
+        if owner is not product:
+            raise ValueError(f"SKU {product.sku!r} is already registered to another product.")
+
+
+class _SortedList:
+    """Sorted list of comparable values split into bounded blocks.
+
+    Inserting or removing a value only shifts one block, so updates stay cheap
+    for hundreds of thousands of values.
+    """
+
+    _load = 512
+
+    def __init__(self):
+        """Initialize an empty _SortedList."""
+        self._lists = []
+        self._maxes = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        """Return the number of stored values."""
+        return self._len
+
+    def __iter__(self):
+        """Iterate over the stored values in ascending order."""
+        for block in self._lists:
+            yield from block
+
+    def add(self, value) -> None:
+        """Insert a value, keeping the list sorted.
+
+        Args:
+            value (Any): The value to insert.
+        """
+        if not self._maxes:
+            self._lists.append([value])
+            self._maxes.append(value)
+        else:
+            position = bisect_left(self._maxes, value)
+            if position == len(self._maxes):
+                position -= 1
+                self._lists[position].append(value)
+                self._maxes[position] = value
+            else:
+                insort(self._lists[position], value)
+            block = self._lists[position]
+            if len(block) > 2 * self._load:
+                self._lists.insert(position + 1, block[self._load:])
+                self._maxes.insert(position + 1, block[-1])
+                del block[self._load:]
+                self._maxes[position] = block[-1]
+        self._len += 1
+
+    def remove(self, value) -> None:
+        """Remove one occurrence of a value.
+
+        Args:
+            value (Any): The value to remove.
+
+        Raises:
+            ValueError: If the value is not present.
+        """
+        position = bisect_left(self._maxes, value)
+        if position < len(self._maxes):
+            block = self._lists[position]
+            index = bisect_left(block, value)
+            if index < len(block) and block[index] == value:
+                del block[index]
+                self._len -= 1
+                if block:
+                    self._maxes[position] = block[-1]
+                else:
+                    del self._lists[position]
+                    del self._maxes[position]
+                return
+        raise ValueError(f"{value!r} is not in the list")
+
+    def irange(self, low=None, high=None, inclusive: tuple = (True, True)):
+        """Lazily yield values between low and high in ascending order.
+
+        Args:
+            low (Any): Lower bound, or None for no lower bound.
+            high (Any): Upper bound, or None for no upper bound.
+            inclusive (tuple): Whether the lower and upper bounds are included.
+        """
+        if low is None:
+            position, index = 0, 0
+        else:
+            position = (bisect_left if inclusive[0] else bisect_right)(self._maxes, low)
+            if position == len(self._maxes):
+                return
+            index = (bisect_left if inclusive[0] else bisect_right)(self._lists[position], low)
+        for block in self._lists[position:]:
+            for value in block[index:] if index else block:
+                if high is not None and (value > high or (value == high and not inclusive[1])):
+                    return
+                yield value
+            index = 0
+
+
+class NameIndex:
+    """In-memory text index over Product names.
+
+    Keeps a sorted list of normalized names for prefix lookups and a trigram
+    inverted index for substring and typo-tolerant lookups. Products sharing
+    a name share one entry.
+    """
+
+    def __init__(self):
+        """Initialize an empty NameIndex."""
+        self._names = _SortedList()
+        self._products = {}
+        self._grams = {}
+
+    def __len__(self) -> int:
+        """Return the number of indexed products."""
+        return sum(len(bucket) for bucket in self._products.values())
+
+    def add(self, product: 'Product') -> None:
+        """Index a product under its current name.
+
+        Args:
+            product (Product): The product to index.
+        """
+        key = _normalize(product.name)
+        bucket = self._products.get(key)
+        if bucket is None:
+            self._products[key] = [product]
+            self._names.add(key)
+            for gram in _trigrams(key):
+                self._grams.setdefault(gram, set()).add(key)
+        elif product not in bucket:
+            bucket.append(product)
+
+    def remove(self, product: 'Product', name: str | None = None) -> None:
+        """Remove a product from the index.
+
+        Args:
+            product (Product): The product to remove.
+            name (str | None): The name the product was indexed under, if it has changed since.
+        """
+        key = _normalize(product.name if name is None else name)
+        bucket = self._products.get(key)
+        if bucket is None or product not in bucket:
+            return
+        bucket.remove(product)
+        if not bucket:
+            del self._products[key]
+            self._names.remove(key)
+            for gram in _trigrams(key):
+                keys = self._grams[gram]
+                keys.discard(key)
+                if not keys:
+                    del self._grams[gram]
+
+    def rename(self, product: 'Product', old: str) -> None:
+        """Move a product from its old name to its current one.
+
+        Args:
+            product (Product): The renamed product.
+            old (str): The name the product was indexed under.
+        """
+        self.remove(product, old)
+        self.add(product)
+
+    def _expand(self, keys, limit: int | None):
+        """Yield the products stored under the given names, stopping after limit products."""
+        count = 0
+        for key in keys:
+            for product in self._products[key]:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield product
+
+    def prefix(self, query: str, limit: int | None = None):
+        """Yield products whose name starts with the query, in name order.
+
+        Args:
+            query (str): Name prefix.
+            limit (int | None): Maximum number of products to yield.
+        """
+        query = _normalize(query)
+
+        def keys():
+            for key in self._names.irange(query):
+                if not key.startswith(query):
+                    return
+                yield key
+
+        return self._expand(keys(), limit)
+
+    def substring(self, query: str, limit: int | None = None):
+        """Yield products whose name contains the query, in name order.
+
+        Args:
+            query (str): Text to look for inside product names.
+            limit (int | None): Maximum number of products to yield.
+        """
+        query = _normalize(query)
+        if len(query) < 3:
+            keys = (key for key in self._names if query in key)
+        else:
+            grams = sorted((query[i:i + 3] for i in range(len(query) - 2)),
+                           key=lambda gram: len(self._grams.get(gram, ())))
+            candidates = set(self._grams.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._grams.get(gram, set())
+            keys = sorted(key for key in candidates if query in key)
+        return self._expand(keys, limit)
+
+    def fuzzy(self, query: str, max_distance: int = 1, limit: int | None = None) -> list:
+        """Return products whose name is within an edit distance of the query.
+
+        Candidates are narrowed with the trigram index before distances are
+        computed; each edit can break at most three trigrams.
+
+        Args:
+            query (str): Name to match, possibly misspelled.
+            max_distance (int): Maximum number of single-character edits.
+            limit (int | None): Maximum number of products to return.
+
+        Returns:
+            list: Matching products, closest first.
+        """
+        if not isinstance(max_distance, int) or max_distance < 0:
+            raise ValueError("max_distance must be a non-negative integer.")
+        query = _normalize(query)
+        grams = _trigrams(query)
+        required = len(grams) - 3 * max_distance
+        if required > 0:
+            shared = {}
+            for gram in grams:
+                for key in self._grams.get(gram, ()):
+                    shared[key] = shared.get(key, 0) + 1
+            candidates = [key for key, count in shared.items() if count >= required]
+        else:
+            candidates = self._names
+        matches = []
+        for key in candidates:
+            distance = _edit_distance(query, key, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, key))
+        matches.sort()
+        return list(self._expand((key for _, key in matches), limit))
+
+    def search(self, query: str, mode: str = "prefix", limit: int | None = None) -> list:
+        """Run a prefix, substring or fuzzy query.
+
+        Args:
+            query (str): Text to search for.
+            mode (str): One of "prefix", "substring" or "fuzzy".
+            limit (int | None): Maximum number of products to return.
+
+        Returns:
+            list: Matching products.
+
+        Raises:
+            TypeError: If query is not a string.
+            ValueError: If mode is unknown.
+        """
+        if not isinstance(query, str):
+            raise TypeError("Query must be a string.")
+        if mode == "prefix":
+            return list(self.prefix(query, limit))
+        if mode == "substring":
+            return list(self.substring(query, limit))
+        if mode == "fuzzy":
+            return self.fuzzy(query, limit=limit)
+        raise ValueError("Mode must be 'prefix', 'substring' or 'fuzzy'.")
+
+
+class SortedIndex:
+    """Sorted secondary index over a numeric Product attribute.
+
+    Entries are (value, id(product)) pairs so products with equal values keep
+    a stable order without being compared themselves. The indexed value of
+    each product is remembered, so an entry can be moved even when the
+    attribute was changed elsewhere (e.g. by another process).
+    """
+
+    def __init__(self, attribute: str, key=None):
+        """Initialize an empty SortedIndex.
+
+        Args:
+            attribute (str): Name of the Product attribute to index, e.g. "price".
+            key (Callable | None): Reads the indexed value of a product instead of the attribute.
+        """
+        self._attribute = attribute
+        self._key = key
+        self._entries = _SortedList()
+        self._products = {}
+        self._values = {}
+
+    def __len__(self) -> int:
+        """Return the number of indexed products."""
+        return len(self._products)
+
+    @property
+    def attribute(self) -> str:
+        """str: Name of the indexed Product attribute."""
+        return self._attribute
+
+    def _value(self, product: 'Product'):
+        """Return the current indexed value of a product."""
+        if self._key is not None:
+            return self._key(product)
+        return getattr(product, self._attribute)
+
+    def add(self, product: 'Product') -> None:
+        """Index a product under its current attribute value.
+
+        Args:
+            product (Product): The product to index.
+        """
+        if id(product) not in self._products:
+            value = self._value(product)
+            self._products[id(product)] = product
+            self._values[id(product)] = value
+            self._entries.add((value, id(product)))
+
+    def remove(self, product: 'Product') -> None:
+        """Remove a product from the index.
+
+        Args:
+            product (Product): The product to remove.
+        """
+        if self._products.pop(id(product), None) is not None:
+            self._entries.remove((self._values.pop(id(product)), id(product)))
+
+    def update(self, product: 'Product') -> None:
+        """Move a product from its indexed value to its current attribute value.
+
+        Args:
+            product (Product): The updated product.
+        """
+        if id(product) in self._products:
+            value = self._value(product)
+            self._entries.remove((self._values[id(product)], id(product)))
+            self._values[id(product)] = value
+            self._entries.add((value, id(product)))
+
+    def range(self, low: int | None = None, high: int | None = None):
+        """Lazily yield products whose value lies between low and high, inclusive, in ascending order.
+
+        Args:
+            low (int | None): Lowest value to include, or None for no lower bound.
+            high (int | None): Highest value to include, or None for no upper bound.
+        """
+        start = None if low is None else (low, -1)
+        stop = None if high is None else (high, float("inf"))
+        for _, key in self._entries.irange(start, stop):
+            yield self._products[key]
+
+
+class StockEvent(NamedTuple):
+    """A Product crossing its low-stock threshold or running out of stock."""
+
+    product: 'Product'
+    kind: str
+    quantity: int
+    threshold: int | None
+    store: 'Store | None'
+    timestamp: datetime
+
+
+class StockEventBus:
+    """Delivers StockEvent instances to subscribers through bounded queues.
+
+    Publishing never blocks and never runs subscriber code: events are put on
+    each subscriber queue and dropped (and counted) when a queue is full, so
+    checkout is not slowed down by replenishment logic.
+    """
+
+    def __init__(self):
+        """Initialize a StockEventBus without subscribers."""
+        self._subscribers = []
+        self._dropped = 0
+
+    @property
+    def dropped(self) -> int:
+        """int: Number of events dropped because a subscriber queue was full."""
+        return self._dropped
+
+    def subscribe(self, maxsize: int = 1024) -> Queue:
+        """Create a subscriber queue that receives every published event.
+
+        Args:
+            maxsize (int): Maximum number of undelivered events kept for the subscriber.
+
+        Returns:
+            Queue: The queue events will be put on.
+
+        Raises:
+            ValueError: If maxsize is not a positive integer.
+        """
+        if not isinstance(maxsize, int) or maxsize <= 0:
+            raise ValueError("maxsize must be a positive integer.")
+        subscription = Queue(maxsize)
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Queue) -> None:
+        """Stop delivering events to a subscriber queue.
+
+        Args:
+            subscription (Queue): A queue returned by subscribe().
+        """
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def publish(self, event: StockEvent) -> None:
+        """Put an event on every subscriber queue without blocking.
+
+        Args:
+            event (StockEvent): The event to deliver.
+        """
+        for subscription in self._subscribers:
+            try:
+                subscription.put_nowait(event)
+            except Full:
+                self._dropped += 1
+
+
+class ReorderQueue:
+    """FIFO queue of products to replenish, holding at most one event per product and store.
+
+    A product that is already queued for a store keeps its place; its event is
+    replaced by the newer one, so repeated low-stock events do not produce
+    duplicate orders. Events of different stores are queued separately.
+    """
+
+    def __init__(self):
+        """Initialize an empty ReorderQueue."""
+        self._events = OrderedDict()
+        self._stores = {}
+
+    def __len__(self) -> int:
+        """Return the number of queued (product, store) pairs."""
+        return len(self._events)
+
+    def __contains__(self, product: 'Product') -> bool:
+        """Return True if the product is waiting to be reordered for any store."""
+        return product in self._stores
+
+    def push(self, event: StockEvent) -> None:
+        """Queue a product for reordering, or refresh its pending event.
+
+        Args:
+            event (StockEvent): The stock event for the product.
+
+        Raises:
+            TypeError: If event is not a StockEvent instance.
+        """
+        if not isinstance(event, StockEvent):
+            raise TypeError(f"Expected StockEvent instance, got {type(event).__name__}")
+        self._events[event.product, event.store] = event
+        self._stores.setdefault(event.product, {})[event.store] = None
+
+    def pop(self) -> StockEvent | None:
+        """Remove and return the oldest queued event.
+
+        Returns:
+            StockEvent | None: The event, or None if the queue is empty.
+        """
+        if not self._events:
+            return None
+        (product, store), event = self._events.popitem(last=False)
+        self._forget(product, store)
+        return event
+
+    def _forget(self, product: 'Product', store: 'Store | None') -> None:
+        """Remove a (product, store) pair from the per-product store index."""
+        stores = self._stores[product]
+        del stores[store]
+        if not stores:
+            del self._stores[product]
+
+    def discard(self, product: 'Product', store: 'Store | None' = None) -> None:
+        """Drop a product from the queue, e.g. once it has been restocked.
+
+        Args:
+            product (Product): The product to drop.
+            store (Store | None): Store to drop the product for; None drops it for every store.
+        """
+        stores = [store] if store is not None else list(self._stores.get(product, ()))
+        for store in stores:
+            if self._events.pop((product, store), None) is not None:
+                self._forget(product, store)
+
+    def drain(self, subscription: Queue, limit: int | None = None) -> int:
+        """Move pending events from a subscriber queue into the reorder queue without blocking.
+
+        Args:
+            subscription (Queue): A queue returned by StockEventBus.subscribe().
+            limit (int | None): Maximum number of events to move.
+
+        Returns:
+            int: Number of events moved.
+        """
+        moved = 0
+        while limit is None or moved < limit:
+            try:
+                event = subscription.get_nowait()
+            except Empty:
+                break
+            self.push(event)
+            moved += 1
+        return moved
+
+
+class StockLedger:
+    """Per-store stock quantities for shared Product definitions.
+
+    Quantities form a store x product matrix stored as one compact
+    array('q') row per product with a column per store, so a single Product
+    can be stocked in any number of stores and "where is this item in stock"
+    is one row scan. Every tracked product is listed in the product
+    collections, SKU registry and indexes of every tracked store.
+    """
+
+    def __init__(self, database: 'Database | None' = None):
+        """Initialize an empty StockLedger.
+
+        Args:
+            database (Database | None): Database whose stock event bus receives low-stock events.
+        """
+        self._database = database
+        self._stores = []
+        self._columns = {}
+        self._rows = {}
+
+    @property
+    def stores(self) -> tuple:
+        """tuple: Stores tracked by the ledger, in column order."""
+        return tuple(self._stores)
+
+    @property
+    def products(self) -> tuple:
+        """tuple: Products tracked by the ledger."""
+        return tuple(self._rows)
+
+    def add_store(self, store: 'Store') -> None:
+        """Add a column for a store, with zero stock of every product.
+
+        Args:
+            store (Store): The store to track.
+
+        Raises:
+            TypeError: If store is not a Store instance.
+            ValueError: If a tracked product SKU is registered to another product of the store.
+        """
+        if not isinstance(store, Store):
+            raise TypeError(f"Expected Store instance, got {type(store).__name__}")
+        if store not in self._columns:
+            _check_skus(store._skus, self._rows)
+            self._columns[store] = len(self._stores)
+            self._stores.append(store)
+            for row in self._rows.values():
+                row.append(0)
+            store._ledger = self
+            for product in self._rows:
+                store._list(product)
+
+    def add_product(self, product: 'Product') -> None:
+        """Add a row for a product, with zero stock in every store.
+
+        Args:
+            product (Product): The product to track.
+
+        Raises:
+            TypeError: If product is not a Product instance.
+            ValueError: If the product SKU is registered to another product of a tracked store.
+        """
+        if not isinstance(product, Product):
+            raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+        if product not in self._rows:
+            for store in self._stores:
+                _check_skus(store._skus, (product,))
+            self._rows[product] = array('q', bytes(8 * len(self._stores)))
+            for store in self._stores:
+                store._list(product)
+
+    def remove_store(self, store: 'Store') -> None:
+        """Drop the column of a store.
+
+        Args:
+            store (Store): The store to stop tracking.
+        """
+        column = self._columns.pop(store, None)
+        if column is None:
+            return
+        del self._stores[column]
+        for position, other in enumerate(self._stores[column:], column):
+            self._columns[other] = position
+        for row in self._rows.values():
+            del row[column]
+        store._ledger = None
+        for product in self._rows:
+            store._unlist(product)
+
+    def remove_product(self, product: 'Product') -> None:
+        """Drop the row of a product.
+
+        Args:
+            product (Product): The product to stop tracking.
+        """
+        if self._rows.pop(product, None) is not None:
+            for store in self._stores:
+                store._unlist(product)
+
+    def tracks(self, product: 'Product', store: 'Store') -> bool:
+        """Return True if the ledger holds stock of the product for the store."""
+        return product in self._rows and store in self._columns
+
+    def get(self, product: 'Product', store: 'Store') -> int:
+        """Return the stock of a product in a store.
+
+        Args:
+            product (Product): A tracked product.
+            store (Store): A tracked store.
+
+        Returns:
+            int: Quantity in stock.
+        """
+        return self._rows[product][self._columns[store]]
+
+    def set(self, product: 'Product', store: 'Store', quantity: int) -> None:
+        """Set the stock of a product in a store, tracking either one if needed.
+
+        Args:
+            product (Product): The product.
+            store (Store): The store.
+            quantity (int): New quantity in stock.
+
+        Raises:
+            TypeError: If quantity is not an integer.
+        """
+        if not isinstance(quantity, int):
+            raise TypeError("Quantity must be an integer.")
+        self.add_store(store)
+        self.add_product(product)
+        row = self._rows[product]
+        column = self._columns[store]
+        old = row[column]
+        row[column] = quantity
+        store._quantity_index.update(product)
+        if quantity < old:
+            product._publish_stock_event(old, quantity, store, self._database)
+
+    def adjust(self, product: 'Product', store: 'Store', delta: int) -> int:
+        """Add delta to the stock of a tracked product in a tracked store.
+
+        Args:
+            product (Product): A tracked product.
+            store (Store): A tracked store.
+            delta (int): Change in quantity, negative for sales.
+
+        Returns:
+            int: New quantity in stock.
+        """
+        row = self._rows[product]
+        column = self._columns[store]
+        old = row[column]
+        row[column] = old + delta
+        store._quantity_index.update(product)
+        if delta < 0:
+            product._publish_stock_event(old, old + delta, store, self._database)
+        return old + delta
+
+    def stock_of(self, product: 'Product') -> dict:
+        """Return the stock of a product in every tracked store.
+
+        Args:
+            product (Product): A tracked product.
+
+        Returns:
+            dict: Store to quantity mapping.
+        """
+        return dict(zip(self._stores, self._rows[product]))
+
+    def stores_with_stock(self, product: 'Product', minimum: int = 1) -> list:
+        """Return the stores holding at least minimum units of a product.
+
+        Args:
+            product (Product): The product to look up.
+            minimum (int): Smallest quantity that counts as in stock.
+
+        Returns:
+            list: Store instances, in column order.
+        """
+        row = self._rows.get(product)
+        if row is None:
+            return []
+        return [self._stores[column] for column, quantity in enumerate(row) if quantity >= minimum]
+
+    def total(self, product: 'Product') -> int:
+        """Return the stock of a product summed over all stores."""
+        row = self._rows.get(product)
+        return sum(row) if row is not None else 0
+
+
+class SharedInventory:
+    """Product quantities kept in a shared memory block, indexed by product ID.
+
+    Several processes (e.g. tills) attach to the same block and sell from one
+    stock pool without a central server. Each slot is a signed 64-bit integer;
+    slots are guarded by a fixed set of striped locks, and a reservation locks
+    the stripes of all its products in ascending order, so multi-product
+    reservations are all-or-nothing and cannot deadlock. A flag byte per slot
+    records whether the slot was written, so a process binding a product late
+    seeds the slot only if no process has stocked it yet.
+
+    Create the inventory in the parent process and pass it to child processes
+    as a Process argument; it is re-attached by name on the other side.
+    """
+
+    def __init__(self, capacity: int, stripes: int = 64, name: str | None = None, locks: list | None = None,
+                 context: str | None = None):
+        """Create a new shared memory block, or attach to an existing one by name.
+
+        Args:
+            capacity (int): Number of slots; product IDs must be below it.
+            stripes (int): Number of locks guarding the slots.
+            name (str | None): Name of an existing block to attach to.
+            locks (list | None): Locks of the existing block, required when attaching.
+            context (str | None): multiprocessing start method the child processes will use, e.g. "spawn".
+
+        Raises:
+            ValueError: If capacity or stripes is not a positive integer.
+        """
+        from multiprocessing import get_context, shared_memory
+
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise ValueError("Capacity must be a positive integer.")
+        if not isinstance(stripes, int) or stripes <= 0:
+            raise ValueError("Stripes must be a positive integer.")
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=9 * capacity)
+            self._memory.buf[:9 * capacity] = bytes(9 * capacity)
+            self._locks = [get_context(context).Lock() for _ in range(stripes)]
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+            self._locks = locks
+        self._capacity = capacity
+        self._slots = self._memory.buf[:8 * capacity].cast('q')
+        self._stocked = self._memory.buf[8 * capacity:9 * capacity]
+
+    def __reduce__(self):
+        """Pickle as a reference to the shared block, for passing to child processes."""
+        return (type(self), (self._capacity, len(self._locks), self._memory.name, self._locks))
+
+    @property
+    def name(self) -> str:
+        """str: Name of the shared memory block."""
+        return self._memory.name
+
+    @property
+    def capacity(self) -> int:
+        """int: Number of product slots."""
+        return self._capacity
+
+    def _lock(self, product_id: int):
+        """Return the lock guarding the slot of a product."""
+        return self._locks[product_id % len(self._locks)]
+
+    def get(self, product_id: int) -> int:
+        """Return the quantity in the slot of a product."""
+        return self._slots[product_id]
+
+    def set(self, product_id: int, quantity: int) -> None:
+        """Overwrite the quantity in the slot of a product."""
+        with self._lock(product_id):
+            self._slots[product_id] = quantity
+            self._stocked[product_id] = 1
+
+    def seed(self, product_id: int, quantity: int) -> int:
+        """Write the quantity of a product unless its slot was written before, and return the slot quantity."""
+        with self._lock(product_id):
+            if not self._stocked[product_id]:
+                self._slots[product_id] = quantity
+                self._stocked[product_id] = 1
+            return self._slots[product_id]
+
+    def add(self, product_id: int, delta: int) -> int:
+        """Atomically add delta to the slot of a product and return the new quantity."""
+        with self._lock(product_id):
+            self._slots[product_id] += delta
+            return self._slots[product_id]
+
+    def reserve(self, items: dict) -> dict | None:
+        """Atomically take stock of several products, or nothing at all.
+
+        Args:
+            items (dict): Product ID to number of units.
+
+        Returns:
+            dict | None: Product ID to quantity before the reservation, or None if
+            any product has insufficient stock.
+        """
+        stripes = sorted({product_id % len(self._locks) for product_id in items})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            before = {product_id: self._slots[product_id] for product_id in items}
+            if any(before[product_id] < count for product_id, count in items.items()):
+                return None
+            for product_id, count in items.items():
+                self._slots[product_id] -= count
+            return before
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
+
+    def release(self, items: dict) -> None:
+        """Return previously reserved units to stock.
+
+        Args:
+            items (dict): Product ID to number of units.
+        """
+        for product_id, count in items.items():
+            self.add(product_id, count)
+
+    def close(self) -> None:
+        """Detach this process from the shared memory block."""
+        self._slots.release()
+        self._stocked.release()
+        self._memory.close()
+
+    def unlink(self) -> None:
+        """Destroy the shared memory block; call once, from the creating process."""
+        self._memory.unlink()
+
+
+class CashbackLedger:
+    """Append-only history of a customer's cashback balance.
+
+    Entries are kept in parallel compact arrays (amount, timestamp, purchase
+    ID, kind) together with running balance, credit and debit totals, so the
+    balance at any point in time is a binary search over the timestamps.
+    Timestamps must not decrease.
+
+    The balance is also kept as lots dated when they were credited, oldest
+    first. Debits take the oldest lots, a refund gives back the lots most
+    recently taken by withdrawals, and a transfer moves lots to another
+    ledger with their dates, so unspent cashback keeps its age for expiry.
+    """
+
+    ACCRUAL = 0
+    WITHDRAWAL = 1
+    ADJUSTMENT = 2
+    EXPIRY = 3
+    REFUND = 4
+    TRANSFER = 5
+
+    def __init__(self):
+        """Initialize an empty CashbackLedger."""
+        self._amounts = array('q')
+        self._times = array('d')
+        self._purchases = array('q')
+        self._kinds = array('b')
+        self._balances = array('q')
+        self._credits = array('q')
+        self._debits = array('q')
+        self._lots = []
+        self._taken = []
+
+    def __len__(self) -> int:
+        """Return the number of entries."""
+        return len(self._amounts)
+
+    @property
+    def balance(self) -> int:
+        """int: Current balance."""
+        return self._balances[-1] if self._balances else 0
+
+    @property
+    def debited(self) -> int:
+        """int: Total of all withdrawals, negative adjustments and expiries, less refunds."""
+        return self._debits[-1] if self._debits else 0
+
+    @property
+    def last(self) -> datetime | None:
+        """datetime | None: Time of the last entry."""
+        return datetime.fromtimestamp(self._times[-1]) if self._times else None
+
+    def append(self, amount: int, kind: int, when: datetime | None = None, purchase_id: int | None = None,
+               lots: list | None = None) -> list:
+        """Append an entry.
+
+        Credits open a lot dated when, or the given lots of a transfer; debits
+        take the oldest lots. A REFUND reverses withdrawals: it gives back the
+        lots they took, latest first, and lowers the debited total instead of
+        raising the credited one.
+
+        Args:
+            amount (int): Change in balance, negative for debits.
+            kind (int): One of ACCRUAL, WITHDRAWAL, ADJUSTMENT, EXPIRY, REFUND or TRANSFER.
+            when (datetime | None): Time of the entry, defaulting to now.
+            purchase_id (int | None): ID of the purchase the entry belongs to.
+            lots (list | None): (datetime, amount) lots of a credit, summing to amount; defaults to one lot at when.
+
+        Returns:
+            list: (datetime, amount) lots taken by a debit, oldest first; empty for credits.
+
+        Raises:
+            ValueError: If when is earlier than the last entry.
+        """
+        when = when or datetime.now()
+        timestamp = when.timestamp()
+        if self._times and timestamp < self._times[-1]:
+            raise ValueError("Ledger entries must be appended in time order.")
+        taken = []
+        refund = kind == self.REFUND
+        if refund:
+            self._restore(amount, timestamp)
+        elif amount > 0:
+            for lot_when, lot_amount in lots or ((when, amount),):
+                insort(self._lots, [lot_when.timestamp(), lot_amount])
+        elif amount < 0:
+            taken = self._consume(-amount)
+            if kind == self.WITHDRAWAL:
+                self._taken.extend(taken)
+        self._amounts.append(amount)
+        self._times.append(timestamp)
+        self._purchases.append(-1 if purchase_id is None else purchase_id)
+        self._kinds.append(kind)
+        self._balances.append(self.balance + amount)
+        self._credits.append((self._credits[-1] if self._credits else 0) + (0 if refund else max(amount, 0)))
+        self._debits.append(self.debited + (-amount if refund else max(-amount, 0)))
+        return [(datetime.fromtimestamp(lot_time), lot_amount) for lot_time, lot_amount in taken]
+
+    def _consume(self, amount: int) -> list:
+        """Take amount from the oldest lots and return the (timestamp, amount) parts taken."""
+        lots = self._lots
+        taken = []
+        used = 0
+        while amount > 0 and used < len(lots):
+            lot = lots[used]
+            part = min(amount, lot[1])
+            taken.append((lot[0], part))
+            amount -= part
+            lot[1] -= part
+            if not lot[1]:
+                used += 1
+        del lots[:used]
+        return taken
+
+    def _restore(self, amount: int, timestamp: float) -> None:
+        """Give back the lots most recently taken by withdrawals; any rest opens a lot at timestamp."""
+        while amount > 0 and self._taken:
+            lot_time, lot_amount = self._taken.pop()
+            part = min(amount, lot_amount)
+            if part < lot_amount:
+                self._taken.append((lot_time, lot_amount - part))
+            insort(self._lots, [lot_time, part])
+            amount -= part
+        if amount > 0:
+            insort(self._lots, [timestamp, amount])
+
+    def expiring(self, before: datetime) -> int:
+        """Return the unspent cashback of the lots credited at or before a point in time."""
+        cutoff = before.timestamp()
+        total = 0
+        for lot_time, lot_amount in self._lots:
+            if lot_time > cutoff:
+                break
+            total += lot_amount
+        return total
+
+    def clamp(self, when: datetime) -> datetime:
+        """Return when, or the time of the last entry if that is later, so that an entry at it can be appended."""
+        if self._times and when.timestamp() < self._times[-1]:
+            return datetime.fromtimestamp(self._times[-1])
+        return when
+
+    def _position(self, when: datetime) -> int:
+        """Return the number of entries made at or before a point in time."""
+        return bisect_right(self._times, when.timestamp())
+
+    def balance_at(self, when: datetime) -> int:
+        """Return the balance at a point in time.
+
+        Args:
+            when (datetime): Point in time.
+
+        Returns:
+            int: Balance after every entry made at or before when.
+        """
+        position = self._position(when)
+        return self._balances[position - 1] if position else 0
+
+    def credited_at(self, when: datetime) -> int:
+        """Return the total credited at or before a point in time."""
+        position = self._position(when)
+        return self._credits[position - 1] if position else 0
+
+    def entries(self, start: datetime | None = None, end: datetime | None = None):
+        """Lazily yield (amount, kind, datetime, purchase ID) entries made between start and end, inclusive.
+
+        Args:
+            start (datetime | None): Earliest entry time, or None.
+            end (datetime | None): Latest entry time, or None.
+        """
+        first = 0 if start is None else bisect_left(self._times, start.timestamp())
+        last = len(self._times) if end is None else self._position(end)
+        for position in range(first, last):
+            purchase_id = self._purchases[position]
+            yield (self._amounts[position], self._kinds[position],
+                   datetime.fromtimestamp(self._times[position]), None if purchase_id < 0 else purchase_id)
+
+
+class PurchaseLine(NamedTuple):
+    """Immutable snapshot of a purchased product as it was sold."""
+    product_id: int | None
+    sku: str | None
+    name: str
+    unit_price: int
+    quantity: int
+
+
+def _capture_lines(products, prices: dict) -> tuple:
+    """Snapshot products, one per unit or as lines, into PurchaseLine tuples with interned names.
+
+    Equal lines are shared by the purchases of a database once they are
+    registered (Database._intern_lines), so a line costs one tuple however
+    many receipts hold it.
+    """
+    counts = Counter(product for product in products if isinstance(product, Product))
+    lines = [product for product in products if isinstance(product, PurchaseLine)]
+    for product, quantity in counts.items():
+        lines.append(PurchaseLine(product.id, product.sku, sys.intern(product.name),
+                                  prices.get(product, product.price), quantity))
+    return tuple(lines)
+
+
+class PurchaseStub(NamedTuple):
+    """Compact in-memory record of an archived purchase."""
+    id: int
+    purchase_date: datetime
+    total: int
+    customer_id: int | None
+    segment: int
+
+
+class PurchaseArchive:
+    """Compressed on-disk segments of old purchases with lazy rehydration.
+
+    Database.archive_purchases moves purchases older than the retention
+    period into gzip-compressed JSON segments and keeps only a PurchaseStub
+    per purchase in memory. Archived purchases are rebuilt on access; a small
+    LRU of decoded segments and rebuilt purchases bounds resident memory
+    regardless of the history length. An archive opened on a directory that
+    already holds segments reads their stubs back and appends after them.
+    Segments are never rewritten: an amended purchase is written again to a
+    new segment, and the latest segment holding a purchase wins.
+    """
+
+    def __init__(self, directory: str, retention_days: int = 90, segment_size: int = 10000,
+                 cache_size: int = 1024):
+        """Initialize a PurchaseArchive.
+
+        Args:
+            directory (str): Directory of the segment files; created if missing, resumed if not empty.
+            retention_days (int): Purchases older than this are archived.
+            segment_size (int): Maximum number of purchases per segment.
+            cache_size (int): Number of rebuilt purchases kept in memory.
+
+        Raises:
+            ValueError: If a number is not positive.
+        """
+        for value in (retention_days, segment_size, cache_size):
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError("Archive settings must be positive integers.")
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._retention = timedelta(days=retention_days)
+        self._segment_size = segment_size
+        self._cache_size = cache_size
+        self._stubs = {}
+        self._last_id = 0
+        self._segments = 0
+        self._decoded = OrderedDict()
+        self._rebuilt = OrderedDict()
+        segments = sorted(int(name[10:-8]) for name in os.listdir(directory)
+                          if name.startswith("purchases-") and name.endswith(".json.gz") and name[10:-8].isdigit())
+        for segment in segments:
+            for record in self._read(segment):
+                self._stubs[record['id']] = PurchaseStub(
+                    record['id'], datetime.fromisoformat(record['purchase_date']), record['total'],
+                    record['customer']['id'], segment)
+                self._last_id = max(self._last_id, record['id'])
+            self._segments = segment + 1
+
+    def __len__(self) -> int:
+        """Return the number of archived purchases."""
+        return len(self._stubs)
+
+    def __contains__(self, purchase_id: int) -> bool:
+        """Return True if a purchase ID is archived."""
+        return purchase_id in self._stubs
+
+    @property
+    def retention(self) -> timedelta:
+        """timedelta: Age after which purchases are archived."""
+        return self._retention
+
+    @property
+    def last_id(self) -> int:
+        """int: Highest archived purchase ID, or 0."""
+        return self._last_id
+
+    @property
+    def stubs(self) -> tuple:
+        """tuple: PurchaseStub of every archived purchase, in archival order."""
+        return tuple(self._stubs.values())
+
+    def stub(self, purchase_id: int) -> PurchaseStub | bool:
+        """Return the stub of an archived purchase, or False."""
+        return self._stubs.get(purchase_id, False)
+
+    def _path(self, segment: int) -> str:
+        """Return the file path of a segment."""
+        return os.path.join(self._directory, f"purchases-{segment:06d}.json.gz")
+
+    @staticmethod
+    def _record(purchase: 'Purchase') -> dict:
+        """Serialize a purchase."""
+        return {'id': purchase.id, 'purchase_date': purchase.purchase_date.isoformat(),
+                'store': purchase.store.to_dict(),
+                'cashier': {**purchase.cashier.to_dict(), 'phone': purchase.cashier._phone},
+                'customer': purchase.customer.to_dict(),
+                'products': [list(line) for line in purchase.products],
+                'used_cashback': purchase.used_cashback, 'total': purchase.total, 'discount': purchase.discount}
+
+    def write(self, purchases) -> list:
+        """Write purchases to new segments; purchases archived before are superseded by the new records.
+
+        Args:
+            purchases (Iterable[Purchase]): Purchases with IDs.
+
+        Returns:
+            list: PurchaseStub of each purchase, in order.
+
+        Raises:
+            FileExistsError: If a segment file was created by someone else meanwhile; it is never overwritten.
+        """
+        import gzip
+        import json
+
+        purchases = list(purchases)
+        stubs = []
+        for start in range(0, len(purchases), self._segment_size):
+            chunk = purchases[start:start + self._segment_size]
+            segment = self._segments
+            with gzip.open(self._path(segment), "xt", encoding="utf-8") as file:
+                json.dump([self._record(purchase) for purchase in chunk], file, separators=(",", ":"))
+            self._segments += 1
+            for purchase in chunk:
+                stub = PurchaseStub(purchase.id, purchase.purchase_date, purchase.total,
+                                    purchase.customer.id, segment)
+                self._stubs[purchase.id] = stub
+                self._last_id = max(self._last_id, purchase.id)
+                stubs.append(stub)
+        return stubs
+
+    def _read(self, segment: int) -> list:
+        """Decode the records of a segment file."""
+        import gzip
+        import json
+
+        with gzip.open(self._path(segment), "rt", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _segment(self, segment: int) -> dict:
+        """Return the decoded records of a segment by purchase ID, keeping the last two segments decoded."""
+        records = self._decoded.get(segment)
+        if records is None:
+            records = {record['id']: record for record in self._read(segment)}
+            self._decoded[segment] = records
+            if len(self._decoded) > 2:
+                self._decoded.popitem(last=False)
+        else:
+            self._decoded.move_to_end(segment)
+        return records
+
+    def load(self, purchase_id: int, database: 'Database') -> 'Purchase':
+        """Rebuild an archived purchase.
+
+        Store, cashier and customer are resolved in the database by ID;
+        entities that no longer exist are rebuilt detached from their archived
+        data.
+
+        Args:
+            purchase_id (int): ID of the archived purchase.
+            database (Database): Database the purchase belonged to.
+
+        Returns:
+            Purchase: The rebuilt purchase.
+
+        Raises:
+            KeyError: If the purchase is not archived.
+        """
+        purchase = self._rebuilt.get(purchase_id)
+        if purchase is not None:
+            self._rebuilt.move_to_end(purchase_id)
+            return purchase
+        record = self._segment(self._stubs[purchase_id].segment)[purchase_id]
+        data = record['store']
+        store = database.find_store_by_id(data['id']) or _detached(Store(data['name'], data['address']), data)
+        data = record['cashier']
+        cashier = (database.find_cashier_by_id(data['id'])
+                   or _detached(Cashier(data['name'], data['surname'], data['phone']), data))
+        data = record['customer']
+        customer = (database.find_customer_by_id(data['id'])
+                    or _detached(Customer(data['name'], data['surname'], data['phone']), data))
+        purchase = Purchase(store, [PurchaseLine(*line) for line in record['products']], cashier, customer,
+                            record['used_cashback'], total=record['total'], discount=record['discount'])
+        purchase._id = purchase_id
+        purchase._purchase_date = datetime.fromisoformat(record['purchase_date'])
+        purchase._database = database
+        self._rebuilt[purchase_id] = purchase
+        if len(self._rebuilt) > self._cache_size:
+            self._rebuilt.popitem(last=False)
+        return purchase
+
+
+def _detached(entity, data: dict):
+    """Give an entity rebuilt from archived data its archived ID."""
+    entity._id = data['id']
+    return entity
+
+
+class ReceiptRenderer:
+    """Renders purchase receipts as text or JSON with an LRU cache bounded by bytes.
+
+    Receipts are rendered on first request and kept until the cache exceeds
+    max_bytes (least recently used first) or the purchase is amended.
+    Purchases without an ID are rendered but not cached.
+    """
+
+    FORMATS = ("text", "json")
+
+    def __init__(self, max_bytes: int = 1 << 20):
+        """Initialize a ReceiptRenderer.
+
+        Args:
+            max_bytes (int): Maximum total size of the cached receipts, in UTF-8 bytes.
+
+        Raises:
+            ValueError: If max_bytes is not a positive integer.
+        """
+        if not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError("max_bytes must be a positive integer.")
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        """Return the number of cached receipts."""
+        return len(self._cache)
+
+    @property
+    def size(self) -> int:
+        """int: Total size of the cached receipts in bytes."""
+        return self._size
+
+    @property
+    def hits(self) -> int:
+        """int: Number of receipts served from the cache."""
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        """int: Number of receipts rendered because they were not cached."""
+        return self._misses
+
+    @staticmethod
+    def _text(purchase: 'Purchase') -> str:
+        """Render a receipt as plain text."""
+        store = purchase.store
+        cashier = purchase.cashier
+        rows = [f"{store.name}, {store.address}",
+                f"Receipt #{purchase.id}  {purchase.purchase_date:%Y-%m-%d %H:%M:%S}",
+                f"Cashier: {cashier.name} {cashier.surname}"]
+        for line in purchase.products:
+            rows.append(f"{line.name}  {line.quantity} x {line.unit_price} = {line.quantity * line.unit_price}")
+        if purchase.discount:
+            rows.append(f"Discount: -{purchase.discount}")
+        if purchase.used_cashback:
+            rows.append(f"Cashback used: -{purchase.used_cashback}")
+        rows.append(f"Total: {purchase.total - purchase.used_cashback}")
+        return "\n".join(rows)
+
+    def render(self, purchase: 'Purchase', format: str = "text") -> str:
+        """Return the receipt of a purchase, rendering it if it is not cached.
+
+        Args:
+            purchase (Purchase): The purchase.
+            format (str): "text" or "json".
+
+        Returns:
+            str: The rendered receipt.
+
+        Raises:
+            ValueError: If format is unknown.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown receipt format {format!r}.")
+        key = (purchase.id, format)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == purchase.revision:
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return cached[1]
+        self._misses += 1
+        if format == "text":
+            receipt = self._text(purchase)
+        else:
+            import json
+
+            receipt = json.dumps(purchase.get_receipt(), separators=(",", ":"))
+        if purchase.id is not None:
+            self._discard(key)
+            size = len(receipt.encode())
+            if size <= self._max_bytes:
+                self._cache[key] = (purchase.revision, receipt, size)
+                self._size += size
+                while self._size > self._max_bytes:
+                    self._size -= self._cache.popitem(last=False)[1][2]
+        return receipt
+
+    def _discard(self, key: tuple) -> None:
+        """Remove one cached receipt."""
+        cached = self._cache.pop(key, None)
+        if cached is not None:
+            self._size -= cached[2]
+
+    def invalidate(self, purchase_id: int) -> None:
+        """Drop the cached receipts of a purchase.
+
+        Args:
+            purchase_id (int): ID of the purchase.
+        """
+        for format in self.FORMATS:
+            self._discard((purchase_id, format))
+
+    def clear(self) -> None:
+        """Drop every cached receipt."""
+        self._cache.clear()
+        self._size = 0
+
+
+class ShiftMetrics:
+    """Throughput counters of a cashier, maintained as sales and voids happen.
+
+    Rates are computed from the counters and the time worked, so every
+    metric is O(1) regardless of the purchase history.
+    """
+
+    def __init__(self):
+        """Initialize zeroed ShiftMetrics."""
+        self._carts = 0
+        self._items = 0
+        self._revenue = 0
+        self._voided_carts = 0
+        self._voided_lines = 0
+        self._seconds = 0.0
+        self._open_since = None
+
+    def _record_sale(self, items: int, revenue: int) -> None:
+        """Count a paid cart."""
+        self._carts += 1
+        self._items += items
+        self._revenue += revenue
+
+    def _record_void(self, cart: bool) -> None:
+        """Count a voided cart or a voided line."""
+        if cart:
+            self._voided_carts += 1
+        else:
+            self._voided_lines += 1
+
+    def _open(self, when: datetime) -> None:
+        """Start counting working time."""
+        self._open_since = when
+
+    def _close(self, when: datetime) -> None:
+        """Stop counting working time."""
+        self._seconds += (when - self._open_since).total_seconds()
+        self._open_since = None
+
+    @property
+    def carts(self) -> int:
+        """int: Number of paid carts."""
+        return self._carts
+
+    @property
+    def items(self) -> int:
+        """int: Number of units sold."""
+        return self._items
+
+    @property
+    def revenue(self) -> int:
+        """int: Amount paid for the carts."""
+        return self._revenue
+
+    @property
+    def voided_carts(self) -> int:
+        """int: Number of voided carts."""
+        return self._voided_carts
+
+    @property
+    def voided_lines(self) -> int:
+        """int: Number of lines removed or reduced before payment."""
+        return self._voided_lines
+
+    @property
+    def hours(self) -> float:
+        """float: Time worked, including the running shift."""
+        seconds = self._seconds
+        if self._open_since is not None:
+            seconds += (datetime.now() - self._open_since).total_seconds()
+        return seconds / 3600
+
+    @property
+    def carts_per_hour(self) -> float:
+        """float: Paid carts per hour worked."""
+        hours = self.hours
+        return self._carts / hours if hours else 0.0
+
+    @property
+    def items_per_minute(self) -> float:
+        """float: Units sold per minute worked."""
+        hours = self.hours
+        return self._items / (hours * 60) if hours else 0.0
+
+    @property
+    def average_basket(self) -> float:
+        """float: Average amount paid per cart."""
+        return self._revenue / self._carts if self._carts else 0.0
+
+    def to_dict(self) -> dict:
+        """Return the counters and rates.
+
+        Returns:
+            dict: Carts, items, revenue, voids, hours and rates.
+        """
+        return {'carts': self._carts, 'items': self._items, 'revenue': self._revenue,
+                'voided_carts': self._voided_carts, 'voided_lines': self._voided_lines,
+                'hours': self.hours, 'carts_per_hour': self.carts_per_hour,
+                'items_per_minute': self.items_per_minute, 'average_basket': self.average_basket}
+
+
+class Shift(ShiftMetrics):
+    """A cashier's working session at a till."""
+
+    def __init__(self, cashier: 'Cashier', store: 'Store | None', start: datetime):
+        """Initialize an open Shift.
+
+        Args:
+            cashier (Cashier): The cashier working the shift.
+            store (Store | None): The store of the shift.
+            start (datetime): Start of the shift.
+        """
+        super().__init__()
+        self._cashier = cashier
+        self._store = store
+        self._start = start
+        self._end = None
+        self._open(start)
+
+    @property
+    def cashier(self) -> 'Cashier':
+        """Cashier: The cashier working the shift."""
+        return self._cashier
+
+    @property
+    def store(self) -> 'Store | None':
+        """Store | None: The store of the shift."""
+        return self._store
+
+    @property
+    def start(self) -> datetime:
+        """datetime: Start of the shift."""
+        return self._start
+
+    @property
+    def end(self) -> datetime | None:
+        """datetime | None: End of the shift, or None while it is running."""
+        return self._end
+
+    def to_dict(self) -> dict:
+        """Return the shift period, counters and rates.
+
+        Returns:
+            dict: Shift data.
+        """
+        return {'cashier': self._cashier.id, 'store': None if self._store is None else self._store.id,
+                'start': self._start.isoformat(), 'end': None if self._end is None else self._end.isoformat(),
+                **super().to_dict()}
+
+
+class _TopK:
+    """Exact top-k of counters, kept in a bounded dict with a lazy min-heap.
+
+    An item enters a full top-k only by exceeding the smallest kept count, so
+    of items tied at the cut-off the one that reached the count first stays.
+    Growing counts are offered one by one; when a kept count shrinks, the
+    top-k is rebuilt from all counts.
+    """
+
+    __slots__ = ('_k', '_counts', '_heap')
+
+    def __init__(self, k: int):
+        """Initialize an empty _TopK keeping k items."""
+        self._k = k
+        self._counts = {}
+        self._heap = []
+
+    def offer(self, item: int, count: int) -> None:
+        """Report the new count of an item."""
+        counts = self._counts
+        if item in counts or len(counts) < self._k:
+            counts[item] = count
+            heappush(self._heap, (count, item))
+            if len(self._heap) > 4 * self._k:
+                self._heap = [(value, key) for key, value in counts.items()]
+                heapify(self._heap)
+            return
+        heap = self._heap
+        while heap[0][1] not in counts or counts[heap[0][1]] != heap[0][0]:
+            heappop(heap)
+        if count > heap[0][0]:
+            del counts[heappop(heap)[1]]
+            counts[item] = count
+            heappush(heap, (count, item))
+
+    def shrink(self, item: int, counts: dict) -> None:
+        """Report that the count of an item dropped; counts holds the count of every item."""
+        if item not in self._counts:
+            return
+        self._counts = {}
+        self._heap = []
+        for key, count in counts.items():
+            self.offer(key, count)
+
+    def items(self) -> list:
+        """Return (item, count) pairs, highest count first, ties by item."""
+        return sorted(self._counts.items(), key=lambda pair: (-pair[1], pair[0]))
+
+
+class AffinityIndex:
+    """Incrementally maintained product co-occurrence and per-customer favourites.
+
+    Every registered purchase adds one to the pair count of each two distinct
+    products bought together and adds the units bought to the customer's
+    product counts. Top-k lists are maintained alongside the counts, so
+    recommendations are read without walking purchases. Products are keyed
+    by ID, so the index does not keep Product instances alive.
+
+    Each purchase is counted once by ID: registering it again, e.g. after it
+    was rehydrated from the archive, does not count it twice. Removing or
+    amending a registered purchase subtracts its old lines.
+    """
+
+    def __init__(self, k: int = 10):
+        """Initialize an empty AffinityIndex.
+
+        Args:
+            k (int): Length of the top lists.
+
+        Raises:
+            ValueError: If k is not a positive integer.
+        """
+        if not isinstance(k, int) or k <= 0:
+            raise ValueError("k must be a positive integer.")
+        self._k = k
+        self._pairs = {}
+        self._related = {}
+        self._bought = {}
+        self._favourites = {}
+        self._counted = set()
+
+    def __contains__(self, purchase_id: int) -> bool:
+        """Return True if the purchase with this ID is counted."""
+        return purchase_id in self._counted
+
+    def add(self, purchase: 'Purchase') -> None:
+        """Count a purchase unless it is counted already.
+
+        Args:
+            purchase (Purchase): The registered purchase.
+        """
+        if purchase.id in self._counted:
+            return
+        self._counted.add(purchase.id)
+        self._count(purchase.products, purchase.customer._id, 1)
+
+    def remove(self, purchase: 'Purchase', lines: tuple | None = None) -> None:
+        """Stop counting a purchase.
+
+        Args:
+            purchase (Purchase): The counted purchase.
+            lines (tuple | None): Lines the purchase was counted with, defaulting to its current lines.
+        """
+        if purchase.id not in self._counted:
+            return
+        self._counted.discard(purchase.id)
+        self._count(purchase.products if lines is None else lines, purchase.customer._id, -1)
+
+    def _count(self, lines, customer: int | None, sign: int) -> None:
+        """Add (sign 1) or subtract (sign -1) the pairs and units of some purchase lines."""
+        lines = [line for line in lines if line.product_id is not None]
+        products = sorted({line.product_id for line in lines})
+        for position, product in enumerate(products):
+            pairs = self._pairs.setdefault(product, {})
+            related = self._related.get(product)
+            if related is None:
+                related = self._related[product] = _TopK(self._k)
+            for other in products[:position] + products[position + 1:]:
+                self._bump(pairs, related, other, sign)
+        if customer is None:
+            return
+        bought = self._bought.setdefault(customer, {})
+        favourites = self._favourites.get(customer)
+        if favourites is None:
+            favourites = self._favourites[customer] = _TopK(self._k)
+        for line in lines:
+            self._bump(bought, favourites, line.product_id, sign * line.quantity)
+
+    @staticmethod
+    def _bump(counts: dict, top: _TopK, item: int, delta: int) -> None:
+        """Change one count and keep its top-k list up to date."""
+        count = counts.get(item, 0) + delta
+        if delta > 0:
+            counts[item] = count
+            top.offer(item, count)
+            return
+        if count > 0:
+            counts[item] = count
+        else:
+            counts.pop(item, None)
+        top.shrink(item, counts)
+
+    def pair_count(self, product_id: int, other_id: int) -> int:
+        """Return how many purchases contained both products."""
+        return self._pairs.get(product_id, {}).get(other_id, 0)
+
+    def bought_together(self, product_id: int) -> list:
+        """Return (product ID, purchases) pairs most often bought with a product, best first."""
+        related = self._related.get(product_id)
+        return related.items() if related is not None else []
+
+    def usual_items(self, customer_id: int) -> list:
+        """Return (product ID, units) pairs a customer buys most, best first."""
+        favourites = self._favourites.get(customer_id)
+        return favourites.items() if favourites is not None else []
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _hash64(value) -> int:
+    """Return a 64-bit hash of a value that is stable across processes."""
+    if isinstance(value, int):
+        value = (value + 0x9E3779B97F4A7C15) & _MASK64
+        value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return value ^ (value >> 31)
+    from hashlib import blake2b
+
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Approximate distinct counter in 2 ** precision one-byte registers.
+
+    The standard error is about 1.04 / sqrt(2 ** precision), e.g. 1.6% at the
+    default precision of 12 (4 KiB).
+    """
+
+    def __init__(self, precision: int = 12):
+        """Initialize an empty HyperLogLog.
+
+        Args:
+            precision (int): Number of index bits, between 4 and 18.
+
+        Raises:
+            ValueError: If precision is out of range.
+        """
+        if not isinstance(precision, int) or not (4 <= precision <= 18):
+            raise ValueError("Precision must be an integer between 4 and 18.")
+        self._precision = precision
+        self._registers = bytearray(1 << precision)
+
+    def add(self, value) -> None:
+        """Count a value."""
+        hashed = _hash64(value)
+        bits = 64 - self._precision
+        rest = hashed & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        index = hashed >> bits
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def count(self) -> int:
+        """Return the estimated number of distinct values."""
+        size = len(self._registers)
+        estimate = (0.7213 / (1 + 1.079 / size)) * size * size / sum(2.0 ** -rank for rank in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """Add the values counted by another HyperLogLog of the same precision.
+
+        Raises:
+            ValueError: If the precisions differ.
+        """
+        if other._precision != self._precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision.")
+        self._registers = bytearray(map(max, self._registers, other._registers))
+
+
+class CountMinSketch:
+    """Approximate counters in depth rows of width cells, with exact top-k heavy hitters of the estimates.
+
+    Estimates never undercount; they overcount by at most 2/width of the total
+    with probability 1 - 2 ** -depth.
+    """
+
+    def __init__(self, width: int = 1024, depth: int = 4, k: int = 10):
+        """Initialize an empty CountMinSketch.
+
+        Args:
+            width (int): Cells per row.
+            depth (int): Number of rows.
+            k (int): Number of heavy hitters to track.
+
+        Raises:
+            ValueError: If a size is not a positive integer.
+        """
+        for value in (width, depth, k):
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError("Sketch sizes must be positive integers.")
+        self._width = width
+        self._depth = depth
+        self._k = k
+        self._rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+        self._total = 0
+        self._top = _TopK(k)
+
+    @property
+    def total(self) -> int:
+        """int: Sum of all counts."""
+        return self._total
+
+    def _cells(self, item) -> list:
+        """Return the cell index of an item in every row."""
+        hashed = _hash64(item)
+        low, high = hashed & 0xFFFFFFFF, hashed >> 32
+        return [(low + row * high) % self._width for row in range(self._depth)]
+
+    def add(self, item, count: int = 1) -> None:
+        """Add count occurrences of an item."""
+        estimate = None
+        for row, cell in zip(self._rows, self._cells(item)):
+            row[cell] += count
+            estimate = row[cell] if estimate is None else min(estimate, row[cell])
+        self._total += count
+        self._top.offer(item, estimate)
+
+    def estimate(self, item) -> int:
+        """Return the estimated count of an item."""
+        return min(row[cell] for row, cell in zip(self._rows, self._cells(item)))
+
+    def heavy_hitters(self) -> list:
+        """Return (item, estimated count) pairs of the most frequent items, highest first."""
+        return [(item, self.estimate(item)) for item, _ in self._top.items()]
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        """Add the counts of another CountMinSketch of the same dimensions.
+
+        Raises:
+            ValueError: If the dimensions differ.
+        """
+        if (other._width, other._depth) != (self._width, self._depth):
+            raise ValueError("Cannot merge CountMinSketches of different dimensions.")
+        for row, other_row in zip(self._rows, other._rows):
+            for cell, count in enumerate(other_row):
+                if count:
+                    row[cell] += count
+        self._total += other._total
+        candidates = {item for item, _ in self._top.items()} | {item for item, _ in other._top.items()}
+        self._top = _TopK(self._k)
+        for item in sorted(candidates, key=repr):
+            self._top.offer(item, self.estimate(item))
+
+
+class TDigest:
+    """Mergeable quantile sketch of weighted centroids, most precise at the tails.
+
+    Memory is bounded by a few times the compression; quantile errors are
+    typically well below 1% of rank.
+    """
+
+    def __init__(self, compression: int = 100):
+        """Initialize an empty TDigest.
+
+        Args:
+            compression (int): Accuracy/size trade-off; more keeps more centroids.
+
+        Raises:
+            ValueError: If compression is not a positive integer.
+        """
+        if not isinstance(compression, int) or compression <= 0:
+            raise ValueError("Compression must be a positive integer.")
+        self._compression = compression
+        self._centroids = []
+        self._buffer = []
+        self._count = 0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def __len__(self) -> int:
+        """Return the total weight added."""
+        return self._count
+
+    def add(self, value: float, weight: int = 1) -> None:
+        """Add a value."""
+        self._buffer.append((value, weight))
+        self._count += weight
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        if len(self._buffer) > 5 * self._compression:
+            self._compress()
+
+    def _compress(self) -> None:
+        """Merge the buffered values into the centroids."""
+        if not self._buffer:
+            return
+        items = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        merged = []
+        mean, weight = items[0]
+        seen = 0
+        for value, extra in items[1:]:
+            quantile = (seen + (weight + extra) / 2) / self._count
+            if weight + extra <= max(1.0, 4 * self._count * quantile * (1 - quantile) / self._compression):
+                weight += extra
+                mean += (value - mean) * extra / weight
+            else:
+                merged.append((mean, weight))
+                seen += weight
+                mean, weight = value, extra
+        merged.append((mean, weight))
+        self._centroids = merged
+
+    def quantile(self, q: float) -> float | None:
+        """Return the estimated value at quantile q (0 to 1), or None if empty.
+
+        Raises:
+            ValueError: If q is outside [0, 1].
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("Quantile must be between 0 and 1.")
+        self._compress()
+        if not self._centroids:
+            return None
+        target = q * self._count
+        previous_mean, previous_center = self._min, 0.0
+        seen = 0
+        for mean, weight in self._centroids:
+            center = seen + weight / 2
+            if target <= center:
+                if center == previous_center:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_mean, previous_center = mean, center
+            seen += weight
+        if self._count == previous_center:
+            return self._max
+        return previous_mean + (self._max - previous_mean) * (target - previous_center) / (self._count - previous_center)
+
+    def merge(self, other: 'TDigest') -> None:
+        """Add the values summarized by another TDigest."""
+        other._compress()
+        self._buffer.extend(other._centroids)
+        self._count += other._count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        self._compress()
+
+
+class SalesSketch:
+    """Sketches of one period of sales: distinct customers, top products and basket values."""
+
+    def __init__(self, precision: int = 12, width: int = 1024, depth: int = 4, k: int = 10,
+                 compression: int = 100):
+        """Initialize an empty SalesSketch; see HyperLogLog, CountMinSketch and TDigest for the arguments."""
+        self._customers = HyperLogLog(precision)
+        self._products = CountMinSketch(width, depth, k)
+        self._baskets = TDigest(compression)
+        self._purchases = 0
+
+    def add(self, purchase: 'Purchase') -> None:
+        """Count a purchase."""
+        self._purchases += 1
+        if purchase.customer._id is not None:
+            self._customers.add(purchase.customer._id)
+        for line in purchase.products:
+            if line.product_id is not None:
+                self._products.add(line.product_id, line.quantity)
+        self._baskets.add(purchase.total - purchase.used_cashback)
+
+    @property
+    def purchases(self) -> int:
+        """int: Number of purchases counted."""
+        return self._purchases
+
+    def distinct_customers(self) -> int:
+        """Return the estimated number of distinct customers."""
+        return self._customers.count()
+
+    def top_products(self) -> list:
+        """Return (product ID, estimated units) pairs of the best sellers."""
+        return self._products.heavy_hitters()
+
+    def units_sold(self, product_id: int) -> int:
+        """Return the estimated units sold of a product."""
+        return self._products.estimate(product_id)
+
+    def basket_quantile(self, q: float) -> float | None:
+        """Return the estimated amount paid per purchase at quantile q."""
+        return self._baskets.quantile(q)
+
+    def merge(self, other: 'SalesSketch') -> None:
+        """Add the sales summarized by another SalesSketch built with the same settings."""
+        self._customers.merge(other._customers)
+        self._products.merge(other._products)
+        self._baskets.merge(other._baskets)
+        self._purchases += other._purchases
+
+
+class SalesSketches:
+    """Bounded-memory streaming sales statistics, overall and per hour.
+
+    Fed by Database as purchases are registered (see
+    Database.set_sales_sketches). Hourly sketches older than the retention
+    are dropped. Sketches of several stores, databases or shards built with
+    the same settings can be merged.
+    """
+
+    def __init__(self, retention_hours: int = 24, **settings):
+        """Initialize empty SalesSketches.
+
+        Args:
+            retention_hours (int): Number of most recent hours kept.
+            **settings: SalesSketch arguments (precision, width, depth, k, compression).
+
+        Raises:
+            ValueError: If retention_hours is not a positive integer.
+        """
+        if not isinstance(retention_hours, int) or retention_hours <= 0:
+            raise ValueError("retention_hours must be a positive integer.")
+        self._retention = retention_hours
+        self._settings = settings
+        self._total = SalesSketch(**settings)
+        self._hourly = {}
+
+    @property
+    def total(self) -> SalesSketch:
+        """SalesSketch: Sales since the sketches were created."""
+        return self._total
+
+    @property
+    def hours(self) -> list:
+        """list: Start of every kept hour, oldest first."""
+        return sorted(self._hourly)
+
+    def hour(self, when: datetime) -> SalesSketch | None:
+        """Return the sketch of the hour containing a point in time, or None."""
+        return self._hourly.get(when.replace(minute=0, second=0, microsecond=0))
+
+    def _bucket(self, hour: datetime) -> SalesSketch | None:
+        """Return the sketch of an hour, creating it and dropping expired hours; None if the hour is expired."""
+        sketch = self._hourly.get(hour)
+        if sketch is None:
+            if len(self._hourly) >= self._retention and hour < min(self._hourly):
+                return None
+            sketch = self._hourly[hour] = SalesSketch(**self._settings)
+            while len(self._hourly) > self._retention:
+                del self._hourly[min(self._hourly)]
+        return sketch
+
+    def add(self, purchase: 'Purchase') -> None:
+        """Count a purchase overall and in its hour."""
+        self._total.add(purchase)
+        sketch = self._bucket(purchase.purchase_date.replace(minute=0, second=0, microsecond=0))
+        if sketch is not None:
+            sketch.add(purchase)
+
+    def merge(self, other: 'SalesSketches') -> None:
+        """Add the sales summarized by other SalesSketches built with the same settings."""
+        self._total.merge(other._total)
+        for hour, sketch in sorted(other._hourly.items()):
+            bucket = self._bucket(hour)
+            if bucket is not None:
+                bucket.merge(sketch)
+
+
+class CashbackRules:
+    """Tiered cashback rules with category/product multipliers and time-boxed promotions.
+
+    Promotions are compiled into per-product and per-category bonus tables
+    that stay valid until the next promotion starts or ends, so evaluating a
+    cart costs a dictionary lookup per line regardless of how many
+    promotions are defined.
+
+    The cashback rate of a line, in percent, is
+    base * multiplier + product bonus + category bonus, where base is the
+    percent of the highest tier reached by the customer's lifetime spend (or
+    the customer's own percent below the first tier) and multiplier is the
+    product multiplier, else the category multiplier, else 1. Lifetime spend
+    includes the purchase being rewarded, so the purchase that crosses a
+    threshold already earns the higher tier.
+    """
+
+    def __init__(self):
+        """Initialize CashbackRules without tiers, multipliers or promotions."""
+        self._thresholds = []
+        self._percents = []
+        self._product_multipliers = {}
+        self._category_multipliers = {}
+        self._promotions = []
+        self._boundaries = []
+        self._product_bonus = {}
+        self._category_bonus = {}
+        self._valid_from = None
+        self._valid_until = None
+
+    def add_tier(self, threshold: int, percent: int) -> None:
+        """Add a tier: customers whose lifetime spend reaches threshold earn percent.
+
+        Args:
+            threshold (int): Lifetime spend needed for the tier.
+            percent (int): Base cashback percent of the tier.
+
+        Raises:
+            ValueError: If threshold is negative or percent is not between 0 and 100.
+        """
+        if not isinstance(threshold, int) or threshold < 0:
+            raise ValueError("Threshold must be a non-negative integer.")
+        if not isinstance(percent, int) or not (0 <= percent <= 100):
+            raise ValueError("Percent must be an integer between 0 and 100.")
+        position = bisect_left(self._thresholds, threshold)
+        if position < len(self._thresholds) and self._thresholds[position] == threshold:
+            self._percents[position] = percent
+        else:
+            self._thresholds.insert(position, threshold)
+            self._percents.insert(position, percent)
+
+    def set_multiplier(self, target: 'Product | Category', multiplier: float) -> None:
+        """Multiply the base percent for a product or for every product of a category.
+
+        Args:
+            target (Product | Category): The product or category.
+            multiplier (float): Non-negative multiplier.
+
+        Raises:
+            TypeError: If target is not a Product or Category instance.
+            ValueError: If multiplier is negative.
+        """
+        if not isinstance(multiplier, int | float) or multiplier < 0:
+            raise ValueError("Multiplier must be a non-negative number.")
+        if isinstance(target, Product):
+            self._product_multipliers[target] = multiplier
+        elif isinstance(target, Category):
+            self._category_multipliers[target] = multiplier
+        else:
+            raise TypeError(f"Expected Product or Category instance, got {type(target).__name__}")
+
+    def add_promotion(self, bonus: float, start: datetime, end: datetime, products=(), categories=()) -> None:
+        """Add bonus percent points for some products and categories between start and end.
+
+        Args:
+            bonus (float): Extra cashback percent points.
+            start (datetime): Start of the promotion, inclusive.
+            end (datetime): End of the promotion, exclusive.
+            products (Iterable[Product]): Products the promotion applies to.
+            categories (Iterable[Category]): Categories the promotion applies to.
+
+        Raises:
+            ValueError: If bonus is negative or end is not after start.
+        """
+        if not isinstance(bonus, int | float) or bonus < 0:
+            raise ValueError("Bonus must be a non-negative number.")
+        if not (isinstance(start, datetime) and isinstance(end, datetime) and start < end):
+            raise ValueError("Promotion end must be after its start.")
+        self._promotions.append((bonus, start, end, tuple(products), tuple(categories)))
+        insort(self._boundaries, start)
+        insort(self._boundaries, end)
+        self._valid_from = self._valid_until = None
+
+    def _compile(self, when: datetime) -> None:
+        """Build the bonus tables of the promotions active at a point in time."""
+        product_bonus = {}
+        category_bonus = {}
+        for bonus, start, end, products, categories in self._promotions:
+            if start <= when < end:
+                for product in products:
+                    product_bonus[product] = product_bonus.get(product, 0) + bonus
+                for category in categories:
+                    category_bonus[category] = category_bonus.get(category, 0) + bonus
+        self._product_bonus = product_bonus
+        self._category_bonus = category_bonus
+        position = bisect_right(self._boundaries, when)
+        self._valid_from = self._boundaries[position - 1] if position else datetime.min
+        self._valid_until = self._boundaries[position] if position < len(self._boundaries) else datetime.max
+
+    def base_percent(self, customer: 'Customer', spent: int | None = None) -> int:
+        """Return the base cashback percent of a customer.
+
+        Args:
+            customer (Customer): The customer.
+            spent (int | None): Lifetime spend to rate, defaulting to the customer's current spend.
+
+        Returns:
+            int: Percent of the highest tier reached, or the customer's own percent.
+        """
+        position = bisect_right(self._thresholds, customer.spent if spent is None else spent)
+        return self._percents[position - 1] if position else customer.percent
+
+    def evaluate(self, customer: 'Customer', products, paid: int, when: datetime | None = None,
+                 prices: dict | None = None, spent: int | None = None) -> int:
+        """Return the cashback earned on a cart.
+
+        Line cashback is computed on the prices charged and scaled to the
+        amount actually paid, so cashback spent on the cart earns nothing.
+
+        Args:
+            customer (Customer): The paying customer.
+            products (Iterable[Product]): Products of the cart, one entry per unit.
+            paid (int): Amount paid for the cart.
+            when (datetime | None): Time of the purchase, defaulting to now.
+            prices (dict | None): Unit price charged per Product; defaults to the current prices.
+            spent (int | None): Lifetime spend including this cart, defaulting to the
+                customer's current spend plus paid.
+
+        Returns:
+            int: Cashback to accrue.
+        """
+        when = when or datetime.now()
+        if self._valid_from is None or not (self._valid_from <= when < self._valid_until):
+            self._compile(when)
+        base = self.base_percent(customer, customer.spent + paid if spent is None else spent)
+        product_multipliers = self._product_multipliers
+        category_multipliers = self._category_multipliers
+        product_bonus = self._product_bonus
+        category_bonus = self._category_bonus
+        prices = prices or {}
+        subtotal = 0
+        earned = 0
+        for product in products:
+            category = product.category
+            multiplier = product_multipliers.get(product)
+            if multiplier is None:
+                multiplier = category_multipliers.get(category, 1)
+            rate = base * multiplier + product_bonus.get(product, 0) + category_bonus.get(category, 0)
+            price = prices.get(product, product.price)
+            subtotal += price
+            earned += price * rate
+        if subtotal <= 0 or paid <= 0:
+            return 0
+        return int(earned * min(paid, subtotal) / subtotal // 100)
+
+
+class Deal:
+    """Multi-buy or bundle deal: a set of items sold together for a fixed price."""
+
+    __slots__ = ('_items', '_price')
+
+    def __init__(self, items: dict, price: int):
+        """Initialize a Deal.
+
+        Args:
+            items (dict): Quantity of each Product needed for one deal.
+            price (int): Price of one deal.
+
+        Raises:
+            TypeError: If a key of items is not a Product instance.
+            ValueError: If a quantity is not positive or price is negative.
+        """
+        if not items:
+            raise ValueError("A deal needs at least one product.")
+        for product, quantity in items.items():
+            if not isinstance(product, Product):
+                raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+            if not isinstance(quantity, int) or quantity <= 0:
+                raise ValueError("Deal quantities must be positive integers.")
+        if not isinstance(price, int) or price < 0:
+            raise ValueError("Deal price must be a non-negative integer.")
+        self._items = tuple(items.items())
+        self._price = price
+
+    @property
+    def items(self) -> tuple:
+        """tuple: (product, quantity) pairs of one deal."""
+        return self._items
+
+    @property
+    def price(self) -> int:
+        """int: Price of one deal."""
+        return self._price
+
+    def saving(self, prices: dict) -> int:
+        """Return how much one deal saves over the unit prices; 0 if it does not save anything.
+
+        Args:
+            prices (dict): Unit price of each product in the cart.
+
+        Returns:
+            int: Saving of one deal.
+        """
+        regular = sum(prices[product] * quantity for product, quantity in self._items)
+        return max(0, regular - self._price)
+
+    def discount(self, lines: dict, prices: dict) -> int:
+        """Return the discount of the deal on a cart, ignoring other deals.
+
+        Args:
+            lines (dict): Quantity of each product in the cart.
+            prices (dict): Unit price of each product in the cart.
+
+        Returns:
+            int: How much the deals that fit in the cart save over the unit prices.
+        """
+        times = min(lines.get(product, 0) // quantity for product, quantity in self._items)
+        if not times:
+            return 0
+        return times * self.saving(prices)
+
+    @staticmethod
+    def allocate(deals, lines: dict, prices: dict) -> dict:
+        """Share the units of a cart between deals so that no unit is discounted twice.
+
+        Deals saving the most per unit are filled first; each takes as many
+        whole deals as the units left over by the better ones allow.
+
+        Args:
+            deals (Iterable[Deal]): Deals that may share products.
+            lines (dict): Quantity of each product in the cart.
+            prices (dict): Unit price of each product in the cart.
+
+        Returns:
+            dict: Discount of each deal.
+        """
+        discounts = {}
+        ranked = []
+        for deal in deals:
+            discounts[deal] = 0
+            if all(lines.get(product, 0) >= quantity for product, quantity in deal._items):
+                units = sum(quantity for _, quantity in deal._items)
+                ranked.append((-deal.saving(prices) / units, len(ranked), deal))
+        remaining = dict(lines)
+        for _, _, deal in sorted(ranked):
+            saving = deal.saving(prices)
+            times = min(remaining[product] // quantity for product, quantity in deal._items)
+            if not saving or not times:
+                continue
+            for product, quantity in deal._items:
+                remaining[product] -= times * quantity
+            discounts[deal] = times * saving
+        return discounts
+
+
+class PriceBook:
+    """Scheduled price lists and promotions with precomputed effective prices.
+
+    Price lists replace the base price of products, percent-off promotions
+    discount the unit price of products or whole categories, and deals
+    (multi-buy, bundle) discount combinations of items in a cart. Each can be
+    limited to some stores and to a time window.
+
+    The schedule is compiled into per-store lookup tables that stay valid
+    until the next price list or promotion starts or ends; effective unit
+    prices are cached per store and product until then, or until the base
+    price of the product changes.
+
+    Overlapping price lists: the last added wins, and store-specific entries
+    win over chain-wide ones. Overlapping percent-off promotions do not stack;
+    the product promotion wins over the category one. Overlapping deals do
+    not share units: each unit counts toward the deal saving the most per unit.
+    """
+
+    def __init__(self):
+        """Initialize an empty PriceBook."""
+        self._entries = []
+        self._boundaries = []
+        self._tables = {}
+        self._effective = {}
+        self._valid_from = None
+        self._valid_until = None
+
+    def _schedule(self, kind: str, payload, start: datetime, end: datetime | None, stores) -> None:
+        """Add an entry to the schedule and invalidate the compiled tables."""
+        end = datetime.max if end is None else end
+        if not (isinstance(start, datetime) and isinstance(end, datetime) and start < end):
+            raise ValueError("End must be after start.")
+        stores = tuple(stores)
+        for store in stores:
+            if not isinstance(store, Store):
+                raise TypeError(f"Expected Store instance, got {type(store).__name__}")
+        self._entries.append((kind, payload, start, end, stores))
+        insort(self._boundaries, start)
+        insort(self._boundaries, end)
+        self._valid_from = self._valid_until = None
+
+    def add_price_list(self, prices: dict, start: datetime, end: datetime | None = None, stores=()) -> None:
+        """Replace the base price of products from start until end.
+
+        Args:
+            prices (dict): New price of each Product.
+            start (datetime): Start of the price list, inclusive.
+            end (datetime | None): End of the price list, exclusive; None means open-ended.
+            stores (Iterable[Store]): Stores the price list applies to; empty means every store.
+
+        Raises:
+            TypeError: If a key of prices is not a Product instance.
+            ValueError: If a price is negative or end is not after start.
+        """
+        for product, price in prices.items():
+            if not isinstance(product, Product):
+                raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+            if not isinstance(price, int) or price < 0:
+                raise ValueError("Price must be a non-negative integer.")
+        self._schedule("prices", dict(prices), start, end, stores)
+
+    def add_percent_off(self, percent: int, start: datetime, end: datetime, products=(), categories=(),
+                        stores=()) -> None:
+        """Discount the unit price of products and categories by a percentage.
+
+        Args:
+            percent (int): Discount in percent.
+            start (datetime): Start of the promotion, inclusive.
+            end (datetime): End of the promotion, exclusive.
+            products (Iterable[Product]): Discounted products.
+            categories (Iterable[Category]): Categories whose products are discounted.
+            stores (Iterable[Store]): Stores the promotion applies to; empty means every store.
+
+        Raises:
+            ValueError: If percent is not between 0 and 100 or end is not after start.
+        """
+        if not isinstance(percent, int) or not (0 <= percent <= 100):
+            raise ValueError("Percent must be an integer between 0 and 100.")
+        self._schedule("percent", (percent, tuple(products), tuple(categories)), start, end, stores)
+
+    def add_multi_buy(self, product: 'Product', quantity: int, price: int, start: datetime, end: datetime,
+                      stores=()) -> Deal:
+        """Sell quantity units of a product for price, e.g. 3 for the price of 2.
+
+        Returns:
+            Deal: The scheduled deal.
+        """
+        deal = Deal({product: quantity}, price)
+        self._schedule("deal", deal, start, end, stores)
+        return deal
+
+    def add_bundle(self, products, price: int, start: datetime, end: datetime, stores=()) -> Deal:
+        """Sell a combination of products together for price.
+
+        Args:
+            products (Iterable[Product]): Products of the bundle; repeat a product to require several units.
+
+        Returns:
+            Deal: The scheduled deal.
+        """
+        deal = Deal(Counter(products), price)
+        self._schedule("deal", deal, start, end, stores)
+        return deal
+
+    def _compile(self, when: datetime) -> None:
+        """Build the per-store tables of the entries active at a point in time."""
+        scoped = {None: ({}, {}, {})}
+        for kind, payload, start, end, stores in self._entries:
+            if not (start <= when < end):
+                continue
+            for store in stores or (None,):
+                prices, percents, deals = scoped.setdefault(store, ({}, {}, {}))
+                if kind == "prices":
+                    prices.update(payload)
+                elif kind == "percent":
+                    percent, products, categories = payload
+                    for target in products + categories:
+                        percents[target] = max(percents.get(target, 0), percent)
+                else:
+                    for product, _ in payload.items:
+                        deals.setdefault(product, []).append(payload)
+        common = scoped.pop(None)
+        tables = {None: common}
+        for store, (prices, percents, deals) in scoped.items():
+            merged = {product: list(found) for product, found in common[2].items()}
+            for product, found in deals.items():
+                merged.setdefault(product, []).extend(found)
+            tables[store] = ({**common[0], **prices}, {**common[1], **percents}, merged)
+        self._tables = tables
+        self._effective = {}
+        position = bisect_right(self._boundaries, when)
+        self._valid_from = self._boundaries[position - 1] if position else datetime.min
+        self._valid_until = self._boundaries[position] if position < len(self._boundaries) else datetime.max
+
+    def _table(self, store: 'Store | None', when: datetime | None) -> tuple:
+        """Return the compiled table of a store, recompiling when a boundary has passed."""
+        when = when or datetime.now()
+        if self._valid_from is None or not (self._valid_from <= when < self._valid_until):
+            self._compile(when)
+        return self._tables.get(store) or self._tables[None]
+
+    def refresh(self, when: datetime | None = None) -> None:
+        """Precompute the tables for a point in time, e.g. right when a promotion starts.
+
+        Args:
+            when (datetime | None): Point in time, defaulting to now.
+        """
+        self._compile(when or datetime.now())
+
+    def price(self, product: 'Product', store: 'Store | None' = None, when: datetime | None = None) -> int:
+        """Return the effective unit price of a product.
+
+        Args:
+            product (Product): The product.
+            store (Store | None): Store selling the product; None uses chain-wide entries only.
+            when (datetime | None): Point in time, defaulting to now.
+
+        Returns:
+            int: Price after price lists and percent-off promotions.
+        """
+        prices, percents, _ = self._table(store, when)
+        base = product.price
+        cached = self._effective.get((store, product))
+        if cached is not None and cached[0] == base:
+            return cached[1]
+        percent = percents.get(product)
+        if percent is None:
+            percent = percents.get(product.category, 0)
+        effective = prices.get(product, base) * (100 - percent) // 100
+        self._effective[(store, product)] = (base, effective)
+        return effective
+
+    def deals(self, product: 'Product', store: 'Store | None' = None, when: datetime | None = None) -> tuple:
+        """Return the deals that involve a product.
+
+        Args:
+            product (Product): The product.
+            store (Store | None): Store selling the product.
+            when (datetime | None): Point in time, defaulting to now.
+
+        Returns:
+            tuple: Active Deal instances including the product.
+        """
+        return tuple(self._table(store, when)[2].get(product, ()))
+
+
+def _label(value) -> str:
+    """Return a short label of a query value for explain() output."""
+    if hasattr(value, "_id") and not isinstance(value, type):
+        return f"{type(value).__name__}#{value._id}"
+    return repr(value)
+
+
+class Query:
+    """Declarative query over one Database collection with an index-aware planner.
+
+    Conditions, ordering, limit, grouping and aggregates are collected by
+    chained calls, each returning a new Query. When the query runs, the
+    planner picks the cheapest available access path (ID, SKU or phone
+    lookup, the purchase date index, or the name/price/quantity indexes of a
+    category or store the query is restricted to) and falls back to a scan
+    of the collection. explain() describes the chosen plan.
+
+    Archived purchases are not queried; only resident ones are.
+    """
+
+    COLLECTIONS = ("stores", "categories", "products", "cashiers", "customers", "purchases")
+    OPERATORS = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+        "prefix": lambda a, b: a is not None and _normalize(a).startswith(_normalize(b)),
+        "contains": lambda a, b: a is not None and _normalize(b) in _normalize(a),
+    }
+    AGGREGATES = {
+        "count": len,
+        "sum": sum,
+        "min": min,
+        "max": max,
+        "avg": lambda values: sum(values) / len(values),
+    }
+
+    def __init__(self, database: 'Database', collection: str):
+        """Initialize a Query over a collection.
+
+        Args:
+            database (Database): The database to query.
+            collection (str): One of "stores", "categories", "products", "cashiers", "customers", "purchases".
+
+        Raises:
+            ValueError: If collection is unknown.
+        """
+        if collection not in self.COLLECTIONS:
+            raise ValueError(f"Unknown collection {collection!r}.")
+        self._database = database
+        self._collection = collection
+        self._conditions = ()
+        self._order = None
+        self._limit = None
+        self._group = None
+        self._aggregates = {}
+
+    def _copy(self, **changes) -> 'Query':
+        """Return a copy of the query with some attributes replaced."""
+        query = object.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        for name, value in changes.items():
+            setattr(query, f"_{name}", value)
+        return query
+
+    def where(self, field: str, op: str, value) -> 'Query':
+        """Keep entities whose field satisfies a condition.
+
+        Args:
+            field (str): Entity attribute, e.g. "price" or "purchase_date".
+            op (str): One of "==", "!=", "<", "<=", ">", ">=", "in", "prefix", "contains".
+            value (Any): Value to compare with.
+
+        Returns:
+            Query: The narrowed query.
+
+        Raises:
+            ValueError: If op is unknown.
+        """
+        if op not in self.OPERATORS:
+            raise ValueError(f"Unknown operator {op!r}.")
+        return self._copy(conditions=self._conditions + ((field, op, value),))
+
+    def between(self, field: str, low, high) -> 'Query':
+        """Keep entities whose field lies between low and high, inclusive; None leaves a side open."""
+        query = self
+        if low is not None:
+            query = query.where(field, ">=", low)
+        if high is not None:
+            query = query.where(field, "<=", high)
+        return query
+
+    def order_by(self, field: str, descending: bool = False) -> 'Query':
+        """Sort the entities by a field."""
+        return self._copy(order=(field, descending))
+
+    def limit(self, count: int) -> 'Query':
+        """Return at most count entities.
+
+        Raises:
+            ValueError: If count is negative.
+        """
+        if not isinstance(count, int) or count < 0:
+            raise ValueError("Limit must be a non-negative integer.")
+        return self._copy(limit=count)
+
+    def group_by(self, field: str) -> 'Query':
+        """Group the entities by a field; results become a dict keyed by the field value."""
+        return self._copy(group=field)
+
+    def aggregate(self, **aggregates) -> 'Query':
+        """Compute aggregates, e.g. aggregate(revenue=("sum", "total"), purchases=("count", None)).
+
+        Raises:
+            ValueError: If an aggregate function is unknown.
+        """
+        for function, _ in aggregates.values():
+            if function not in self.AGGREGATES:
+                raise ValueError(f"Unknown aggregate {function!r}.")
+        return self._copy(aggregates={**self._aggregates, **aggregates})
+
+    def _bounds(self, field: str) -> tuple | None:
+        """Return inclusive (low, high) bounds of a field from the range conditions, or None."""
+        low = high = None
+        found = False
+        for name, op, value in self._conditions:
+            if name != field:
+                continue
+            if op in (">", ">="):
+                low, found = value if low is None else max(low, value), True
+            elif op in ("<", "<="):
+                high, found = value if high is None else min(high, value), True
+            elif op == "==":
+                low, high, found = value, value, True
+        return (low, high) if found else None
+
+    def _plan(self) -> tuple:
+        """Pick an access path: (description, source callable, field the source is ordered by)."""
+        database = self._database
+        collection = self._collection
+        equal = {}
+        text = {}
+        for field, op, value in self._conditions:
+            if op == "==":
+                equal.setdefault(field, value)
+            elif op in ("prefix", "contains"):
+                text.setdefault(field, (op, value))
+        if "id" in equal:
+            entity = database._find_by_id(collection, equal["id"])
+            return f"index {collection}.id == {equal['id']!r}", lambda: [entity] if entity else [], None
+        if collection == "products" and "sku" in equal:
+            product = database._skus.get(equal["sku"])
+            return f"index products.sku == {equal['sku']!r}", lambda: [product] if product else [], None
+        if collection == "customers" and "phone" in equal:
+            customers = database._phones.get(equal["phone"], {})
+            return f"index customers.phone == {equal['phone']!r}", lambda: list(customers), None
+        if collection == "purchases" and (bounds := self._bounds("purchase_date")):
+            return (f"index purchases.purchase_date range [{bounds[0]}, {bounds[1]}]",
+                    lambda: database._purchase_dates.range(*bounds), "purchase_date")
+        if collection == "purchases" and isinstance(equal.get("customer"), Customer):
+            customer = equal["customer"]
+            return (f"index {_label(customer)}.purchases",
+                    lambda: [purchase for purchase in customer._purchases if isinstance(purchase, Purchase)],
+                    None)
+        if collection == "products":
+            containers = [equal[field] for field in ("category", "store")
+                          if isinstance(equal.get(field), Category | Store)]
+            if containers:
+                container = min(containers, key=lambda container: len(container._products))
+                label = _label(container)
+                if bounds := self._bounds("price"):
+                    return (f"index {label}.price range [{bounds[0]}, {bounds[1]}]",
+                            lambda: container._price_index.range(*bounds), "price")
+                if bounds := self._bounds("quantity"):
+                    return (f"index {label}.quantity range [{bounds[0]}, {bounds[1]}]",
+                            lambda: container._quantity_index.range(*bounds), "quantity")
+                if "name" in equal or "name" in text:
+                    op, value = ("prefix", equal["name"]) if "name" in equal else text["name"]
+                    search = container._name_index.prefix if op == "prefix" else container._name_index.substring
+                    return f"index {label}.name {op} {value!r}", lambda: search(value), None
+                return f"scan {label}.products", lambda: list(container._products), None
+        return f"scan {collection}", lambda: list(getattr(database, f"_{collection}")), None
+
+    def _filter(self):
+        """Return the access path description, the filtered entities and the field they are ordered by."""
+        description, source, ordered = self._plan()
+        conditions = [(field, self.OPERATORS[op], value) for field, op, value in self._conditions]
+        rows = (entity for entity in source()
+                if all(test(getattr(entity, field), value) for field, test, value in conditions))
+        return description, rows, ordered
+
+    def explain(self) -> str:
+        """Describe how the query would run.
+
+        Returns:
+            str: One line per step: access path, filter, sort, limit, grouping.
+        """
+        description, _, ordered = self._plan()
+        steps = [f"{self._collection}", f"  access: {description}"]
+        if self._conditions:
+            steps.append("  filter: " + ", ".join(f"{field} {op} {_label(value)}"
+                                                   for field, op, value in self._conditions))
+        if self._group is not None or self._aggregates:
+            if self._group is not None:
+                steps.append(f"  group: by {self._group}")
+            if self._aggregates:
+                steps.append("  aggregate: " + ", ".join(f"{name}={function}({field or '*'})"
+                                                         for name, (function, field) in self._aggregates.items()))
+            return "\n".join(steps)
+        if self._order is not None:
+            field, descending = self._order
+            if field == ordered and not descending:
+                steps.append(f"  sort: {field} (index order)")
+            else:
+                steps.append(f"  sort: {field}{' desc' if descending else ''}")
+        if self._limit is not None:
+            steps.append(f"  limit: {self._limit}")
+        return "\n".join(steps)
+
+    def _summarize(self, entities: list) -> dict | int:
+        """Compute the aggregates of some entities."""
+        if not self._aggregates:
+            return entities
+        summary = {}
+        for name, (function, field) in self._aggregates.items():
+            values = entities if function == "count" else [getattr(entity, field) for entity in entities]
+            summary[name] = self.AGGREGATES[function](values) if values or function in ("count", "sum") else None
+        return summary
+
+    def all(self) -> list | dict:
+        """Run the query.
+
+        Returns:
+            list | dict: Matching entities; with group_by a dict of group value to entities
+                (or to aggregates); with aggregate only, a dict of aggregates.
+        """
+        _, rows, ordered = self._filter()
+        if self._group is not None:
+            groups = {}
+            for entity in rows:
+                groups.setdefault(getattr(entity, self._group), []).append(entity)
+            return {key: self._summarize(entities) for key, entities in groups.items()}
+        if self._aggregates:
+            return self._summarize(list(rows))
+        if self._order is not None:
+            field, descending = self._order
+            if field != ordered or descending:
+                rows = sorted(rows, key=lambda entity: (getattr(entity, field) is None, getattr(entity, field)),
+                              reverse=descending)
+        if self._limit is not None:
+            rows = islice(rows, self._limit)
+        return list(rows)
+
+    def __iter__(self):
+        """Iterate over the matching entities."""
+        return iter(self.all())
+
+    def first(self):
+        """Return the first matching entity, or False."""
+        found = self.limit(1).all()
+        return found[0] if found else False
+
+    def count(self) -> int:
+        """Return the number of matching entities."""
+        return sum(1 for _ in self._filter()[1])
+
+
+class Database:
+    """Represents a centralized system to manage all entities related to a retail environment.
+
+    Stores references to stores, categories, products, cashiers, customers, and purchases.
+    Provides methods to add, remove, and query these entities.
+    """
+
+    def __init__(self, name: str):
+        """Initialize a new Database instance.
+
+        Args:
+            name (str): The name of the database.
+        """
+        self._name = name
+        self._stores = {}
+        self._categories = {}
+        self._products = {}
+        self._skus = {}
+        self._cashiers = {}
+        self._customers = {}
+        self._purchases = {}
+        self._phones = {}
+        self._purchase_dates = SortedIndex("purchase_date")
+        self._ids = {collection: {} for collection in
+                     ("stores", "categories", "products", "cashiers", "customers", "purchases")}
+        self._last_ids = dict.fromkeys(self._ids, 0)
+        self._archived_stores = {}
+        self._archived_categories = {}
+        self._archived_products = {}
+        self._stock_events = StockEventBus()
+        self._stock_ledger = StockLedger(self)
+        self._inventory = None
+        self._batch_cashback = False
+        self._pending_cashback = []
+        self._cashback_rules = None
+        self._price_book = None
+        self._purchase_archive = None
+        self._receipt_renderer = ReceiptRenderer()
+        self._affinity = None
+        self._sketches = None
+        self._catalog = None
+        self._interned_lines = {}
+
+    def _check_id(self, collection: str, entity) -> None:
+        """Raise ValueError if the entity ID is taken by another entity of the collection.
+
+        Args:
+            collection (str): Collection name, e.g. "stores".
+            entity (Any): The entity about to be attached.
+        """
+        if entity._id is not None and self._ids[collection].get(entity._id, entity) is not entity:
+            raise ValueError(f"ID {entity._id} is already used in {collection}.")
+        if collection == "purchases" and self._purchase_archive is not None and entity._id in self._purchase_archive:
+            raise ValueError(f"ID {entity._id} is already used by an archived purchase.")
+
+    def _attach(self, collection: str, entity) -> None:
+        """Add an entity to a collection, assigning it the next free ID if it has none.
+
+        Args:
+            collection (str): Collection name, e.g. "stores".
+            entity (Any): The entity to add.
+        """
+        if entity._id is None:
+            entity._id = self._last_ids[collection] + 1
+        self._last_ids[collection] = max(self._last_ids[collection], entity._id)
+        self._ids[collection][entity._id] = entity
+        getattr(self, f"_{collection}")[entity] = None
+
+    def _detach(self, collection: str, entity) -> None:
+        """Remove an entity from a collection; the entity keeps its ID.
+
+        Args:
+            collection (str): Collection name, e.g. "stores".
+            entity (Any): The entity to remove.
+        """
+        del getattr(self, f"_{collection}")[entity]
+        del self._ids[collection][entity._id]
+
+    def _detach_store(self, store: 'Store') -> None:
+        """Remove a store from the stores collection and the stock ledger; the store keeps its ID."""
+        self._stock_ledger.remove_store(store)
+        self._detach("stores", store)
+
+    def _find_by_id(self, collection: str, entity_id: int):
+        """Return the entity of a collection with the given ID, or False."""
+        return self._ids[collection].get(entity_id, False)
+
+    def _intern_lines(self, lines: tuple) -> tuple:
+        """Return lines with equal lines shared by the registered purchases, counting every use."""
+        interned = []
+        for line in lines:
+            entry = self._interned_lines.get(line)
+            if entry is None:
+                entry = self._interned_lines[line] = [line, 0]
+            entry[1] += 1
+            interned.append(entry[0])
+        return tuple(interned)
+
+    def _release_lines(self, lines: tuple) -> None:
+        """Drop one use of each line, forgetting lines no registered purchase holds any more."""
+        for line in lines:
+            entry = self._interned_lines[line]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._interned_lines[line]
+
+    def _load_catalog(self, collection: str | None = None, key: str | None = None, value=None) -> None:
+        """Load deferred stores from the lazy catalog the database was opened from, if any.
+
+        Args:
+            collection (str | None): "categories" or "products" to load only the stores holding
+                the entity whose key equals value; None loads every deferred store.
+            key (str | None): "id" or "sku".
+            value (Any): Value of the key.
+        """
+        if self._catalog is None:
+            return
+        if collection is None:
+            self._catalog.load_all()
+        else:
+            self._catalog._load_holding(collection, key, value)
+
+    def _index_phone(self, customer: 'Customer', phone: int | None = None) -> None:
+        """Add a customer to the phone index, removing it from its old phone first if given."""
+        if phone is not None:
+            customers = self._phones[phone]
+            del customers[customer]
+            if not customers:
+                del self._phones[phone]
+        self._phones.setdefault(customer.phone, {})[customer] = None
+
+    def _unindex_phone(self, customer: 'Customer') -> None:
+        """Remove a customer from the phone index."""
+        customers = self._phones[customer.phone]
+        del customers[customer]
+        if not customers:
+            del self._phones[customer.phone]
+
+    def to_columns(self, tables=("purchases", "lines", "products", "customers"),
+                   numpy: bool | None = None, purchases=None) -> dict:
+        """Export collections as columns for analytics, without building per-row dicts.
+
+        Numeric columns are compact arrays (missing IDs are -1, purchase dates
+        are POSIX timestamps) and text columns are lists. With NumPy the
+        numeric arrays are wrapped without copying and text columns become
+        object arrays, ready for pandas.DataFrame(columns). Line items join
+        purchases on purchase_id and products on product_id; the lines of a
+        purchase are contiguous, in purchase order, and counted by the
+        purchases line_count column. Archived purchases are exported only when
+        passed in purchases, e.g. rebuilt with find_purchase_by_id.
+
+        Args:
+            tables (Iterable[str]): Any of "purchases", "lines", "products" and "customers".
+            numpy (bool | None): Return NumPy arrays; None uses NumPy when it is installed.
+            purchases (Iterable[Purchase] | None): Purchases to export to the purchases and
+                lines tables, in order; None exports the registered purchases.
+
+        Returns:
+            dict: Table name to a dict of column name to column.
+
+        Raises:
+            ValueError: If a table is unknown.
+            ImportError: If numpy is True and NumPy is not installed.
+        """
+        def ids(entities):
+            return array('q', [-1 if entity is None or entity._id is None else entity._id for entity in entities])
+
+        selected = list(self._purchases if purchases is None else purchases)
+        result = {}
+        for table in tables:
+            if table == "purchases":
+                purchases = selected
+                result[table] = {
+                    'id': ids(purchases),
+                    'store_id': ids([purchase._store for purchase in purchases]),
+                    'cashier_id': ids([purchase._cashier for purchase in purchases]),
+                    'customer_id': ids([purchase._customer for purchase in purchases]),
+                    'purchase_date': array('d', [purchase._purchase_date.timestamp() for purchase in purchases]),
+                    'total': array('q', [purchase._total for purchase in purchases]),
+                    'discount': array('q', [purchase._discount for purchase in purchases]),
+                    'used_cashback': array('q', [purchase._used_cashback for purchase in purchases]),
+                    'line_count': array('q', [len(purchase._lines) for purchase in purchases]),
+                }
+            elif table == "lines":
+                purchase_ids = []
+                lines = []
+                for purchase in selected:
+                    purchase_ids.extend([purchase._id] * len(purchase._lines))
+                    lines.extend(purchase._lines)
+                result[table] = {
+                    'purchase_id': array('q', purchase_ids),
+                    'product_id': array('q', [-1 if line.product_id is None else line.product_id for line in lines]),
+                    'unit_price': array('q', [line.unit_price for line in lines]),
+                    'quantity': array('q', [line.quantity for line in lines]),
+                }
+            elif table == "products":
+                self._load_catalog()
+                products = list(self._products)
+                result[table] = {
+                    'id': ids(products),
+                    'store_id': ids([product._store for product in products]),
+                    'category_id': ids([product._category for product in products]),
+                    'price': array('q', [product._price for product in products]),
+                    'quantity': array('q', [product.quantity for product in products]),
+                    'sku': [product._sku for product in products],
+                    'name': [product._name for product in products],
+                }
+            elif table == "customers":
+                customers = list(self._customers)
+                result[table] = {
+                    'id': ids(customers),
+                    'phone': array('q', [customer._phone for customer in customers]),
+                    'cashback': array('q', [customer._ledger.balance for customer in customers]),
+                    'spent': array('q', [customer._spent for customer in customers]),
+                    'percent': array('q', [customer._percent for customer in customers]),
+                    'name': [customer._name for customer in customers],
+                    'surname': [customer._surname for customer in customers],
+                }
+            else:
+                raise ValueError(f"Unknown table {table!r}.")
+        if numpy is False:
+            return result
+        try:
+            import numpy as np
+        except ImportError:
+            if numpy:
+                raise
+            return result
+        for columns in result.values():
+            for name, column in columns.items():
+                if isinstance(column, array):
+                    columns[name] = np.frombuffer(column, dtype=np.float64 if column.typecode == 'd' else np.int64)
+                else:
+                    columns[name] = np.array(column, dtype=object)
+        return result
+
+    def query(self, collection: str) -> Query:
+        """Start a query over a collection.
+
+        Args:
+            collection (str): One of "stores", "categories", "products", "cashiers", "customers", "purchases".
+
+        Returns:
+            Query: A query matching every entity of the collection.
+        """
+        if collection in ("categories", "products"):
+            self._load_catalog()
+        return Query(self, collection)
+
+    @property
+    def stock_events(self) -> StockEventBus:
+        """Returns the bus that publishes low-stock and out-of-stock events.
+
+        Returns:
+            StockEventBus: Stock event bus of the database.
+        """
+        return self._stock_events
+
+    @property
+    def batch_cashback(self) -> bool:
+        """Returns whether cashback is accrued by accrue_pending_cashback instead of at checkout.
+
+        Returns:
+            bool: True if cashback accrual is batched.
+        """
+        return self._batch_cashback
+
+    @batch_cashback.setter
+    def batch_cashback(self, enabled: bool) -> None:
+        """Enable or disable batched cashback accrual.
+
+        Args:
+            enabled (bool): True to defer accrual to accrue_pending_cashback.
+        """
+        if not isinstance(enabled, bool):
+            raise TypeError("enabled must be a bool.")
+        self._batch_cashback = enabled
+
+    @property
+    def cashback_rules(self) -> CashbackRules | None:
+        """Returns the cashback rules applied at checkout, if any.
+
+        Returns:
+            CashbackRules | None: Cashback rules of the database.
+        """
+        return self._cashback_rules
+
+    @cashback_rules.setter
+    def cashback_rules(self, rules: CashbackRules | None) -> None:
+        """Set the cashback rules applied at checkout; None falls back to the customer percent.
+
+        Args:
+            rules (CashbackRules | None): The rules to apply.
+        """
+        if not isinstance(rules, CashbackRules | None):
+            raise TypeError(f"Expected CashbackRules or None instance, got {type(rules).__name__}")
+        self._cashback_rules = rules
+
+    @property
+    def price_book(self) -> PriceBook | None:
+        """Returns the price lists and promotions applied to carts, if any.
+
+        Returns:
+            PriceBook | None: Price book of the database.
+        """
+        return self._price_book
+
+    @price_book.setter
+    def price_book(self, price_book: PriceBook | None) -> None:
+        """Set the price lists and promotions applied to carts; None uses the product prices.
+
+        Args:
+            price_book (PriceBook | None): The price book to apply.
+        """
+        if not isinstance(price_book, PriceBook | None):
+            raise TypeError(f"Expected PriceBook or None instance, got {type(price_book).__name__}")
+        self._price_book = price_book
+
+    def _cashback(self, customer: 'Customer', products, paid: int, when: datetime, prices: dict | None = None,
+                  spent: int | None = None) -> int:
+        """Return the cashback earned by one purchase using the cashback rules or the customer percent.
+
+        Args:
+            when (datetime): Time of the purchase, which decides the promotions that apply.
+            prices (dict | None): Unit price charged per Product.
+            spent (int | None): Customer's lifetime spend including the purchase, which decides the tier.
+
+        Raises:
+            ValueError: If the amount paid or the cashback earned is negative.
+        """
+        if paid < 0:
+            raise ValueError("Order amount must be non-negative.")
+        if self._cashback_rules is None:
+            return (paid * customer.percent) // 100
+        earned = self._cashback_rules.evaluate(customer, products, paid, when, prices, spent)
+        if earned < 0:
+            raise ValueError("Cashback amount must be non-negative.")
+        return earned
+
+    def _accrue(self, purchase: 'Purchase', products, spent: int, when: datetime | None = None) -> None:
+        """Accrue the cashback of a registered purchase at its date, charged prices and the spend as of it.
+
+        The ledger entry is stamped when, but no earlier than the customer's last entry.
+        """
+        customer = purchase.customer
+        charged = {line.product_id: line.unit_price for line in purchase.products}
+        prices = {product: charged.get(product.id, product.price) for product in products}
+        earned = self._cashback(customer, products, purchase.total - purchase.used_cashback,
+                                purchase.purchase_date, prices, spent)
+        customer.credit_cashback(earned, purchase.id, customer.cashback_ledger.clamp(when or datetime.now()))
+
+    def accrue_pending_cashback(self, when: datetime | None = None) -> int:
+        """Accrue the cashback of every purchase made since the last batch.
+
+        Purchases are grouped by customer and credited in purchase order, one
+        ledger entry per purchase, evaluated at the purchase date, charged
+        prices and the customer's lifetime spend as of the purchase, and
+        stamped with the batch time (or the customer's last ledger entry, if later). A purchase stays pending
+        until its cashback is credited, so a failing accrual can be retried.
+
+        Args:
+            when (datetime | None): Time of the batch, defaulting to now.
 
-class Database:
-    """Represents a centralized system to manage all entities related to a retail environment.
+        Returns:
+            int: Total cashback accrued.
+        """
+        when = when or datetime.now()
+        pending = self._pending_cashback
+        by_customer = {}
+        for index, (purchase, products, spent) in enumerate(pending):
+            by_customer.setdefault(purchase.customer, []).append((index, purchase, products, spent))
+        done = set()
+        accrued = 0
+        try:
+            for customer, purchases in by_customer.items():
+                before = customer.cashback
+                try:
+                    for index, purchase, products, spent in purchases:
+                        self._accrue(purchase, products, spent, when)
+                        done.add(index)
+                finally:
+                    accrued += customer.cashback - before
+        finally:
+            self._pending_cashback = [entry for index, entry in enumerate(pending) if index not in done]
+        return accrued
+
+    def expire_cashback(self, before: datetime, when: datetime | None = None) -> int:
+        """Expire cashback credited before a cutoff that has not been spent since.
+
+        Debits take the oldest cashback lots first and refunds give back the
+        lots they took, so the expiring amount of a customer is what is left
+        of the lots credited up to the cutoff, with their original dates.
 
-    Stores references to stores, categories, products, cashiers, customers, and purchases.
-    Provides methods to add, remove, and query these entities.
-    """
+        Args:
+            before (datetime): Cashback credited at or before this time expires.
+            when (datetime | None): Time of the expiry entries, defaulting to now
+                (or each customer's last ledger entry, if later).
 
-    def __init__(self, name: str):
-        """Initialize a new Database instance.
+        Returns:
+            int: Total cashback expired.
+
+        Raises:
+            ValueError: If when is earlier than the last entry of a ledger; nothing is expired then.
+        """
+        if when is not None:
+            for customer in self._customers:
+                last = customer.cashback_ledger.last
+                if last is not None and when < last:
+                    raise ValueError("Expiry time is earlier than the last cashback ledger entry.")
+        expired = 0
+        for customer in self._customers:
+            ledger = customer.cashback_ledger
+            amount = ledger.expiring(before)
+            if amount > 0:
+                ledger.append(-amount, CashbackLedger.EXPIRY, when or ledger.clamp(datetime.now()))
+                expired += amount
+        return expired
+
+    @property
+    def shared_inventory(self) -> SharedInventory | None:
+        """Returns the shared memory inventory holding the product quantities, if any.
+
+        Returns:
+            SharedInventory | None: Shared inventory of the database.
+        """
+        return self._inventory
+
+    def set_shared_inventory(self, inventory: SharedInventory | None, load: bool = False) -> None:
+        """Keep the quantities of all database products in a shared memory inventory.
+
+        Products added later are bound as well; their quantity is copied into
+        their slot only if no process has stocked the slot yet, otherwise they
+        take the shared quantity. Passing None copies the shared quantities
+        back into the products.
 
         Args:
-            name (str): The name of the database.
+            inventory (SharedInventory | None): The inventory to use, or None to stop using one.
+            load (bool): Copy the current product quantities into the inventory;
+                use it in the process that fills the stock pool.
+
+        Raises:
+            TypeError: If inventory is not a SharedInventory or None instance.
+            ValueError: If a product ID does not fit in the inventory.
         """
-        self._name = name
-        self._stores = []
-        self._categories = []
-        self._products = []
-        self._cashiers = []
-        self._customers = []
-        self._purchases = []
+        if not isinstance(inventory, SharedInventory | None):
+            raise TypeError(f"Expected SharedInventory or None instance, got {type(inventory).__name__}")
+        if inventory is not None:
+            for product in self._products:
+                if product.id >= inventory.capacity:
+                    raise ValueError(f"Product ID {product.id} does not fit in the shared inventory.")
+        for product in self._products:
+            product._unbind_inventory()
+        self._inventory = inventory
+        if inventory is not None:
+            for product in self._products:
+                product._bind_inventory(inventory, load)
+
+    @property
+    def stock_ledger(self) -> StockLedger:
+        """Returns the per-store stock ledger used for products shared between stores.
+
+        Returns:
+            StockLedger: Stock ledger of the database.
+        """
+        return self._stock_ledger
 
     @property
     def stores(self) -> tuple:
@@ -43,9 +3277,7 @@ class Database:
             if not isinstance(store, Store):
                 raise TypeError(f"Expected Store instance, got {type(store).__name__}")
         for store in stores:
-            if store not in self._stores:
-                self._stores.append(store)
-                store.set_database(self)
+            store.set_database(self)
 
     def remove_stores(self, *stores: 'Store'):
         """Remove one or more Store instances from the database.
@@ -61,9 +3293,98 @@ class Database:
                 raise TypeError(f"Expected Store instance, got {type(store).__name__}")
         for store in stores:
             if store in self._stores:
-                self._stores.remove(store)
                 store.set_database(None)
 
+    def find_store_by_id(self, store_id: int):
+        """Search for a Store instance by ID.
+
+        Args:
+            store_id (int): ID to search for.
+
+        Returns:
+            Store | bool: The matching Store instance if found, otherwise False.
+        """
+        return self._find_by_id("stores", store_id)
+
+    @property
+    def archived_stores(self) -> tuple:
+        """Returns Store instances archived by cascade_remove_stores.
+
+        Returns:
+            tuple: Tuple containing all archived Store instances.
+        """
+        return tuple(self._archived_stores)
+
+    def cascade_remove_stores(self, *stores: 'Store', archive: bool = False):
+        """Remove stores together with their categories and products.
+
+        The whole subtree is detached from the database in one pass. When
+        deleting, every link inside the subtree is cleared as well; when
+        archiving, the subtree keeps its internal links and is moved to the
+        archived collections. Links to objects outside the subtree are always cut.
+
+        Args:
+            *stores (Store): Variable number of Store instances to remove.
+            archive (bool): Archive the subtree instead of deleting it.
+
+        Raises:
+            TypeError: If any argument is not a Store instance.
+        """
+        for store in stores:
+            if not isinstance(store, Store):
+                raise TypeError(f"Expected Store instance, got {type(store).__name__}")
+        stores = dict.fromkeys(stores)
+        categories = {}
+        products = {}
+        for store in stores:
+            categories.update(store._categories)
+            products.update(store._products)
+        for category in categories:
+            products.update(category._products)
+        self._cascade_remove(stores, categories, products, archive)
+
+    def _cascade_remove(self, stores: dict, categories: dict, products: dict, archive: bool):
+        """Detach a store/category/product subtree from the database.
+
+        Args:
+            stores (dict): Stores of the subtree.
+            categories (dict): Categories of the subtree.
+            products (dict): Products of the subtree.
+            archive (bool): Archive the subtree instead of deleting it.
+        """
+        for product in products:
+            if product._store is not None and product._store not in stores:
+                product.set_store(None)
+            if product._category is not None and product._category not in categories:
+                product.set_category(None)
+            if product._database is self:
+                self._detach_product(product)
+                product._database = None
+        for category in categories:
+            if category._store is not None and category._store not in stores:
+                category.set_store(None)
+            if category._database is self:
+                self._detach("categories", category)
+                category._database = None
+        for store in stores:
+            if store._database is self:
+                self._detach_store(store)
+                store._database = None
+        if archive:
+            self._archived_stores.update(stores)
+            self._archived_categories.update(categories)
+            self._archived_products.update(products)
+            return
+        for product in products:
+            product._store = None
+            product._category = None
+        for category in categories:
+            category._store = None
+            category._clear_products()
+        for store in stores:
+            store._categories = {}
+            store._clear_products()
+
     @property
     def categories(self) -> tuple:
         """Returns all registered Category instances.
@@ -71,6 +3392,7 @@ class Database:
         Returns:
             tuple: Tuple containing all Category instances in the database.
         """
+        self._load_catalog()
         return tuple(self._categories)
 
     def add_categories(self, *categories: 'Category'):
@@ -86,9 +3408,7 @@ class Database:
             if not isinstance(category, Category):
                 raise TypeError(f"Expected Category instance, got {type(category).__name__}")
         for category in categories:
-            if category not in self._categories:
-                self._categories.append(category)
-                category.set_database(self)
+            category.set_database(self)
 
     def remove_categories(self, *categories: 'Category'):
         """Remove one or more Category instances from the database.
@@ -104,9 +3424,53 @@ class Database:
                 raise TypeError(f"Expected Category instance, got {type(category).__name__}")
         for category in categories:
             if category in self._categories:
-                self._categories.remove(category)
                 category.set_database(None)
 
+    def find_category_by_id(self, category_id: int):
+        """Search for a Category instance by ID.
+
+        Args:
+            category_id (int): ID to search for.
+
+        Returns:
+            Category | bool: The matching Category instance if found, otherwise False.
+        """
+        found = self._find_by_id("categories", category_id)
+        if not found and self._catalog is not None:
+            self._load_catalog("categories", "id", category_id)
+            found = self._find_by_id("categories", category_id)
+        return found
+
+    @property
+    def archived_categories(self) -> tuple:
+        """Returns Category instances archived by a cascading removal.
+
+        Returns:
+            tuple: Tuple containing all archived Category instances.
+        """
+        return tuple(self._archived_categories)
+
+    def cascade_remove_categories(self, *categories: 'Category', archive: bool = False):
+        """Remove categories together with their products.
+
+        See cascade_remove_stores for how the subtree is detached.
+
+        Args:
+            *categories (Category): Variable number of Category instances to remove.
+            archive (bool): Archive the subtree instead of deleting it.
+
+        Raises:
+            TypeError: If any argument is not a Category instance.
+        """
+        for category in categories:
+            if not isinstance(category, Category):
+                raise TypeError(f"Expected Category instance, got {type(category).__name__}")
+        categories = dict.fromkeys(categories)
+        products = {}
+        for category in categories:
+            products.update(category._products)
+        self._cascade_remove({}, categories, products, archive)
+
     @property
     def products(self) -> tuple:
         """Returns all registered Product instances.
@@ -114,6 +3478,7 @@ class Database:
         Returns:
             tuple: Tuple containing all Product instances in the database.
         """
+        self._load_catalog()
         return tuple(self._products)
 
     def add_products(self, *products: 'Product'):
@@ -124,14 +3489,14 @@ class Database:
 
         Raises:
             TypeError: If any argument is not a Product instance.
+            ValueError: If a product SKU is already registered to another product.
         """
         for product in products:
             if not isinstance(product, Product):
                 raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+        _check_skus(self._skus, products)
         for product in products:
-            if product not in self._products:
-                self._products.append(product)
-                product.set_database(self)
+            product.set_database(self)
 
     def remove_products(self, *products: 'Product'):
         """Remove one or more Product instances from the database.
@@ -147,9 +3512,79 @@ class Database:
                 raise TypeError(f"Expected Product instance, got {type(product).__name__}")
         for product in products:
             if product in self._products:
-                self._products.remove(product)
                 product.set_database(None)
 
+    def find_product_by_id(self, product_id: int):
+        """Search for a Product instance by ID.
+
+        Args:
+            product_id (int): ID to search for.
+
+        Returns:
+            Product | bool: The matching Product instance if found, otherwise False.
+        """
+        found = self._find_by_id("products", product_id)
+        if not found and self._catalog is not None:
+            self._load_catalog("products", "id", product_id)
+            found = self._find_by_id("products", product_id)
+        return found
+
+    def _check_slot(self, product: 'Product') -> None:
+        """Raise ValueError if the product ID, or the ID it is about to get, does not fit in the shared inventory."""
+        if self._inventory is not None:
+            product_id = self._last_ids["products"] + 1 if product._id is None else product._id
+            if product_id >= self._inventory.capacity:
+                raise ValueError(f"Product ID {product_id} does not fit in the shared inventory.")
+
+    def _attach_product(self, product: 'Product') -> None:
+        """Register a product in the database collections and SKU registry.
+
+        With a shared inventory the product quantity seeds its slot if the slot
+        was never stocked; otherwise the product takes the shared quantity.
+        """
+        self._attach("products", product)
+        if product.sku is not None:
+            self._skus[product.sku] = product
+        if self._inventory is not None:
+            stocked = self._inventory.seed(product._id, product._quantity)
+            product._bind_inventory(self._inventory, False)
+            if stocked != product._quantity:
+                for parent in (product._store, product._category):
+                    if parent is not None:
+                        parent._quantity_index.update(product)
+
+    def _detach_product(self, product: 'Product') -> None:
+        """Unregister a product from the database collections, SKU registry and stock ledger."""
+        self._stock_ledger.remove_product(product)
+        product._unbind_inventory()
+        self._detach("products", product)
+        if product.sku is not None:
+            del self._skus[product.sku]
+
+    def find_product_by_sku(self, sku: str):
+        """Search for a Product instance by SKU or barcode.
+
+        Args:
+            sku (str): SKU or barcode to search for.
+
+        Returns:
+            Product | bool: The matching Product instance if found, otherwise False.
+        """
+        found = self._skus.get(sku, False)
+        if not found and self._catalog is not None:
+            self._load_catalog("products", "sku", sku)
+            found = self._skus.get(sku, False)
+        return found
+
+    @property
+    def archived_products(self) -> tuple:
+        """Returns Product instances archived by a cascading removal.
+
+        Returns:
+            tuple: Tuple containing all archived Product instances.
+        """
+        return tuple(self._archived_products)
+
     @property
     def cashiers(self) -> tuple:
         """Returns all registered Cashier instances.
@@ -172,9 +3607,7 @@ class Database:
             if not isinstance(cashier, Cashier):
                 raise TypeError(f"Expected Cashier instance, got {type(cashier).__name__}")
         for cashier in cashiers:
-            if cashier not in self._cashiers:
-                self._cashiers.append(cashier)
-                cashier.set_database(self)
+            cashier.set_database(self)
 
     def remove_cashiers(self, *cashiers: 'Cashier'):
         """Remove one or more Cashier instances from the database.
@@ -190,9 +3623,19 @@ class Database:
                 raise TypeError(f"Expected Cashier instance, got {type(cashier).__name__}")
         for cashier in cashiers:
             if cashier in self._cashiers:
-                self._cashiers.remove(cashier)
                 cashier.set_database(None)
 
+    def find_cashier_by_id(self, cashier_id: int):
+        """Search for a Cashier instance by ID.
+
+        Args:
+            cashier_id (int): ID to search for.
+
+        Returns:
+            Cashier | bool: The matching Cashier instance if found, otherwise False.
+        """
+        return self._find_by_id("cashiers", cashier_id)
+
     @property
     def customers(self) -> tuple:
         """Returns all registered Customer instances.
@@ -215,9 +3658,7 @@ class Database:
             if not isinstance(customer, Customer):
                 raise TypeError(f"Expected Customer instance, got {type(customer).__name__}")
         for customer in customers:
-            if customer not in self._customers:
-                self._customers.append(customer)
-                customer.set_database(self)
+            customer.set_database(self)
 
     def remove_customers(self, *customers: 'Customer'):
         """Remove one or more Customer instances from the database.
@@ -233,9 +3674,19 @@ class Database:
                 raise TypeError(f"Expected Customer instance, got {type(customer).__name__}")
         for customer in customers:
             if customer in self._customers:
-                self._customers.remove(customer)
                 customer.set_database(None)
 
+    def find_customer_by_id(self, customer_id: int):
+        """Search for a Customer instance by ID.
+
+        Args:
+            customer_id (int): ID to search for.
+
+        Returns:
+            Customer | bool: The matching Customer instance if found, otherwise False.
+        """
+        return self._find_by_id("customers", customer_id)
+
     def find_customer_by_phone(self, phone):
         """Search for a Customer instance by phone number.
 
@@ -245,9 +3696,8 @@ class Database:
         Returns:
             Customer | bool: The matching Customer instance if found, otherwise False.
         """
-        for customer in self._customers:
-            if customer.phone == phone:
-                return customer
+        for customer in self._phones.get(phone, ()):
+            return customer
         return False
 
     @property
@@ -272,9 +3722,7 @@ class Database:
             if not isinstance(purchase, Purchase):
                 raise TypeError(f"Expected Purchase instance, got {type(purchase).__name__}")
         for purchase in purchases:
-            if purchase not in self._purchases:
-                self._purchases.append(purchase)
-                purchase.set_database(self)
+            purchase.set_database(self)
 
     def remove_purchases(self, *purchases: 'Purchase'):
         """Remove one or more Purchase instances from the database.
@@ -290,11 +3738,192 @@ class Database:
                 raise TypeError(f"Expected Purchase instance, got {type(purchase).__name__}")
         for purchase in purchases:
             if purchase in self._purchases:
-                self._purchases.remove(purchase)
                 purchase.set_database(None)
 
+    def find_purchase_by_id(self, purchase_id: int):
+        """Search for a Purchase instance by ID, rebuilding it if it is archived.
+
+        Args:
+            purchase_id (int): ID to search for.
+
+        Returns:
+            Purchase | bool: The matching Purchase instance if found, otherwise False.
+        """
+        purchase = self._find_by_id("purchases", purchase_id)
+        if not purchase and self._purchase_archive is not None and purchase_id in self._purchase_archive:
+            return self._purchase_archive.load(purchase_id, self)
+        return purchase
+
+    @property
+    def affinity(self) -> AffinityIndex | None:
+        """Returns the co-occurrence index updated as purchases are registered, if any.
+
+        Returns:
+            AffinityIndex | None: Affinity index of the database.
+        """
+        return self._affinity
+
+    def set_affinity_index(self, index: AffinityIndex | None, load: bool = True) -> None:
+        """Set the co-occurrence index updated as purchases are registered.
+
+        Args:
+            index (AffinityIndex | None): The index, or None to stop maintaining one.
+            load (bool): Count the purchases already registered.
+        """
+        if not isinstance(index, AffinityIndex | None):
+            raise TypeError(f"Expected AffinityIndex or None instance, got {type(index).__name__}")
+        self._affinity = index
+        if index is not None and load:
+            for purchase in self._purchases:
+                index.add(purchase)
+
+    @property
+    def sales_sketches(self) -> SalesSketches | None:
+        """Returns the streaming sales statistics updated as purchases are registered, if any.
+
+        Returns:
+            SalesSketches | None: Sales sketches of the database.
+        """
+        return self._sketches
+
+    def set_sales_sketches(self, sketches: SalesSketches | None, load: bool = True) -> None:
+        """Set the streaming sales statistics updated as purchases are registered.
+
+        Args:
+            sketches (SalesSketches | None): The sketches, or None to stop maintaining them.
+            load (bool): Count the purchases already registered.
+        """
+        if not isinstance(sketches, SalesSketches | None):
+            raise TypeError(f"Expected SalesSketches or None instance, got {type(sketches).__name__}")
+        self._sketches = sketches
+        if sketches is not None and load:
+            for purchase in self._purchases:
+                sketches.add(purchase)
+
+    def bought_together(self, product: 'Product', limit: int | None = None) -> list:
+        """Return the products most often bought together with a product.
+
+        Args:
+            product (Product): The product.
+            limit (int | None): Maximum number of products.
+
+        Returns:
+            list: Product instances, best first; products no longer in the database are skipped.
+
+        Raises:
+            ValueError: If no affinity index is set.
+        """
+        if self._affinity is None:
+            raise ValueError("No affinity index is set.")
+        found = [self._find_by_id("products", product_id)
+                 for product_id, _ in self._affinity.bought_together(product.id)]
+        return [product for product in found if product][:limit]
+
+    def usual_items(self, customer: 'Customer', limit: int | None = None) -> list:
+        """Return the products a customer buys most.
+
+        Args:
+            customer (Customer): The customer.
+            limit (int | None): Maximum number of products.
+
+        Returns:
+            list: Product instances, best first; products no longer in the database are skipped.
+
+        Raises:
+            ValueError: If no affinity index is set.
+        """
+        if self._affinity is None:
+            raise ValueError("No affinity index is set.")
+        found = [self._find_by_id("products", product_id)
+                 for product_id, _ in self._affinity.usual_items(customer.id)]
+        return [product for product in found if product][:limit]
+
+    @property
+    def receipt_renderer(self) -> ReceiptRenderer:
+        """Returns the renderer caching the receipts of the database purchases.
+
+        Returns:
+            ReceiptRenderer: Receipt renderer of the database.
+        """
+        return self._receipt_renderer
+
+    @property
+    def purchase_archive(self) -> PurchaseArchive | None:
+        """Returns the archive old purchases are moved to, if any.
+
+        Returns:
+            PurchaseArchive | None: Purchase archive of the database.
+        """
+        return self._purchase_archive
+
+    def set_purchase_archive(self, archive: PurchaseArchive | None):
+        """Set the archive old purchases are moved to.
+
+        New purchases get IDs after the archived ones, so a resumed archive
+        keeps its purchase IDs unique.
+
+        Args:
+            archive (PurchaseArchive | None): The archive.
+
+        Raises:
+            ValueError: If purchases were already archived to the current archive,
+                or a registered purchase has the ID of an archived one.
+        """
+        if not isinstance(archive, PurchaseArchive | None):
+            raise TypeError(f"Expected PurchaseArchive or None instance, got {type(archive).__name__}")
+        if self._purchase_archive is not None and len(self._purchase_archive) and archive is not self._purchase_archive:
+            raise ValueError("Purchases were already archived to the current archive.")
+        if archive is not None:
+            for purchase in self._purchases:
+                if purchase.id in archive:
+                    raise ValueError(f"ID {purchase.id} is already used by an archived purchase.")
+            self._last_ids["purchases"] = max(self._last_ids["purchases"], archive.last_id)
+        self._purchase_archive = archive
+
+    def archive_purchases(self, now: datetime | None = None) -> int:
+        """Move purchases older than the archive retention period to the archive.
+
+        Archived purchases leave the purchases collection and the purchase
+        lists of their customers are switched to stubs; find_purchase_by_id
+        and Customer.purchases rebuild them on access. Purchases still
+        waiting for batched cashback are kept.
+
+        Args:
+            now (datetime | None): Current time, defaulting to now.
+
+        Returns:
+            int: Number of purchases archived.
+
+        Raises:
+            ValueError: If no archive is set.
+        """
+        if self._purchase_archive is None:
+            raise ValueError("No purchase archive is set.")
+        cutoff = (now or datetime.now()) - self._purchase_archive.retention
+        pending = {purchase for purchase, _, _ in self._pending_cashback}
+        old = [purchase for purchase in self._purchase_dates.range(high=cutoff)
+               if purchase.purchase_date < cutoff and purchase not in pending]
+        if not old:
+            return 0
+        stubs = dict(zip(old, self._purchase_archive.write(old)))
+        customers = set()
+        for purchase in old:
+            self._detach("purchases", purchase)
+            self._purchase_dates.remove(purchase)
+            self._release_lines(purchase._lines)
+            purchase._database = None
+            customers.add(purchase.customer)
+        for customer in customers:
+            customer._purchases = [stubs.get(purchase, purchase) if isinstance(purchase, Purchase) else purchase
+                                   for purchase in customer._purchases]
+        return len(old)
+
 class Store:
     """Represents a Store structure containing Categories and Products."""
+
+    # Child collections a persistent backend may leave unset until first access.
+    _LAZY = frozenset(("_categories", "_products", "_skus", "_name_index", "_price_index", "_quantity_index"))
+
     def __init__(self, name: str, address: str):
         """Initialize a Store instance.
 
@@ -312,8 +3941,14 @@ class Store:
         self._id = None
         self._name = name
         self._address = address
-        self._categories = []
-        self._products = []
+        self._categories = {}
+        self._products = {}
+        self._stocked = {}
+        self._skus = {}
+        self._name_index = NameIndex()
+        self._price_index = SortedIndex("price")
+        self._quantity_index = SortedIndex("quantity", self.quantity_of)
+        self._ledger = None
         self._database = None
 
     def to_dict(self) -> dict:
@@ -411,9 +4046,7 @@ class Store:
             if not isinstance(category, Category):
                 raise TypeError(f"Expected Category instance, got {type(category).__name__}")
         for category in categories:
-            if category not in self._categories:
-                self._categories.append(category)
-                category.set_store(self)
+            category.set_store(self)
 
     def remove_category(self, *categories: 'Category') -> None:
         """Remove one or more categories from the Store.
@@ -429,7 +4062,6 @@ class Store:
                 raise TypeError(f"Expected Category instance, got {type(category).__name__}")
         for category in categories:
             if category in self._categories:
-                self._categories.remove(category)
                 category.set_store(None)
 
     @property
@@ -437,9 +4069,10 @@ class Store:
         """Return the Store products.
 
         Returns:
-            tuple: Products of the store.
+            tuple: Products of the store, followed by products of other stores
+                that the stock ledger stocks here.
         """
-        return tuple(self._products)
+        return tuple(self._products) + tuple(self._stocked)
 
     def add_product(self, *products: 'Product') -> None:
         """Add one or more products to the Store.
@@ -449,31 +4082,219 @@ class Store:
 
         Raises:
             TypeError: If any input is not a Product instance.
+            ValueError: If a product SKU is already registered to another product of the Store.
         """
         for product in products:
             if not isinstance(product, Product):
                 raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+        _check_skus(self._skus, products)
         for product in products:
-            if product not in self._products:
-                self._products.append(product)
-                product.set_store(self)
+            product.set_store(self)
 
     def remove_product(self, *products: 'Product') -> None:
         """Remove one or more products from the Store.
 
-        Args:
-            *products (Product): One or more Product instances.
+        Args:
+            *products (Product): One or more Product instances.
+
+        Raises:
+            TypeError: If any input is not a Product instance.
+        """
+        for product in products:
+            if not isinstance(product, Product):
+                raise TypeError(f"Expected Product instance, got {type(product).__name__}")
+        for product in products:
+            if product in self._products:
+                product.set_store(None)
+
+    def _attach_product(self, product: 'Product') -> None:
+        """Register a product in the Store collections, SKU registry and indexes."""
+        self._stocked.pop(product, None)
+        self._products[product] = None
+        self._index(product)
+
+    def _index(self, product: 'Product') -> None:
+        """Add a product to the Store SKU registry and indexes."""
+        if product.sku is not None:
+            self._skus[product.sku] = product
+        self._name_index.add(product)
+        self._price_index.add(product)
+        self._quantity_index.add(product)
+
+    def _unindex(self, product: 'Product') -> None:
+        """Remove a product from the Store SKU registry and indexes."""
+        if product.sku is not None and self._skus.get(product.sku) is product:
+            del self._skus[product.sku]
+        self._name_index.remove(product)
+        self._price_index.remove(product)
+        self._quantity_index.remove(product)
+
+    def _list(self, product: 'Product') -> None:
+        """Register a product of another store that the stock ledger stocks in this Store."""
+        if product not in self._products and product not in self._stocked:
+            self._stocked[product] = None
+            self._index(product)
+
+    def _unlist(self, product: 'Product') -> None:
+        """Unregister a product the stock ledger no longer stocks in this Store."""
+        if product in self._stocked:
+            del self._stocked[product]
+            self._unindex(product)
+        elif product in self._products:
+            self._quantity_index.update(product)
+
+    def quantity_of(self, product: 'Product') -> int:
+        """Return the stock of a product in the Store.
+
+        Args:
+            product (Product): A product of the Store.
+
+        Returns:
+            int: The stock ledger quantity if the ledger tracks the product here, else its quantity.
+        """
+        if self._ledger is not None and self._ledger.tracks(product, self):
+            return self._ledger.get(product, self)
+        return product.quantity
+
+    def _clear_products(self) -> None:
+        """Empty the Store product collection, SKU registry and indexes without touching the products.
+
+        Products stocked here through the stock ledger stay registered.
+        """
+        self._products = {}
+        self._skus = {}
+        self._name_index = NameIndex()
+        self._price_index = SortedIndex("price")
+        self._quantity_index = SortedIndex("quantity", self.quantity_of)
+        for product in self._stocked:
+            self._index(product)
+
+    def _defer(self, loader) -> None:
+        """Drop the child collections so that the first access calls loader(store) to fill them.
+
+        The loader must give the Store its child collections back, e.g. with _clear_products,
+        before linking the children.
+        """
+        for name in Store._LAZY:
+            self.__dict__.pop(name, None)
+        self._loader = loader
+
+    def __getattr__(self, name: str):
+        """Load the children of a deferred Store when one of its child collections is first accessed."""
+        loader = self.__dict__.pop("_loader", None)
+        if loader is None or name not in Store._LAZY:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        loader(self)
+        return getattr(self, name)
+
+    def _detach_product(self, product: 'Product') -> None:
+        """Unregister a product from the Store collections, SKU registry and indexes.
+
+        A product the stock ledger still stocks here stays listed.
+        """
+        del self._products[product]
+        if self._ledger is not None and self._ledger.tracks(product, self):
+            self._stocked[product] = None
+            self._quantity_index.update(product)
+        else:
+            self._unindex(product)
+
+    def transfer(self, other: 'Store', products=(), categories=()) -> None:
+        """Move products and categories to another Store in one pass.
+
+        Moving a category also moves its products that belong to this Store.
+        Everything is validated before anything is moved.
+
+        Args:
+            other (Store): Destination store.
+            products (Iterable[Product]): Products of this Store to move.
+            categories (Iterable[Category]): Categories of this Store to move.
+
+        Raises:
+            TypeError: If other is not a Store instance.
+            ValueError: If an item does not belong to this Store, or a product SKU
+                is already registered to another product of the destination.
+        """
+        if not isinstance(other, Store):
+            raise TypeError(f"Expected Store instance, got {type(other).__name__}")
+        categories = list(categories)
+        for category in categories:
+            if category not in self._categories:
+                raise ValueError(f"Category {category.name} does not belong to the store.")
+        moved = dict.fromkeys(products)
+        for category in categories:
+            moved.update((product, None) for product in category._products if product._store is self)
+        for product in moved:
+            if product not in self._products:
+                raise ValueError(f"Product {product.name} does not belong to the store.")
+        if other is self:
+            return
+        _check_skus(other._skus, moved)
+        for category in categories:
+            del self._categories[category]
+            category._store = other
+            other._categories[category] = None
+        for product in moved:
+            self._detach_product(product)
+            product._store = other
+            other._attach_product(product)
+
+    def find_product_by_sku(self, sku: str):
+        """Search for a Store product by SKU or barcode.
+
+        Args:
+            sku (str): SKU or barcode to search for.
+
+        Returns:
+            Product | bool: The matching Product instance if found, otherwise False.
+        """
+        return self._skus.get(sku, False)
+
+    def search_products(self, query: str, mode: str = "prefix", category: 'Category | None' = None,
+                        limit: int | None = None) -> list:
+        """Search the Store products by name.
+
+        Args:
+            query (str): Text to search for.
+            mode (str): One of "prefix", "substring" or "fuzzy" (typo-tolerant).
+            category (Category | None): Restrict the search to products of this category.
+            limit (int | None): Maximum number of products to return.
+
+        Returns:
+            list: Matching Product instances.
+
+        Raises:
+            TypeError: If category is not a Category or None instance.
+        """
+        if category is None:
+            return self._name_index.search(query, mode, limit)
+        if not isinstance(category, Category):
+            raise TypeError(f"Expected Category or None instance, got {type(category).__name__}")
+        matches = [product for product in category.search_products(query, mode)
+                   if product.store is self or product in self._stocked]
+        return matches if limit is None else matches[:limit]
+
+    def products_by_price(self, low: int | None = None, high: int | None = None):
+        """Lazily yield the Store products priced between low and high, inclusive, cheapest first.
+
+        Args:
+            low (int | None): Lowest price to include, or None for no lower bound.
+            high (int | None): Highest price to include, or None for no upper bound.
+        """
+        return self._price_index.range(low, high)
+
+    def products_by_quantity(self, low: int | None = None, high: int | None = None):
+        """Lazily yield the Store products with stock between low and high, inclusive, lowest first.
+
+        Products the stock ledger tracks for this Store are indexed by their
+        ledger quantity. With a shared inventory the index follows the quantity
+        changes made by this process only; stock sold by other processes is not reflected.
 
-        Raises:
-            TypeError: If any input is not a Product instance.
+        Args:
+            low (int | None): Lowest quantity to include, or None for no lower bound.
+            high (int | None): Highest quantity to include, or None for no upper bound.
         """
-        for product in products:
-            if not isinstance(product, Product):
-                raise TypeError(f"Expected Product instance, got {type(product).__name__}")
-        for product in products:
-            if product in self._products:
-                self._products.remove(product)
-                product.set_store(None)
+        return self._quantity_index.range(low, high)
 
     @property
     def database(self) -> Database:
@@ -481,13 +4302,16 @@ class Store:
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("stores", self)
         if self._database is not None:
-            self._database.remove_stores(self)
+            self._database._detach_store(self)
         self._database = database
         if database is not None:
-            if self not in self._database.stores:
-                database.add_stores(self)
+            database._attach("stores", self)
 
 class Category:
     """Represents a Category belonging to a Store and containing Products."""
@@ -504,7 +4328,10 @@ class Category:
             raise TypeError("Name must be a string.")
         self._id = None
         self._name = name
-        self._products = []
+        self._products = {}
+        self._name_index = NameIndex()
+        self._price_index = SortedIndex("price")
+        self._quantity_index = SortedIndex("quantity")
         self._store = None
         self._database = None
 
@@ -580,9 +4407,7 @@ class Category:
             if not isinstance(product, Product):
                 raise TypeError(f"Expected Product instance, got {type(product).__name__}")
         for product in products:
-            if product not in self._products:
-                self._products.append(product)
-                product.set_category(self)
+            product.set_category(self)
 
     def remove_product(self, *products: 'Product') -> None:
         """Remove one or more products from the Category.
@@ -598,9 +4423,87 @@ class Category:
                 raise TypeError(f"Expected Product instance, got {type(product).__name__}")
         for product in products:
             if product in self._products:
-                self._products.remove(product)
                 product.set_category(None)
 
+    def _attach_product(self, product: 'Product') -> None:
+        """Register a product in the Category collection and indexes."""
+        self._products[product] = None
+        self._name_index.add(product)
+        self._price_index.add(product)
+        self._quantity_index.add(product)
+
+    def _clear_products(self) -> None:
+        """Empty the Category product collection and indexes without touching the products."""
+        self._products = {}
+        self._name_index = NameIndex()
+        self._price_index = SortedIndex("price")
+        self._quantity_index = SortedIndex("quantity")
+
+    def _detach_product(self, product: 'Product') -> None:
+        """Unregister a product from the Category collection and indexes."""
+        del self._products[product]
+        self._name_index.remove(product)
+        self._price_index.remove(product)
+        self._quantity_index.remove(product)
+
+    def move_products_to(self, other: 'Category', products=None) -> None:
+        """Move products to another Category in one pass.
+
+        Args:
+            other (Category): Destination category.
+            products (Iterable[Product] | None): Products of this Category to move, or None for all of them.
+
+        Raises:
+            TypeError: If other is not a Category instance.
+            ValueError: If a product does not belong to this Category.
+        """
+        if not isinstance(other, Category):
+            raise TypeError(f"Expected Category instance, got {type(other).__name__}")
+        products = list(self._products) if products is None else list(dict.fromkeys(products))
+        for product in products:
+            if product not in self._products:
+                raise ValueError(f"Product {product.name} does not belong to the category.")
+        if other is self:
+            return
+        for product in products:
+            self._detach_product(product)
+            product._category = other
+            other._attach_product(product)
+
+    def search_products(self, query: str, mode: str = "prefix", limit: int | None = None) -> list:
+        """Search the Category products by name.
+
+        Args:
+            query (str): Text to search for.
+            mode (str): One of "prefix", "substring" or "fuzzy" (typo-tolerant).
+            limit (int | None): Maximum number of products to return.
+
+        Returns:
+            list: Matching Product instances.
+        """
+        return self._name_index.search(query, mode, limit)
+
+    def products_by_price(self, low: int | None = None, high: int | None = None):
+        """Lazily yield the Category products priced between low and high, inclusive, cheapest first.
+
+        Args:
+            low (int | None): Lowest price to include, or None for no lower bound.
+            high (int | None): Highest price to include, or None for no upper bound.
+        """
+        return self._price_index.range(low, high)
+
+    def products_by_quantity(self, low: int | None = None, high: int | None = None):
+        """Lazily yield the Category products with stock between low and high, inclusive, lowest first.
+
+        With a shared inventory the index follows the quantity changes made by
+        this process only; stock sold by other processes is not reflected.
+
+        Args:
+            low (int | None): Lowest quantity to include, or None for no lower bound.
+            high (int | None): Highest quantity to include, or None for no upper bound.
+        """
+        return self._quantity_index.range(low, high)
+
     @property
     def store(self) -> Store:
         """Return the Category's store.
@@ -621,11 +4524,13 @@ class Category:
         """
         if not isinstance(store, Store | None):
             raise TypeError(f"Expected Store or None instance, got {type(store).__name__}")
+        if store is self._store:
+            return
         if self._store is not None:
-            self._store.remove_category(self)
+            del self._store._categories[self]
         self._store = store
         if store is not None:
-            store.add_category(self)
+            store._categories[self] = None
 
     @property
     def database(self) -> Database:
@@ -633,26 +4538,31 @@ class Category:
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("categories", self)
         if self._database is not None:
-            self._database.remove_categories(self)
+            self._database._detach("categories", self)
         self._database = database
         if database is not None:
-            if self not in self._database.categories:
-                database.add_categories(self)
+            database._attach("categories", self)
 
 class Product:
     """Represents a Product belonging to a Category and a Store."""
-    def __init__(self, name: str, price: int, quantity: int):
+    def __init__(self, name: str, price: int, quantity: int, sku: str | None = None):
         """Initialize a Product instance.
 
         Args:
             name (str): Name of the product.
             price (int): Price of the product.
             quantity (int): Quantity of the product.
+            sku (str | None): SKU or barcode (EAN/UPC) of the product.
 
         Raises:
             TypeError: If any argument is of incorrect type.
+            ValueError: If sku is an empty string.
         """
         if not isinstance(name, str):
             raise TypeError("Name must be a string.")
@@ -660,10 +4570,17 @@ class Product:
             raise TypeError("Price must be an integer.")
         if not isinstance(quantity, int):
             raise TypeError("Quantity must be an integer.")
+        if not isinstance(sku, str | None):
+            raise TypeError("SKU must be a string or None.")
+        if sku is not None and not sku.strip():
+            raise ValueError("SKU must be a non-empty string.")
         self._id = None
+        self._sku = sku
         self._name = name
         self._price = price
         self._quantity = quantity
+        self._inventory = None
+        self._low_stock_threshold = None
         self._category = None
         self._store = None
         self._database = None
@@ -674,8 +4591,8 @@ class Product:
         Returns:
             dict: Product's basic information.
         """
-        return {'id': self._id, 'name': self._name,
-            'price': self._price, 'quantity': self._quantity}
+        return {'id': self._id, 'sku': self._sku, 'name': self._name,
+            'price': self._price, 'quantity': self.quantity}
 
     def __str__(self) -> str:
         """Return a string representation of the Product including its category and store.
@@ -696,6 +4613,42 @@ class Product:
         """
         return self._id
 
+    @property
+    def sku(self) -> str | None:
+        """Return the Product's SKU or barcode.
+
+        Returns:
+            str | None: SKU of the product.
+        """
+        return self._sku
+
+    @sku.setter
+    def sku(self, new: str | None) -> None:
+        """Set a new SKU for the Product, updating the Store and Database registries.
+
+        Args:
+            new (str | None): New SKU or barcode.
+
+        Raises:
+            TypeError: If new SKU is not a string or None.
+            ValueError: If new SKU is empty or registered to another product.
+        """
+        if not isinstance(new, str | None):
+            raise TypeError("SKU must be a string or None.")
+        if new is not None and not new.strip():
+            raise ValueError("SKU must be a non-empty string.")
+        parents = [parent for parent in (self._store, self._database) if parent is not None]
+        parents.extend(self._listings())
+        for parent in parents:
+            if parent._skus.get(new, self) is not self:
+                raise ValueError(f"SKU {new!r} is already registered to another product.")
+        for parent in parents:
+            if self._sku is not None and parent._skus.get(self._sku) is self:
+                del parent._skus[self._sku]
+            if new is not None:
+                parent._skus[new] = self
+        self._sku = new
+
     @property
     def name(self) -> str:
         """Return the Product's name.
@@ -717,7 +4670,11 @@ class Product:
         """
         if not isinstance(new, str):
             raise TypeError("Name must be a string.")
+        old = self._name
         self._name = new
+        for parent in (self._store, self._category, *self._listings()):
+            if parent is not None:
+                parent._name_index.rename(self, old)
 
     @property
     def price(self) -> int:
@@ -741,6 +4698,15 @@ class Product:
         if not isinstance(new, int):
             raise TypeError("Price must be an integer.")
         self._price = new
+        for parent in (self._store, self._category, *self._listings()):
+            if parent is not None:
+                parent._price_index.update(self)
+
+    def _listings(self) -> list:
+        """Return the other stores that the stock ledger of the Database stocks the Product in."""
+        if self._database is None:
+            return []
+        return [store for store in self._database._stock_ledger.stores if self in store._stocked]
 
     @property
     def quantity(self) -> int:
@@ -749,6 +4715,8 @@ class Product:
         Returns:
             int: Quantity of the product.
         """
+        if self._inventory is not None:
+            return self._inventory.get(self._id)
         return self._quantity
 
     @quantity.setter
@@ -763,7 +4731,87 @@ class Product:
         """
         if not isinstance(new, int):
             raise TypeError("Quantity must be an integer.")
-        self._quantity = new
+        old = self.quantity
+        if self._inventory is not None:
+            self._inventory.set(self._id, new)
+        else:
+            self._quantity = new
+        self._quantity_changed(old, new)
+
+    def _bind_inventory(self, inventory: SharedInventory, load: bool) -> None:
+        """Keep the quantity of the Product in a shared inventory slot.
+
+        Args:
+            inventory (SharedInventory): The inventory to use.
+            load (bool): Copy the current quantity into the slot.
+        """
+        if load:
+            inventory.set(self._id, self._quantity)
+        self._inventory = inventory
+
+    def _unbind_inventory(self) -> None:
+        """Copy the shared quantity back into the Product and stop using the inventory."""
+        if self._inventory is not None:
+            self._quantity = self._inventory.get(self._id)
+            self._inventory = None
+
+    def _quantity_changed(self, old: int, new: int) -> None:
+        """Update the quantity indexes and publish stock events after a quantity change.
+
+        Args:
+            old (int): Quantity before the change.
+            new (int): Quantity after the change.
+        """
+        for parent in (self._store, self._category):
+            if parent is not None:
+                parent._quantity_index.update(self)
+        if new < old:
+            self._publish_stock_event(old, new, self._store, self._database)
+
+    @property
+    def low_stock_threshold(self) -> int | None:
+        """Return the quantity at or below which a low-stock event is published.
+
+        Returns:
+            int | None: Low-stock threshold of the product.
+        """
+        return self._low_stock_threshold
+
+    @low_stock_threshold.setter
+    def low_stock_threshold(self, new: int | None) -> None:
+        """Set the low-stock threshold of the Product.
+
+        Args:
+            new (int | None): New threshold, or None to only report running out of stock.
+
+        Raises:
+            ValueError: If new threshold is not a non-negative integer or None.
+        """
+        if new is not None and (not isinstance(new, int) or new < 0):
+            raise ValueError("Threshold must be a non-negative integer or None.")
+        self._low_stock_threshold = new
+
+    def _publish_stock_event(self, old: int, new: int, store: 'Store | None',
+                             database: 'Database | None') -> None:
+        """Publish a stock event if a quantity has just crossed a threshold.
+
+        Args:
+            old (int): Quantity before the decrease.
+            new (int): Quantity after the decrease.
+            store (Store | None): Store whose stock changed.
+            database (Database | None): Database to publish on, falling back to the store's.
+        """
+        if old > 0 >= new:
+            kind = "out_of_stock"
+        elif self._low_stock_threshold is not None and old > self._low_stock_threshold >= new:
+            kind = "low_stock"
+        else:
+            return
+        if database is None and store is not None:
+            database = store.database
+        if database is not None:
+            database.stock_events.publish(StockEvent(
+                self, kind, new, self._low_stock_threshold, store, datetime.now()))
 
     @property
     def category(self) -> Category:
@@ -785,11 +4833,13 @@ class Product:
         """
         if not isinstance(category, Category | None):
             raise TypeError(f"Expected Category or None instance, got {type(category).__name__}")
+        if category is self._category:
+            return
         if self._category is not None:
-            self._category.remove_product   (self)
+            self._category._detach_product(self)
         self._category = category
         if category is not None:
-            category.add_product(self)
+            category._attach_product(self)
 
     @property
     def store(self) -> Store:
@@ -808,14 +4858,19 @@ class Product:
 
         Raises:
             TypeError: If an input is not a Store or None instance.
+            ValueError: If the product SKU is already registered to another product of the Store.
         """
         if not isinstance(store, Store | None):
             raise TypeError(f"Expected Store or None instance, got {type(store).__name__}")
+        if store is self._store:
+            return
+        if store is not None:
+            _check_skus(store._skus, [self])
         if self._store is not None:
-            self._store.remove_product(self)
+            self._store._detach_product(self)
         self._store = store
         if store is not None:
-            store.add_product(self)
+            store._attach_product(self)
 
     @property
     def database(self) -> Database:
@@ -823,13 +4878,18 @@ class Product:
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("products", self)
+            database._check_slot(self)
+            _check_skus(database._skus, [self])
         if self._database is not None:
-            self._database.remove_products(self)
+            self._database._detach_product(self)
         self._database = database
         if database is not None:
-            if self not in self._database.products:
-                database.add_products(self)
+            database._attach_product(self)
 
 class User:
     """Represents a base user with name, surname, and optional ID."""
@@ -841,16 +4901,18 @@ class User:
         Args:
             name (str): The user's first name.
             surname (str): The user's last name.
+            phone (str | int): The user's phone number.
 
         Raises:
-            ValueError: If name or surname is not a valid non-empty string.
+            ValueError: If name, surname or phone is not valid.
         """
         if not isinstance(name, str) or not name.strip():
             raise ValueError("Name must be a non-empty string.")
         if not isinstance(surname, str) or not surname.strip():
             raise ValueError("Surname must be a non-empty string.")
-        if not isinstance(phone, str) or not surname.strip():
-            raise ValueError("Phone must be a non-empty string.")
+        if isinstance(phone, str) and not phone.strip() or isinstance(phone, int) and phone <= 0 \
+                or not isinstance(phone, str | int):
+            raise ValueError("Phone must be a non-empty string or a positive integer.")
         self._id = None
         self._name = name
         self._surname = surname
@@ -940,6 +5002,9 @@ class Cashier(User):
         """
         super().__init__(name, surname, phone)
         self._database = None
+        self._shift = None
+        self._shifts = []
+        self._metrics = ShiftMetrics()
 
     def __str__(self) -> str:
         """
@@ -950,23 +5015,117 @@ class Cashier(User):
         """
         return str({'class': type(self).__name__, **self.to_dict()})
 
+    @property
+    def shift(self) -> Shift | None:
+        """
+        Returns the running shift.
+
+        Returns:
+            Shift | None: The running shift, or None when off shift.
+        """
+        return self._shift
+
+    @property
+    def shifts(self) -> tuple:
+        """
+        Returns every shift of the cashier, oldest first.
+
+        Returns:
+            tuple: Shift instances.
+        """
+        return tuple(self._shifts)
+
+    @property
+    def metrics(self) -> ShiftMetrics:
+        """
+        Returns the lifetime throughput metrics of the cashier.
+
+        Returns:
+            ShiftMetrics: Counters and rates over every shift.
+        """
+        return self._metrics
+
+    def start_shift(self, store: Store | None = None, when: datetime | None = None) -> Shift:
+        """
+        Starts a shift.
+
+        Args:
+            store (Store | None): Store of the shift.
+            when (datetime | None): Start of the shift, defaulting to now.
+
+        Returns:
+            Shift: The new shift.
+
+        Raises:
+            ValueError: If a shift is already running.
+        """
+        if self._shift is not None:
+            raise ValueError("Cashier is already on shift.")
+        if not isinstance(store, Store | None):
+            raise TypeError(f"Expected Store or None instance, got {type(store).__name__}")
+        when = when or datetime.now()
+        self._shift = Shift(self, store, when)
+        self._shifts.append(self._shift)
+        self._metrics._open(when)
+        return self._shift
+
+    def end_shift(self, when: datetime | None = None) -> Shift:
+        """
+        Ends the running shift.
+
+        Args:
+            when (datetime | None): End of the shift, defaulting to now.
+
+        Returns:
+            Shift: The ended shift.
+
+        Raises:
+            ValueError: If no shift is running or when is before its start.
+        """
+        if self._shift is None:
+            raise ValueError("Cashier is not on shift.")
+        when = when or datetime.now()
+        shift = self._shift
+        if when < shift.start:
+            raise ValueError("Shift cannot end before it starts.")
+        shift._close(when)
+        shift._end = when
+        self._metrics._close(when)
+        self._shift = None
+        return shift
+
+    def _record_sale(self, items: int, revenue: int) -> None:
+        """Count a paid cart in the lifetime metrics and the running shift."""
+        self._metrics._record_sale(items, revenue)
+        if self._shift is not None:
+            self._shift._record_sale(items, revenue)
+
+    def _record_void(self, cart: bool) -> None:
+        """Count a voided cart or line in the lifetime metrics and the running shift."""
+        self._metrics._record_void(cart)
+        if self._shift is not None:
+            self._shift._record_void(cart)
+
     @property
     def database(self) -> Database:
         return self._database
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("cashiers", self)
         if self._database is not None:
-            self._database.remove_cashiers(self)
+            self._database._detach("cashiers", self)
         self._database = database
         if database is not None:
-            if self not in self._database.cashiers:
-                database.add_cashiers(self)
+            database._attach("cashiers", self)
 
 class Customer(User):
     """Represents a customer with phone number, cashback, and purchase history."""
-    def __init__(self, name: str, surname: str, phone: str):
+    def __init__(self, name: str, surname: str, phone: int):
         """
         Initializes a Customer instance.
 
@@ -978,9 +5137,12 @@ class Customer(User):
          Raises:
             ValueError: If phone is not a positive integer.
         """
+        if not isinstance(phone, int) or phone <= 0:
+            raise ValueError("Phone must be a positive integer.")
         super().__init__(name, surname, phone)
-        self._cashback = 0
+        self._ledger = CashbackLedger()
         self._percent = 1
+        self._spent = 0
         self._purchases = []
         self._database = None
 
@@ -994,7 +5156,7 @@ class Customer(User):
         return {
             **super().to_dict(),
             'phone': self._phone,
-            'cashback': self._cashback,
+            'cashback': self._ledger.balance,
             'percent': self._percent}
 
     def __str__(self) -> str:
@@ -1030,17 +5192,23 @@ class Customer(User):
         """
         if not isinstance(phone, int) or phone <= 0:
             raise ValueError("Phone must be a positive integer.")
-        self._phone = phone
+        old, self._phone = self._phone, phone
+        if self._database is not None:
+            self._database._index_phone(self, old)
 
     @property
     def purchases(self) -> list:
         """
-        Gets the list of customer purchases.
+        Gets the list of customer purchases, rebuilding archived ones.
 
         Returns:
             list: List of purchases.
         """
-        return self._purchases
+        if self._database is None or self._database.purchase_archive is None:
+            return self._purchases
+        archive = self._database.purchase_archive
+        return [archive.load(purchase.id, self._database) if isinstance(purchase, PurchaseStub) else purchase
+                for purchase in self._purchases]
 
     def add_purchase(self, purchase):
         """
@@ -1050,6 +5218,18 @@ class Customer(User):
             purchase: An order object or identifier to be added to purchases.
         """
         self._purchases.append(purchase)
+        if isinstance(purchase, Purchase):
+            self._spent += purchase.total - purchase.used_cashback
+
+    @property
+    def spent(self) -> int:
+        """
+        Gets the lifetime amount paid by the customer, used for cashback tiers.
+
+        Returns:
+            int: Total paid over all purchases.
+        """
+        return self._spent
 
     @property
     def cashback(self) -> int:
@@ -1059,19 +5239,31 @@ class Customer(User):
         Returns:
             int: Cashback amount.
         """
-        return self._cashback
+        return self._ledger.balance
 
     @cashback.setter
     def cashback(self, cashback: int):
         """
-        Sets the cashback amount.
+        Sets the cashback amount, recording the difference as an adjustment.
 
         Args:
             cashback (int): New cashback balance.
         """
         if not isinstance(cashback, int) or cashback < 0:
             raise ValueError("Cashback must be a non-negative integer.")
-        self._cashback = cashback
+        if cashback != self._ledger.balance:
+            self._ledger.append(cashback - self._ledger.balance, CashbackLedger.ADJUSTMENT,
+                                self._ledger.clamp(datetime.now()))
+
+    @property
+    def cashback_ledger(self) -> CashbackLedger:
+        """
+        Gets the history of the cashback balance.
+
+        Returns:
+            CashbackLedger: Cashback ledger of the customer.
+        """
+        return self._ledger
 
     @property
     def percent(self) -> int:
@@ -1110,24 +5302,83 @@ class Customer(User):
         """
         if amount < 0:
             raise ValueError("Withdrawal amount must be non-negative.")
-        if amount <= self._cashback:
-            self._cashback -= amount
+        if amount <= self._ledger.balance:
+            self._ledger.append(-amount, CashbackLedger.WITHDRAWAL, self._ledger.clamp(datetime.now()))
             return True
         return False
 
-    def accrue_cashback(self, order_amount: int):
+    def refund_cashback(self, amount: int):
+        """
+        Returns withdrawn cashback, e.g. of a voided cart, with the dates it was credited.
+
+        Args:
+            amount (int): Amount to return.
+
+        Raises:
+            ValueError: If amount is negative.
+        """
+        if amount < 0:
+            raise ValueError("Refund amount must be non-negative.")
+        if amount:
+            self._ledger.append(amount, CashbackLedger.REFUND, self._ledger.clamp(datetime.now()))
+
+    def take_cashback(self, amount: int | None = None) -> list:
+        """
+        Takes cashback off the balance to move it to another ledger, e.g. of another shard.
+
+        Args:
+            amount (int | None): Amount to take, capped at the balance; None takes the whole balance.
+
+        Returns:
+            list: (datetime, amount) lots taken, dated when they were credited.
+        """
+        amount = self._ledger.balance if amount is None else min(amount, self._ledger.balance)
+        if amount <= 0:
+            return []
+        return self._ledger.append(-amount, CashbackLedger.TRANSFER, self._ledger.clamp(datetime.now()))
+
+    def give_cashback(self, lots: list):
+        """
+        Adds cashback taken from another ledger, keeping the dates it was credited.
+
+        Args:
+            lots (list): (datetime, amount) lots returned by take_cashback.
+        """
+        amount = sum(lot_amount for _, lot_amount in lots)
+        if amount:
+            self._ledger.append(amount, CashbackLedger.TRANSFER, self._ledger.clamp(datetime.now()), lots=lots)
+
+    def accrue_cashback(self, order_amount: int, purchase_id: int | None = None, when: datetime | None = None):
         """
         Accrues cashback from a purchase based on the cashback percent.
 
         Args:
             order_amount (int): Total amount of the purchase.
+            purchase_id (int | None): ID of the purchase, recorded in the ledger.
+            when (datetime | None): Time of the accrual, defaulting to now.
         Raises:
             ValueError: If order amount is negative.
         """
         if order_amount < 0:
             raise ValueError("Order amount must be non-negative.")
-        earned_cashback = (order_amount * self._percent) // 100
-        self._cashback += earned_cashback
+        self.credit_cashback((order_amount * self._percent) // 100, purchase_id, when)
+
+    def credit_cashback(self, amount: int, purchase_id: int | None = None, when: datetime | None = None):
+        """
+        Credits an already computed cashback amount.
+
+        Args:
+            amount (int): Cashback earned.
+            purchase_id (int | None): ID of the purchase, recorded in the ledger.
+            when (datetime | None): Time of the accrual, defaulting to now.
+        Raises:
+            ValueError: If amount is negative.
+        """
+        if amount < 0:
+            raise ValueError("Cashback amount must be non-negative.")
+        if amount:
+            self._ledger.append(amount, CashbackLedger.ACCRUAL, self._ledger.clamp(when or datetime.now()),
+                                purchase_id)
 
     @property
     def database(self) -> Database:
@@ -1135,13 +5386,18 @@ class Customer(User):
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("customers", self)
         if self._database is not None:
-            self._database.remove_customers(self)
+            self._database._detach("customers", self)
+            self._database._unindex_phone(self)
         self._database = database
         if database is not None:
-            if self not in self._database.customers:
-                database.add_customers(self)
+            database._attach("customers", self)
+            database._index_phone(self)
 
 class ShoppingCart:
     def __init__(self, product: Product, database: Database):
@@ -1150,20 +5406,26 @@ class ShoppingCart:
 
         Args:
             product (Product): The initial product to add to the cart.
+            database (Database): The database the cart resolves customers and products in.
         """
         if not isinstance(product, Product):
             raise TypeError("product must be an instance of Product")
         if not isinstance(database, Database):
             raise TypeError("database must be an instance of Database")
         self._id = None
-        self._products = [product]
         self._cashier = None
         self._customer = None
         self._used_cashback = 0
-        self._total = product.price
+        self._lines = {}
+        self._prices = {}
+        self._deal_discounts = {}
+        self._subtotal = 0
+        self._discount = 0
+        self._total = 0
         self._store = None
-        self._database = None
+        self._database = database
         self._status = "pending"
+        self.add_product(product)
 
     def to_dict(self) -> dict:
         """
@@ -1183,7 +5445,7 @@ class ShoppingCart:
             str: Human-readable string of the cart details.
         """
         return str({'class': type(self).__name__, **self.to_dict(),
-            'products': [product.to_dict() for product in self._products]})
+            'products': [product.to_dict() for product in self.products]})
 
     @property
     def id(self) -> int:
@@ -1198,12 +5460,22 @@ class ShoppingCart:
     @property
     def products(self) -> list:
         """
-        Returns the list of products in the cart.
+        Returns the list of products in the cart, one entry per unit.
 
         Returns:
             list: List of Product instances.
         """
-        return self._products
+        return [product for product, count in self._lines.items() for _ in range(count)]
+
+    @property
+    def lines(self) -> dict:
+        """
+        Returns the quantity of each product in the cart.
+
+        Returns:
+            dict: Product to quantity.
+        """
+        return dict(self._lines)
 
     @property
     def cashier(self) -> Cashier:
@@ -1227,6 +5499,30 @@ class ShoppingCart:
             raise TypeError("cashier must be an instance of Cashier")
         self._cashier = new
 
+    @property
+    def store(self) -> Store:
+        """
+        Returns the store the cart is being used in.
+
+        Returns:
+            Store: The store of the cart, or None.
+        """
+        return self._store
+
+    @store.setter
+    def store(self, new):
+        """
+        Assigns the store the cart is being used in.
+
+        Args:
+            new (Store): The store to assign.
+        """
+        if not isinstance(new, Store):
+            raise TypeError("store must be an instance of Store")
+        if new is not self._store:
+            self._store = new
+            self._reprice()
+
     @property
     def customer(self) -> Customer:
         """
@@ -1247,10 +5543,30 @@ class ShoppingCart:
         """
         return self._used_cashback
 
+    @property
+    def subtotal(self) -> int:
+        """
+        Returns the price of the products before deals and cashback.
+
+        Returns:
+            int: Sum of the effective unit prices.
+        """
+        return self._subtotal
+
+    @property
+    def discount(self) -> int:
+        """
+        Returns the discount of the multi-buy and bundle deals in the cart.
+
+        Returns:
+            int: Total deal discount.
+        """
+        return self._discount
+
     @property
     def total(self) -> int:
         """
-        Returns the total price after applying cashback.
+        Returns the total price after applying deals and cashback.
 
         Returns:
             int: Total cart value.
@@ -1271,13 +5587,187 @@ class ShoppingCart:
         """
         Adds a product to the cart and updates the total price.
 
+        The unit price is captured when the product first enters the cart.
+        Only the deals sharing products with the product are re-evaluated,
+        so the cost does not grow with the size of the cart.
+
         Args:
             product (Product): The product to add.
+
+        Raises:
+            ValueError: If the cart is already paid or voided.
+        """
+        if not isinstance(product, Product):
+            raise TypeError("product must be an instance of Product")
+        self._check_open()
+        count = self._lines.get(product, 0)
+        if count:
+            price = self._prices[product]
+        else:
+            price_book = self._database.price_book
+            price = product.price if price_book is None else price_book.price(product, self._store)
+            self._prices[product] = price
+        self._lines[product] = count + 1
+        self._subtotal += price
+        self._update_deals(product)
+        self._total = self._subtotal - self._discount - self._used_cashback
+
+    def set_quantity(self, product, quantity: int):
+        """
+        Changes the quantity of a product in the cart; 0 removes the line.
+
+        Subtotal, deal discount and total are adjusted by the difference, so
+        the cost does not grow with the size of the cart. Cashback exceeding
+        the new total is returned to the customer.
+
+        Args:
+            product (Product): The product to change.
+            quantity (int): New quantity.
+
+        Raises:
+            ValueError: If quantity is negative, the product is not in the cart,
+                the cart would become empty, or the cart is already paid or voided.
         """
         if not isinstance(product, Product):
             raise TypeError("product must be an instance of Product")
-        self._products.append(product)
-        self._total += product.price
+        if not isinstance(quantity, int) or quantity < 0:
+            raise ValueError("quantity must be a non-negative integer")
+        self._check_open()
+        count = self._lines.get(product, 0)
+        if not count:
+            if not quantity:
+                raise ValueError("product is not in the cart")
+            self.add_product(product)
+            count = 1
+        if quantity == count:
+            return
+        if not quantity and len(self._lines) == 1:
+            raise ValueError("cart cannot be empty; use void() to cancel it")
+        self._subtotal += (quantity - count) * self._prices[product]
+        if quantity:
+            self._lines[product] = quantity
+        else:
+            del self._lines[product]
+        self._update_deals(product)
+        if not quantity:
+            del self._prices[product]
+        if quantity < count and self._cashier is not None:
+            self._cashier._record_void(cart=False)
+        self._total = self._subtotal - self._discount - self._used_cashback
+        self._return_excess_cashback()
+
+    def remove_product(self, product, quantity: int = 1):
+        """
+        Removes units of a product from the cart.
+
+        Args:
+            product (Product): The product to remove.
+            quantity (int): Number of units to remove.
+
+        Raises:
+            ValueError: If the cart is already paid or voided.
+        """
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise ValueError("quantity must be a positive integer")
+        self._check_open()
+        self.set_quantity(product, max(0, self._lines.get(product, 0) - quantity))
+
+    def void_line(self, product):
+        """
+        Removes every unit of a product from the cart.
+
+        Args:
+            product (Product): The product to remove.
+        """
+        self.set_quantity(product, 0)
+
+    def void(self):
+        """
+        Cancels the cart, returning the applied cashback to the customer.
+
+        Raises:
+            ValueError: If the cart is already paid or voided.
+        """
+        self._check_open()
+        if self._used_cashback:
+            self._customer.refund_cashback(self._used_cashback)
+            self._total += self._used_cashback
+            self._used_cashback = 0
+        self._status = "voided"
+        if self._cashier is not None:
+            self._cashier._record_void(cart=True)
+
+    def _check_open(self):
+        """Raise a ValueError if the cart is already paid or voided; failed carts stay open for a retry."""
+        if self._status in ("success", "voided"):
+            raise ValueError(f"Cart is already {self._status}.")
+
+    def _return_excess_cashback(self):
+        """Return cashback that exceeds the price of the remaining products to the customer."""
+        if self._total < 0:
+            excess = min(-self._total, self._used_cashback)
+            self._customer.refund_cashback(excess)
+            self._used_cashback -= excess
+            self._total += excess
+
+    def _update_deals(self, product):
+        """Re-allocate the deals sharing units with a product and adjust the discount."""
+        price_book = self._database.price_book
+        if price_book is None:
+            return
+        deals = {}
+        products = {product}
+        stack = [product]
+        while stack:
+            for deal in price_book.deals(stack.pop(), self._store):
+                if deal in deals:
+                    continue
+                deals[deal] = None
+                for item, _ in deal.items:
+                    if item in self._lines and item not in products:
+                        products.add(item)
+                        stack.append(item)
+        lines = {item: self._lines[item] for item in products if item in self._lines}
+        for deal, discount in Deal.allocate(deals, lines, self._prices).items():
+            self._discount += discount - self._deal_discounts.get(deal, 0)
+            self._deal_discounts[deal] = discount
+
+    def _reprice(self):
+        """Recapture unit prices and deals, e.g. after the store of the cart changes."""
+        price_book = self._database.price_book
+        if price_book is None:
+            return
+        self._prices = {product: price_book.price(product, self._store) for product in self._lines}
+        self._subtotal = sum(self._prices[product] * count for product, count in self._lines.items())
+        deals = {deal: None for product in self._lines for deal in price_book.deals(product, self._store)}
+        self._deal_discounts = Deal.allocate(deals, self._lines, self._prices)
+        self._discount = sum(self._deal_discounts.values())
+        self._total = self._subtotal - self._discount - self._used_cashback
+
+    def scan(self, code: str):
+        """
+        Resolves a scanned SKU or barcode and adds the product to the cart.
+
+        The code is looked up in the cart's store if one is assigned, otherwise
+        in the database.
+
+        Args:
+            code (str): Scanned SKU or barcode.
+
+        Returns:
+            Product: The product that was added.
+
+        Raises:
+            ValueError: If no product is registered under the code where it is looked up.
+        """
+        if not isinstance(code, str):
+            raise TypeError("code must be a string")
+        source = self._store if self._store is not None else self._database
+        product = source.find_product_by_sku(code)
+        if not product:
+            raise ValueError(f"No product registered under code {code!r}")
+        self.add_product(product)
+        return product
 
     def add_customer(self, phone: int):
         """
@@ -1292,10 +5782,10 @@ class ShoppingCart:
         if not isinstance(phone, int) or len(str(phone)) < 7:
             raise ValueError("phone must be a valid integer phone number")
 
-        for customer in self._database.customers:
-            if customer.phone == phone:
-                self._customer = customer
-                return True
+        customer = self._database.find_customer_by_phone(phone)
+        if customer:
+            self._customer = customer
+            return True
         return False
 
     def withdraw_cashback(self, amount):
@@ -1310,7 +5800,10 @@ class ShoppingCart:
         """
         if not isinstance(amount, int) or amount <= 0:
             raise ValueError("amount must be a positive integer")
+        self._check_open()
 
+        if amount > self._total:
+            return False
         if self._customer and self._customer.withdraw_cashback(amount):
             self._used_cashback += amount
             self._total -= amount
@@ -1325,7 +5818,12 @@ class ShoppingCart:
             card_number (int): Credit/debit card number.
             expiration_date (list): [month, year] of card expiration.
             cvv (int): Card verification value.
+
+        Raises:
+            ValueError: If the cart is already paid or voided.
         """
+        self._check_open()
+        reserved = None
         try:
             if not isinstance(card_number, int) or len(str(card_number)) < 13:
                 raise ValueError("Invalid card number")
@@ -1341,21 +5839,63 @@ class ShoppingCart:
             if not self._customer:
                 raise ValueError("No customer assigned to the cart.")
 
-            for product in self._products:
-                if product.quantity < 1:
+            products = self.products
+            purchase = Purchase(self._store, products, self._cashier, self._customer, self._used_cashback,
+                                total=self._subtotal - self._discount, discount=self._discount,
+                                prices=self._prices)
+            when = self._customer.cashback_ledger.clamp(purchase.purchase_date)
+            earned = None
+            spent = self._customer.spent + self._total
+            if not self._database.batch_cashback:
+                earned = self._database._cashback(self._customer, products, self._total, purchase.purchase_date,
+                                                  self._prices, spent)
+
+            ledger = self._database.stock_ledger
+            counts = self._lines
+            inventory = self._database.shared_inventory
+            shared = {product: count for product, count in counts.items()
+                      if product._inventory is not None and not ledger.tracks(product, self._store)}
+            for product, count in counts.items():
+                if ledger.tracks(product, self._store):
+                    available = ledger.get(product, self._store)
+                elif product in shared:
+                    continue
+                else:
+                    available = product.quantity
+                if available < count:
                     raise ValueError(f"Product {product.name} is out of stock.")
-                product.quantity -= 1
+            if shared:
+                before = inventory.reserve({product.id: count for product, count in shared.items()})
+                if before is None:
+                    raise ValueError("Some products are out of stock.")
+                reserved = shared
+                for product, count in shared.items():
+                    product._quantity_changed(before[product.id], before[product.id] - count)
+            for product, count in counts.items():
+                if ledger.tracks(product, self._store):
+                    ledger.adjust(product, self._store, -count)
+                elif product not in shared:
+                    product.quantity -= count
 
-            self._customer.accrue_cashback(self._total)
-            purchase = Purchase(self._store, self._products, self._cashier, self._customer, self._used_cashback)
             self._customer.add_purchase(purchase)
-            self._database.add_purchase(purchase)
-
+            self._database.add_purchases(purchase)
+            reserved = None
+            if earned is None:
+                self._database._pending_cashback.append((purchase, products, spent))
+            else:
+                self._customer.credit_cashback(earned, purchase.id, when)
+
+            self._cashier._record_sale(sum(counts.values()), self._total)
             self._status = "success"
             print("Payment successful.")
             return True
 
         except Exception as e:
+            if reserved:
+                inventory.release({product.id: count for product, count in reserved.items()})
+                for product, count in reserved.items():
+                    quantity = inventory.get(product.id)
+                    product._quantity_changed(quantity - count, quantity)
             self._status = "failed"
             print(f"Payment failed: {str(e)}")
             return False
@@ -1364,12 +5904,23 @@ class Purchase:
     """Represents a completed purchase made by a customer."""
 
     def __init__(self, store: Store, products: list[Product], cashier: Cashier,
-                 customer: Customer, used_cashback: int):
+                 customer: Customer, used_cashback: int, total: int | None = None, discount: int = 0,
+                 prices: dict | None = None):
         """Initialize a Purchase instance.
 
+        The products are captured as PurchaseLine snapshots, so the purchase
+        keeps what was sold even when the products change later, and does
+        not keep the Product instances alive.
+
         Args:
             customer (Customer): The customer who made the purchase.
-            products (list[Product]): List of purchased Product instances.
+            products (list[Product | PurchaseLine]): Purchased Product instances, one per unit,
+                or already captured lines.
+            used_cashback (int): Cashback the customer paid with; it is already withdrawn.
+            total (int | None): Total charged before cashback, as captured by the cart;
+                None sums the current product prices.
+            discount (int): Deal discount included in total.
+            prices (dict | None): Unit price of each product as charged; defaults to the current prices.
 
         Raises:
             TypeError: If inputs are not of correct types.
@@ -1384,21 +5935,30 @@ class Purchase:
         if not products:
             raise ValueError("Products list cannot be empty.")
         for product in products:
-            if not isinstance(product, Product):
+            if not isinstance(product, Product | PurchaseLine):
                 raise TypeError(f"Expected Product in products list, got {type(product).__name__}")
+        lines = _capture_lines(products, prices or {})
+        if total is None:
+            total = sum(line.unit_price * line.quantity for line in lines)
+        if not isinstance(total, int) or total < 0:
+            raise ValueError("Total must be a non-negative integer.")
+        if not isinstance(discount, int) or discount < 0:
+            raise ValueError("Discount must be a non-negative integer.")
         if not isinstance(used_cashback, int) or used_cashback < 0:
             raise ValueError("Cashback must be a non-negative integer.")
-        if used_cashback > customer.cashback:
-            raise ValueError("Cashback used exceeds available cashback.")
+        if used_cashback > total:
+            raise ValueError("Cashback used exceeds the purchase total.")
 
         self._id = None
         self._store = store
-        self._products = products
+        self._lines = lines
         self._cashier = cashier
         self._customer = customer
         self._used_cashback = used_cashback
         self._purchase_date = datetime.now()
-        self._total = sum(product.price for product in products)
+        self._total = total
+        self._discount = discount
+        self._revision = 0
         self._database = None
 
     @property
@@ -1413,8 +5973,13 @@ class Purchase:
 
     @property
     def products(self) -> tuple:
-        """tuple: Tuple of Product instances purchased."""
-        return tuple(self._products)
+        """tuple: PurchaseLine snapshots of the purchased products, one per product."""
+        return self._lines
+
+    @property
+    def cashier(self) -> 'Cashier':
+        """Cashier: The cashier who handled the purchase."""
+        return self._cashier
 
     @property
     def customer(self) -> 'Customer':
@@ -1428,14 +5993,93 @@ class Purchase:
 
     @property
     def total(self) -> int:
-        """int: The total cost of the purchase."""
+        """int: The total cost of the purchase before cashback."""
         return self._total
 
+    @property
+    def discount(self) -> int:
+        """int: The deal discount included in the total."""
+        return self._discount
+
     @property
     def purchase_date(self) -> datetime:
         """datetime: The date and time the purchase was made."""
         return self._purchase_date
 
+    @property
+    def revision(self) -> int:
+        """int: Number of times the purchase was amended."""
+        return self._revision
+
+    def amend(self, products: list | None = None, total: int | None = None, discount: int | None = None,
+              prices: dict | None = None):
+        """Correct the products or totals of the purchase, e.g. after a return.
+
+        Cached receipts of the purchase are invalidated and the customer's
+        lifetime spend is adjusted by the difference. An archived purchase is
+        written back to a new archive segment, so the correction survives
+        its eviction from the archive cache.
+
+        Args:
+            products (list[Product | PurchaseLine] | None): New products; None keeps the lines.
+            total (int | None): New total before cashback; None keeps it, or sums the new lines.
+            discount (int | None): New deal discount; None keeps it.
+            prices (dict | None): Unit price of each new product; defaults to the current prices.
+
+        Raises:
+            ValueError: If a value is invalid or the used cashback exceeds the new total.
+        """
+        lines = self._lines
+        if products is not None:
+            if not products:
+                raise ValueError("Products list cannot be empty.")
+            for product in products:
+                if not isinstance(product, Product | PurchaseLine):
+                    raise TypeError(f"Expected Product in products list, got {type(product).__name__}")
+            lines = _capture_lines(products, prices or {})
+            if total is None:
+                total = sum(line.unit_price * line.quantity for line in lines)
+        total = self._total if total is None else total
+        discount = self._discount if discount is None else discount
+        if not isinstance(total, int) or total < 0:
+            raise ValueError("Total must be a non-negative integer.")
+        if not isinstance(discount, int) or discount < 0:
+            raise ValueError("Discount must be a non-negative integer.")
+        if self._used_cashback > total:
+            raise ValueError("Cashback used exceeds the purchase total.")
+        archive = self._database._purchase_archive if self._database is not None else None
+        archived = archive is not None and self not in self._database._purchases and self._id in archive
+        if archived or self in self._customer._purchases:
+            self._customer._spent += total - self._total
+        if self._database is not None and self in self._database._purchases and lines is not self._lines:
+            lines = self._database._intern_lines(lines)
+            self._database._release_lines(self._lines)
+        affinity = self._database._affinity if self._database is not None else None
+        if affinity is not None and self._id in affinity and lines is not self._lines:
+            affinity.remove(self)
+            self._lines = lines
+            affinity.add(self)
+        self._lines = lines
+        self._total = total
+        self._discount = discount
+        self._revision += 1
+        if archived:
+            archive.write([self])
+        if self._database is not None:
+            self._database.receipt_renderer.invalidate(self._id)
+
+    def render(self, format: str = "text") -> str:
+        """Return the receipt as text or JSON, cached by the database renderer.
+
+        Args:
+            format (str): "text" or "json".
+
+        Returns:
+            str: The rendered receipt.
+        """
+        renderer = self._database.receipt_renderer if self._database is not None else ReceiptRenderer()
+        return renderer.render(self, format)
+
     def get_receipt(self) -> dict:
         """Return a dictionary representation of the purchase.
 
@@ -1447,8 +6091,9 @@ class Purchase:
             'store': self._store.to_dict(),
             'cashier': self._cashier.to_dict(),
             'customer': self._customer.to_dict(),
-            'products': [p.to_dict() for p in self._products],
+            'products': [line._asdict() for line in self._lines],
             'used_cashback': self._used_cashback,
+            'discount': self._discount,
             'purchase_date': self._purchase_date.isoformat(),
             'total': self._total
         }
@@ -1467,13 +6112,26 @@ class Purchase:
 
     def set_database(self, database: Database | None):
         if not isinstance(database, Database | None):
-            raise TypeError(f"Expected Database or None instance, got {type(Database).__name__}")
+            raise TypeError(f"Expected Database or None instance, got {type(database).__name__}")
+        if database is self._database:
+            return
+        if database is not None:
+            database._check_id("purchases", self)
         if self._database is not None:
-            self._database.remove_purchases(self)
+            if self._database._affinity is not None:
+                self._database._affinity.remove(self)
+            self._database._detach("purchases", self)
+            self._database._purchase_dates.remove(self)
+            self._database._release_lines(self._lines)
         self._database = database
         if database is not None:
-            if self not in self._database.purchases:
-                database.add_purchases(self)
+            database._attach("purchases", self)
+            database._purchase_dates.add(self)
+            self._lines = database._intern_lines(self._lines)
+            if database._affinity is not None:
+                database._affinity.add(self)
+            if database._sketches is not None:
+                database._sketches.add(self)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,468 @@
+"""Precompiled catalog cache for fast till startup.
+
+CatalogCache compiles the stores, categories and products of a Database into
+a single binary file of fixed-size records and a string table. Opening the
+cache memory-maps the file and creates the stores only; the categories and
+products of a store are materialized from their records the first time one
+of its child collections is accessed, without going through the validating
+constructors and linking methods (the data was validated when compiled).
+
+    CatalogCache("catalog.smc").save(database)          # back office
+    cache = CatalogCache("catalog.smc")                 # till
+    database = cache.open()
+    cart = ShoppingCart(cache.find_product_by_sku("4820000000017"), database)
+
+Stores linked by a category holding products of several stores are
+materialized together. Database-wide lookups of the opened database load the
+stores they need, and new categories and products get IDs after the cached
+ones. Benchmark the time from process start to the first
+checkout being ready against rebuilding the catalog from an SQLiteCatalog:
+
+    python store_management_catalog.py --stores 50 --products 200000
+"""
+import mmap
+import os
+import struct
+import sys
+from bisect import bisect_right
+
+from store_management import Category, Database, Product, Store
+
+_MAGIC = b"SMCAT\x00\x00\x02"
+_HEADER = struct.Struct("<8s6I8Q2q")
+_STORE = struct.Struct("<qIIIIIIi")
+_CATEGORY = struct.Struct("<qI")
+_PRODUCT = struct.Struct("<qIIqqiqB")
+_SKU = struct.Struct("<II")
+_ID = struct.Struct("<qI")
+_NONE = 0xFFFFFFFF
+
+
+def _align(buffer: bytearray) -> int:
+    """Pad a buffer to a multiple of 8 bytes and return its length."""
+    buffer.extend(bytes(-len(buffer) % 8))
+    return len(buffer)
+
+
+class CatalogCache:
+    """Compiles the catalog of a Database to a file and materializes it back on demand."""
+
+    def __init__(self, path: str):
+        """Initialize a CatalogCache.
+
+        Args:
+            path (str): Path of the cache file, created on first save.
+
+        Raises:
+            TypeError: If path is not a string.
+        """
+        if not isinstance(path, str):
+            raise TypeError("Path must be a string.")
+        self._path = path
+        self._file = None
+        self._map = None
+        self._database = None
+        self._header = None
+        self._offsets = None
+        self._stores = []
+        self._store_groups = {}
+        self._categories = {}
+        self._groups = {}
+        self._category_starts = []
+        self._product_starts = []
+        self._unassigned = (0, 0)
+
+    @property
+    def database(self) -> Database | None:
+        """Database | None: The database opened last."""
+        return self._database
+
+    @property
+    def pending(self) -> int:
+        """int: Number of opened stores whose children are not materialized yet."""
+        return sum(len(stores) for stores in self._groups.values())
+
+    def save(self, database: Database) -> None:
+        """Compile the stores, categories and products of a database into the cache file.
+
+        The file is written next to the old one and swapped in, so running tills keep their mapping.
+        Deferred stores of a database opened from this cache are materialized first.
+
+        Args:
+            database (Database): The database to compile.
+
+        Raises:
+            TypeError: If database is not a Database instance.
+            ValueError: If an ID, price, quantity or threshold does not fit in 64 bits.
+        """
+        if not isinstance(database, Database):
+            raise TypeError(f"Expected Database instance, got {type(database).__name__}")
+        if database is self._database:
+            self.load_all()
+        strings = {}
+
+        def string(text: str | None) -> int:
+            if text is None:
+                return _NONE
+            return strings.setdefault(text, len(strings))
+
+        stores = list(database.stores)
+        positions = {store: index for index, store in enumerate(stores)}
+        unassigned = len(stores)
+        categories = {store: [] for store in stores}
+        categories[None] = []
+        for category in database.categories:
+            categories[category.store if category.store in positions else None].append(category)
+        products = {store: [] for store in stores}
+        products[None] = []
+        for product in database.products:
+            products[product.store if product.store in positions else None].append(product)
+        ordered_categories = [category for group in categories.values() for category in group]
+        category_indexes = {category: index for index, category in enumerate(ordered_categories)}
+
+        parents = list(range(len(stores) + 1))
+
+        def root(node: int) -> int:
+            while parents[node] != node:
+                parents[node] = parents[parents[node]]
+                node = parents[node]
+            return node
+
+        for store, group in products.items():
+            for product in group:
+                if product.category in category_indexes:
+                    owner = product.category.store
+                    parents[root(positions.get(store, unassigned))] = root(positions.get(owner, unassigned))
+
+        try:
+            store_records = bytearray()
+            category_records = bytearray()
+            product_records = bytearray()
+            skus = []
+            category_start = product_start = 0
+            for index, store in enumerate([*stores, None]):
+                for category in categories[store]:
+                    category_records += _CATEGORY.pack(category.id, string(category.name))
+                for position, product in enumerate(products[store], product_start):
+                    threshold = product.low_stock_threshold
+                    if product.sku is not None:
+                        skus.append((product.sku, position))
+                    product_records += _PRODUCT.pack(
+                        product.id, string(product.name), string(product.sku), product.price, product.quantity,
+                        category_indexes.get(product.category, -1), threshold or 0, threshold is not None)
+                if store is not None:
+                    store_records += _STORE.pack(store.id, string(store.name), string(store.address),
+                                                 category_start, len(categories[store]),
+                                                 product_start, len(products[store]), root(index))
+                category_start += len(categories[store])
+                product_start += len(products[store])
+            sku_records = b"".join(_SKU.pack(string(sku), product) for sku, product in sorted(skus))
+            product_ids = sorted((product.id, position) for position, product in
+                                 enumerate(product for store in [*stores, None] for product in products[store]))
+            category_ids = sorted((category.id, position) for position, category in enumerate(ordered_categories))
+            product_id_records = b"".join(_ID.pack(*entry) for entry in product_ids)
+            category_id_records = b"".join(_ID.pack(*entry) for entry in category_ids)
+        except struct.error as error:
+            raise ValueError(f"Catalog value out of range: {error}") from None
+
+        blob = bytearray()
+        offsets = [0]
+        for text in strings:
+            blob += text.encode()
+            offsets.append(len(blob))
+        buffer = bytearray(_HEADER.size)
+        sections = []
+        for section in (struct.pack(f"<{len(offsets)}I", *offsets), blob, store_records,
+                        category_records, product_records, sku_records, product_id_records, category_id_records):
+            sections.append(_align(buffer))
+            buffer += section
+        _HEADER.pack_into(buffer, 0, _MAGIC, len(strings), len(stores), category_start, product_start,
+                          len(skus), root(unassigned), *sections,
+                          category_ids[-1][0] if category_ids else 0, product_ids[-1][0] if product_ids else 0)
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(buffer)
+        os.replace(temporary, self._path)
+
+    def open(self, name: str = "catalog") -> Database:
+        """Memory-map the cache file and open it as a new Database.
+
+        Stores are created right away; their categories and products are materialized on first access.
+        Categories and products without a store are materialized right away.
+
+        Args:
+            name (str): Name of the new database.
+
+        Returns:
+            Database: The opened database.
+
+        Raises:
+            ValueError: If the file is not a catalog cache.
+        """
+        self.close()
+        self._file = open(self._path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _HEADER.unpack_from(self._map, 0)
+        if header[0] != _MAGIC:
+            self.close()
+            raise ValueError(f"{self._path} is not a catalog cache.")
+        self._header = header
+        strings = header[1]
+        self._offsets = memoryview(self._map)[header[7]:header[7] + 4 * (strings + 1)].cast("I")
+        self._database = Database(name)
+        self._stores = []
+        self._store_groups = {}
+        self._categories = {}
+        self._groups = {}
+        self._category_starts = []
+        self._product_starts = []
+        self._unassigned = (0, 0)
+        self._database._last_ids['categories'] = header[15]
+        self._database._last_ids['products'] = header[16]
+        records = _STORE.iter_unpack(self._map[header[9]:header[9] + _STORE.size * header[2]])
+        for (store_id, store_name, address, category_start, category_count,
+             product_start, product_count, group) in records:
+            store = Store(self._string(store_name), self._string(address))
+            store._id = store_id
+            self._database.add_stores(store)
+            store._defer(self._load)
+            self._store_groups[store] = group
+            self._stores.append(store)
+            self._groups.setdefault(group, []).append(len(self._stores) - 1)
+            self._category_starts.append(category_start)
+            self._product_starts.append(product_start)
+            self._unassigned = (category_start + category_count, product_start + product_count)
+        self._materialize(header[6], True)
+        if self._groups:
+            self._database._catalog = self
+        return self._database
+
+    def close(self) -> None:
+        """Unmap the cache file; deferred stores of the opened database stay empty."""
+        if self._database is not None and self._database._catalog is self:
+            self._database._catalog = None
+        for indexes in self._groups.values():
+            for index in indexes:
+                store = self._stores[index]
+                store.__dict__.pop("_loader", None)
+                store._categories = {}
+                store._clear_products()
+        self._groups = {}
+        if self._offsets is not None:
+            self._offsets.release()
+            self._offsets = None
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+
+    def load_all(self) -> None:
+        """Materialize the children of every deferred store of the opened database."""
+        for group in list(self._groups):
+            self._materialize(group)
+
+    def find_product_by_sku(self, sku: str):
+        """Search the opened database for a product by SKU, materializing the stores that hold it.
+
+        Args:
+            sku (str): SKU or barcode to search for.
+
+        Returns:
+            Product | bool: The matching Product instance if found, otherwise False.
+        """
+        if self._database is None:
+            return False
+        return self._database.find_product_by_sku(sku)
+
+    def _search(self, offset: int, count: int, record: struct.Struct, key, value) -> int | None:
+        """Binary search a sorted table of (key, index) records and return the index stored for value."""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if key(record.unpack_from(self._map, offset + middle * record.size)[0]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count:
+            return None
+        found, index = record.unpack_from(self._map, offset + low * record.size)
+        return index if key(found) == value else None
+
+    def _load_holding(self, collection: str, key: str, value) -> None:
+        """Materialize the deferred stores holding the category or product whose key ("id" or "sku") equals value."""
+        if self._map is None:
+            return
+        header = self._header
+        if collection == "categories":
+            index = self._search(header[14], header[3], _ID, int, value) if key == "id" else None
+            starts, unassigned = self._category_starts, self._unassigned[0]
+        elif key == "sku":
+            index = self._search(header[12], header[5], _SKU, self._string, value)
+            starts, unassigned = self._product_starts, self._unassigned[1]
+        else:
+            index = self._search(header[13], header[4], _ID, int, value)
+            starts, unassigned = self._product_starts, self._unassigned[1]
+        if index is not None and index < unassigned:
+            self._load(self._stores[bisect_right(starts, index) - 1])
+
+    def _string(self, index: int) -> str | None:
+        """Decode a string of the string table."""
+        if index == _NONE:
+            return None
+        start = self._header[8]
+        return self._map[start + self._offsets[index]:start + self._offsets[index + 1]].decode()
+
+    def _load(self, store: Store) -> None:
+        """Materialize a deferred store together with the stores linked to it."""
+        store.__dict__.pop("_loader", None)
+        self._materialize(self._store_groups[store])
+
+    def _materialize(self, group: int, unassigned: bool = False) -> None:
+        """Create and link the categories and products of a group of stores, and the unassigned ones if asked."""
+        header = self._header
+        database = self._database
+        ranges = []
+        indexes = self._groups.pop(group, ())
+        if not self._groups and database._catalog is self:
+            database._catalog = None
+        for index in indexes:
+            store = self._stores[index]
+            store.__dict__.pop("_loader", None)
+            store._categories = {}
+            store._clear_products()
+            _, _, _, category_start, category_count, product_start, product_count, _ = _STORE.unpack_from(
+                self._map, header[9] + index * _STORE.size)
+            ranges.append((store, category_start, category_count, product_start, product_count))
+        if unassigned:
+            stores = len(self._stores)
+            category_start = product_start = 0
+            if stores:
+                _, _, _, category_start, category_count, product_start, product_count, _ = _STORE.unpack_from(
+                    self._map, header[9] + (stores - 1) * _STORE.size)
+                category_start += category_count
+                product_start += product_count
+            ranges.append((None, category_start, header[3] - category_start, product_start, header[4] - product_start))
+        category_template = {**Category("").__dict__, '_database': database}
+        product_template = {**Product("", 0, 0).__dict__, '_database': database}
+        for store, category_start, category_count, _, _ in ranges:
+            offset = header[10] + category_start * _CATEGORY.size
+            for position, (category_id, name) in enumerate(_CATEGORY.iter_unpack(
+                    self._map[offset:offset + category_count * _CATEGORY.size]), category_start):
+                category = Category.__new__(Category)
+                category.__dict__.update(category_template)
+                category._clear_products()
+                category._id = category_id
+                category._name = self._string(name)
+                category._store = store
+                database._check_id("categories", category)
+                if store is not None:
+                    store._categories[category] = None
+                database._attach("categories", category)
+                self._categories[position] = category
+        for store, _, _, product_start, product_count in ranges:
+            offset = header[11] + product_start * _PRODUCT.size
+            for product_id, name, sku, price, quantity, category, threshold, has_threshold in _PRODUCT.iter_unpack(
+                    self._map[offset:offset + product_count * _PRODUCT.size]):
+                product = Product.__new__(Product)
+                product.__dict__.update(product_template)
+                product._id = product_id
+                product._name = self._string(name)
+                product._sku = self._string(sku)
+                product._price = price
+                product._quantity = quantity
+                product._low_stock_threshold = threshold if has_threshold else None
+                product._store = store
+                database._check_id("products", product)
+                database._check_slot(product)
+                if product._sku is not None and product._sku in database._skus:
+                    raise ValueError(f"SKU {product._sku!r} is already registered to another product.")
+                database._attach_product(product)
+                if store is not None:
+                    store._attach_product(product)
+                if category >= 0:
+                    product._category = self._categories[category]
+                    product._category._attach_product(product)
+
+
+def _benchmark_database(stores: int, products: int) -> Database:
+    """Build a database with a generated catalog for the benchmark."""
+    database = Database("catalog")
+    shops = [Store(f"Store {number}", f"{number} street") for number in range(stores)]
+    database.add_stores(*shops)
+    for number, store in enumerate(shops):
+        categories = [Category(f"Category {number}-{index}") for index in range(20)]
+        database.add_categories(*categories)
+        store.add_category(*categories)
+        items = [Product(f"Product {code}", 10 + code % 500, 100, f"482{code:010d}")
+                 for code in range(number, products, stores)]
+        database.add_products(*items)
+        store.add_product(*items)
+        for index, product in enumerate(items):
+            categories[index % len(categories)].add_product(product)
+    return database
+
+
+def _child(mode: str, directory: str, sku: str) -> None:
+    """Start a till: load the catalog, open a cart with one product and report readiness."""
+    from store_management import ShoppingCart
+
+    if mode == "cache":
+        cache = CatalogCache(os.path.join(directory, "catalog.smc"))
+        database = cache.open()
+        product = cache.find_product_by_sku(sku)
+    else:
+        from store_management_sqlite import SQLiteCatalog
+
+        catalog = SQLiteCatalog(os.path.join(directory, "catalog.db"))
+        database = catalog.open()
+        catalog.load_all()
+        product = database.find_product_by_sku(sku)
+    ShoppingCart(product, database)
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+
+
+def main() -> None:
+    """Parse the command line, run the startup benchmark and print the report."""
+    import argparse
+    import subprocess
+    import tempfile
+    import time
+
+    from store_management_sqlite import SQLiteCatalog
+
+    parser = argparse.ArgumentParser(description="Benchmark till startup with and without the catalog cache.")
+    parser.add_argument("--stores", type=int, default=50, help="generated stores")
+    parser.add_argument("--products", type=int, default=200000, help="generated products")
+    parser.add_argument("--runs", type=int, default=3, help="startups per mode, the best is reported")
+    options = parser.parse_args()
+
+    database = _benchmark_database(options.stores, options.products)
+    sku = database.products[len(database.products) // 2].sku
+    with tempfile.TemporaryDirectory() as directory:
+        SQLiteCatalog(os.path.join(directory, "catalog.db")).save(database)
+        CatalogCache(os.path.join(directory, "catalog.smc")).save(database)
+        print(f"{options.stores} stores, {options.products} products, "
+              f"cache {os.path.getsize(os.path.join(directory, 'catalog.smc')) / 2 ** 20:.1f} MiB")
+        results = {}
+        for mode in ("rebuild", "cache"):
+            best = None
+            for _ in range(options.runs):
+                started = time.perf_counter()
+                child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", mode, directory, sku],
+                                         stdout=subprocess.PIPE, text=True)
+                if child.stdout.readline() != "ready\n":
+                    raise RuntimeError(f"{mode} startup failed.")
+                elapsed = time.perf_counter() - started
+                child.wait()
+                best = elapsed if best is None else min(best, elapsed)
+            results[mode] = best
+            print(f"{mode:8} process start to first checkout ready: {best * 1000:.0f} ms")
+        print(f"speed-up {results['rebuild'] / results['cache']:.1f}x")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        _child(*sys.argv[2:5])
+    else:
+        main()
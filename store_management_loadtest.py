@@ -0,0 +1,112 @@
+"""Load test for store_management_service against localhost.
+
+Starts a demo server in a subprocess, runs concurrent simulated tills that
+open a cart, scan a few items, attach a customer and pay, and reports the
+p50/p99 latency of the whole checkout and of the payment request alone.
+
+    python store_management_loadtest.py --tills 32 --checkouts 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from store_management_service import ServiceClient
+
+
+def _percentile(samples: list, percent: float) -> float:
+    """Return the nearest-rank percentile of sorted samples."""
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def _free_port() -> int:
+    """Return a free localhost TCP port."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for(port: int, timeout: float = 30.0) -> None:
+    """Wait until a server accepts connections on a localhost port."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def _till(client: ServiceClient, checkouts: int, products: int, customers: int,
+                basket: int, seed: int, totals: list, payments: list) -> None:
+    """Run checkouts one after another, recording their latencies in seconds."""
+    rng = random.Random(seed)
+    for _ in range(checkouts):
+        skus = [f"SKU{rng.randint(1, products)}" for _ in range(basket)]
+        started = time.perf_counter()
+        cart_id = await client.open_cart(1, 1, sku=skus[0])
+        for sku in skus[1:]:
+            await client.add(cart_id, sku=sku)
+        await client.call("customer", cart_id=cart_id, phone=380990000001 + rng.randrange(customers))
+        paying = time.perf_counter()
+        result = await client.call("checkout", cart_id=cart_id, card_number=1234567812345678,
+                                   expiration_date=[12, 2030], cvv=123)
+        finished = time.perf_counter()
+        if result['status'] != "success":
+            raise RuntimeError(f"Checkout failed: {result}")
+        totals.append(finished - started)
+        payments.append(finished - paying)
+
+
+async def run(port: int, tills: int, checkouts: int, pool_size: int, basket: int) -> dict:
+    """Run the load test against a server on localhost and return latency statistics in milliseconds."""
+    totals, payments = [], []
+    async with ServiceClient("127.0.0.1", port, pool_size) as client:
+        started = time.perf_counter()
+        per_till = max(1, checkouts // tills)
+        await asyncio.gather(*(_till(client, per_till, 1000, 100, basket, seed, totals, payments)
+                               for seed in range(tills)))
+        elapsed = time.perf_counter() - started
+    totals.sort()
+    payments.sort()
+    return {
+        'checkouts': len(totals),
+        'throughput': len(totals) / elapsed,
+        'checkout_p50': _percentile(totals, 50) * 1000,
+        'checkout_p99': _percentile(totals, 99) * 1000,
+        'payment_p50': _percentile(payments, 50) * 1000,
+        'payment_p99': _percentile(payments, 99) * 1000,
+    }
+
+
+def main() -> None:
+    """Parse the command line, run the load test and print the report."""
+    parser = argparse.ArgumentParser(description="Load test a store_management service on localhost.")
+    parser.add_argument("--tills", type=int, default=16, help="concurrent simulated tills")
+    parser.add_argument("--checkouts", type=int, default=2000, help="total checkouts")
+    parser.add_argument("--pool", type=int, default=4, help="client connection pool size")
+    parser.add_argument("--basket", type=int, default=5, help="items per cart")
+    options = parser.parse_args()
+
+    port = _free_port()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "store_management_service.py")
+    server = subprocess.Popen([sys.executable, script, "--demo", "--port", str(port)], stdout=subprocess.DEVNULL)
+    try:
+        _wait_for(port)
+        stats = asyncio.run(run(port, options.tills, options.checkouts, options.pool, options.basket))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{stats['checkouts']} checkouts, {stats['throughput']:.0f} checkouts/s")
+    print(f"checkout  p50 {stats['checkout_p50']:.2f} ms  p99 {stats['checkout_p99']:.2f} ms")
+    print(f"payment   p50 {stats['payment_p50']:.2f} ms  p99 {stats['payment_p99']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
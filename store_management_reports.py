@@ -0,0 +1,279 @@
+"""Parallel end-of-day reports over a store_management Database.
+
+ReportEngine selects the purchases of the report window through the
+purchase date index, splits them into partitions and aggregates every
+partition in a concurrent.futures process pool. Each partition is exported
+to columns (Database.to_columns) by the worker that aggregates it when the
+pool forks; other start methods export in the parent and send the columns.
+Workers return plain partial sums that are merged in partition order, so the
+report is the same whatever the number of workers.
+
+Partitions are either contiguous date ranges of the purchase history or
+groups of stores. Archived purchases are left out unless the report is run
+with archived=True, which rebuilds them from the archive.
+
+Benchmark the scaling across cores with:
+
+    python store_management_reports.py --purchases 200000 --workers 1 2 4
+
+The speed-up is only measurable with at least as many usable cores as workers.
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from store_management import Database
+
+# (database, partitions) inherited by forked workers of the running report.
+_inherited = None
+
+
+def _export(database: Database, purchases: list) -> tuple:
+    """Export purchases and their line items as purchase and line columns."""
+    columns = database.to_columns(("purchases", "lines"), numpy=False, purchases=purchases)
+    return columns['purchases'], columns['lines']
+
+
+def _aggregate_inherited(index: int, since: float | None, until: float | None) -> dict:
+    """Export and aggregate a partition inherited from the forking parent."""
+    database, partitions = _inherited
+    return _aggregate(*_export(database, partitions[index]), since, until)
+
+
+def _aggregate(purchases: dict, lines: dict, since: float | None, until: float | None) -> dict:
+    """Aggregate one partition of purchase and line columns into partial sums."""
+    stores = {}
+    cashiers = {}
+    products = {}
+    used = 0
+    position = 0
+    product_ids = lines['product_id']
+    unit_prices = lines['unit_price']
+    quantities = lines['quantity']
+    for store, cashier, date, total, cashback, count in zip(
+            purchases['store_id'], purchases['cashier_id'], purchases['purchase_date'],
+            purchases['total'], purchases['used_cashback'], purchases['line_count']):
+        start, position = position, position + count
+        if since is not None and date < since or until is not None and date >= until:
+            continue
+        items = 0
+        for index in range(start, position):
+            quantity = quantities[index]
+            items += quantity
+            entry = products.get(product_ids[index])
+            if entry is None:
+                products[product_ids[index]] = [quantity, quantity * unit_prices[index]]
+            else:
+                entry[0] += quantity
+                entry[1] += quantity * unit_prices[index]
+        entry = stores.get(store)
+        if entry is None:
+            stores[store] = [1, total, cashback]
+        else:
+            entry[0] += 1
+            entry[1] += total
+            entry[2] += cashback
+        entry = cashiers.get(cashier)
+        if entry is None:
+            cashiers[cashier] = [1, total - cashback, items]
+        else:
+            entry[0] += 1
+            entry[1] += total - cashback
+            entry[2] += items
+        used += cashback
+    return {'stores': stores, 'cashiers': cashiers, 'products': products, 'used_cashback': used}
+
+
+def _merge(partials: list) -> dict:
+    """Sum partial aggregates in order."""
+    merged = {'stores': {}, 'cashiers': {}, 'products': {}, 'used_cashback': 0}
+    for partial in partials:
+        for key in ('stores', 'cashiers', 'products'):
+            target = merged[key]
+            for entity_id, values in partial[key].items():
+                entry = target.get(entity_id)
+                if entry is None:
+                    target[entity_id] = list(values)
+                else:
+                    for index, value in enumerate(values):
+                        entry[index] += value
+        merged['used_cashback'] += partial['used_cashback']
+    return merged
+
+
+class ReportEngine:
+    """Computes end-of-day reports on a process pool.
+
+    Reports contain revenue per store, top products, cashier performance and
+    the outstanding cashback liability, keyed by entity ID.
+    """
+
+    PARTITIONS = ("time", "store")
+
+    def __init__(self, database: Database, workers: int | None = None, partition: str = "time",
+                 context: str | None = None):
+        """Initialize a ReportEngine.
+
+        Args:
+            database (Database): The database to report on.
+            workers (int | None): Number of worker processes, defaulting to the number of CPU cores;
+                1 aggregates in the calling process.
+            partition (str): "time" for contiguous slices of the purchase history, "store" for groups of stores.
+            context (str | None): multiprocessing start method, e.g. "spawn".
+
+        Raises:
+            TypeError: If database is not a Database instance.
+            ValueError: If workers is not a positive integer or partition is unknown.
+        """
+        if not isinstance(database, Database):
+            raise TypeError(f"Expected Database instance, got {type(database).__name__}")
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if not isinstance(workers, int) or workers <= 0:
+            raise ValueError("workers must be a positive integer.")
+        if partition not in self.PARTITIONS:
+            raise ValueError(f"Unknown partition {partition!r}.")
+        self._database = database
+        self._workers = workers
+        self._partition = partition
+        self._context = context
+
+    @property
+    def workers(self) -> int:
+        """int: Number of worker processes."""
+        return self._workers
+
+    def _select(self, since: datetime | None, until: datetime | None, archived: bool) -> list:
+        """Return the purchases made in [since, until) in date order, rebuilding archived ones if asked."""
+        database = self._database
+        selected = [purchase for purchase in database._purchase_dates.range(since, until)
+                    if until is None or purchase.purchase_date < until]
+        archive = database.purchase_archive
+        if archived and archive is not None:
+            old = [archive.load(stub.id, database) for stub in archive.stubs
+                   if (since is None or stub.purchase_date >= since)
+                   and (until is None or stub.purchase_date < until)]
+            selected = sorted(old + selected, key=lambda purchase: purchase.purchase_date)
+        return selected
+
+    @staticmethod
+    def _time_partitions(purchases: list, count: int) -> list:
+        """Split purchases in date order into at most count contiguous date ranges."""
+        bounds = [len(purchases) * part // count for part in range(count + 1)]
+        return [purchases[start:stop] for start, stop in zip(bounds, bounds[1:]) if start != stop]
+
+    @staticmethod
+    def _store_partitions(purchases: list, count: int) -> list:
+        """Split purchases into at most count groups of stores (store ID modulo count)."""
+        groups = {}
+        for purchase in purchases:
+            store = purchase._store
+            store_id = -1 if store is None or store._id is None else store._id
+            groups.setdefault(store_id % count, []).append(purchase)
+        return [group for _, group in sorted(groups.items())]
+
+    def _aggregate_partitions(self, partitions: list, bounds: tuple) -> list:
+        """Export and aggregate every partition, on the process pool when there are several."""
+        global _inherited
+        if self._workers == 1 or len(partitions) <= 1:
+            return [_aggregate(*_export(self._database, part), *bounds) for part in partitions]
+        context = multiprocessing.get_context(self._context)
+        with ProcessPoolExecutor(len(partitions), context) as pool:
+            if context.get_start_method() == "fork":
+                _inherited = (self._database, partitions)
+                try:
+                    futures = [pool.submit(_aggregate_inherited, index, *bounds)
+                               for index in range(len(partitions))]
+                finally:
+                    _inherited = None
+            else:
+                futures = [pool.submit(_aggregate, *_export(self._database, part), *bounds)
+                           for part in partitions]
+            return [future.result() for future in futures]
+
+    def run(self, since: datetime | None = None, until: datetime | None = None, top: int = 10,
+            archived: bool = False) -> dict:
+        """Compute the reports.
+
+        Only the purchases of the [since, until) window are selected and exported.
+
+        Args:
+            since (datetime | None): Include purchases made at or after this time.
+            until (datetime | None): Include purchases made before this time.
+            top (int): Number of top products to report.
+            archived (bool): Include archived purchases, rebuilding them from the purchase archive.
+
+        Returns:
+            dict: "revenue_per_store", "top_products", "cashier_performance" and "cashback_liability".
+        """
+        purchases = self._select(since, until, archived)
+        split = self._time_partitions if self._partition == "time" else self._store_partitions
+        partitions = split(purchases, self._workers)
+        bounds = (None if since is None else since.timestamp(), None if until is None else until.timestamp())
+        merged = _merge(self._aggregate_partitions(partitions, bounds))
+        balances = self._database.to_columns(("customers",), numpy=False)['customers']['cashback']
+        return {
+            'revenue_per_store': {
+                store: {'purchases': count, 'gross': gross, 'cashback_used': used, 'net': gross - used}
+                for store, (count, gross, used) in sorted(merged['stores'].items())},
+            'top_products': [
+                {'product_id': product, 'quantity': quantity, 'revenue': revenue}
+                for product, (quantity, revenue) in sorted(merged['products'].items(),
+                                                           key=lambda item: (-item[1][0], -item[1][1], item[0]))[:top]],
+            'cashier_performance': {
+                cashier: {'purchases': count, 'revenue': revenue, 'items': items,
+                          'average': revenue / count if count else 0}
+                for cashier, (count, revenue, items) in sorted(merged['cashiers'].items())},
+            'cashback_liability': {
+                'outstanding': sum(balances),
+                'customers': sum(1 for balance in balances if balance > 0),
+                'used': merged['used_cashback']},
+        }
+
+
+def _benchmark_database(purchases: int, stores: int = 8) -> Database:
+    """Build a database with generated purchases for the benchmark."""
+    from store_management import Cashier, Customer, Product, Purchase, Store
+
+    database = Database("reports")
+    cashiers = [Cashier("Cashier", f"No{number}", f"38099000{number:04d}") for number in range(stores)]
+    database.add_cashiers(*cashiers)
+    customers = [Customer("Customer", f"No{number}", 380990100000 + number) for number in range(1000)]
+    database.add_customers(*customers)
+    shops = [Store(f"Store {number}", f"{number} street") for number in range(stores)]
+    database.add_stores(*shops)
+    products = [Product(f"Product {number}", 10 + number % 500, 10 ** 9) for number in range(2000)]
+    database.add_products(*products)
+    for number in range(purchases):
+        basket = [products[(number * step) % len(products)] for step in range(1, 8)]
+        purchase = Purchase(shops[number % stores], basket, cashiers[number % stores],
+                            customers[number % len(customers)], 0)
+        database.add_purchases(purchase)
+    return database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel report generation.")
+    parser.add_argument("--purchases", type=int, default=200000, help="generated purchases")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--partition", choices=ReportEngine.PARTITIONS, default="time")
+    options = parser.parse_args()
+    database = _benchmark_database(options.purchases)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    print(f"{options.purchases} purchases, {cores} usable CPU cores")
+    if cores < max(options.workers):
+        print(f"Only {cores} usable cores: speed-ups above {cores} workers cannot be measured here.")
+    baseline = None
+    for workers in options.workers:
+        engine = ReportEngine(database, workers, options.partition)
+        started = time.perf_counter()
+        report = engine.run()
+        elapsed = time.perf_counter() - started
+        if baseline is None:
+            baseline = (elapsed, report)
+        elif report != baseline[1]:
+            raise RuntimeError("Reports differ between worker counts.")
+        print(f"{workers} workers: {elapsed:.2f} s  speed-up {baseline[0] / elapsed:.2f}x")
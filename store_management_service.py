@@ -0,0 +1,427 @@
+"""Network service front-end for a store_management Database.
+
+The service speaks a compact framed protocol over TCP: every message is a
+4-byte big-endian length followed by a JSON object. Requests look like
+{"id": 1, "op": "open_cart", "args": {...}} and replies like
+{"id": 1, "ok": true, "result": ...} or {"id": 1, "ok": false, "error": "..."}.
+Requests on one connection are answered in order, so clients may pipeline
+several requests before reading the replies. A checkout is refused when an
+operation on the cart failed since the last checkout, so a pipelined checkout
+never pays for a partial cart. Frames longer than MAX_FRAME_SIZE bytes drop the
+connection, and the carts a connection opened are voided when it closes.
+
+Run a demo server with:  python store_management_service.py --demo --port 8765
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import struct
+
+from store_management import Cashier, Category, Customer, Database, Product, ShoppingCart, Store
+
+_header = struct.Struct(">I")
+
+MAX_FRAME_SIZE = 1 << 20
+
+
+def _encode(message: dict) -> bytes:
+    """Frame a message as length-prefixed compact JSON."""
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    return _header.pack(len(payload)) + payload
+
+
+async def _read(reader: asyncio.StreamReader, max_size: int = MAX_FRAME_SIZE) -> dict | None:
+    """Read one framed message, or return None at end of stream, including a truncated last message.
+
+    Raises:
+        ValueError: If the frame is longer than max_size bytes or is not valid JSON.
+    """
+    try:
+        header = await reader.readexactly(_header.size)
+        size = _header.unpack(header)[0]
+        if size > max_size:
+            raise ValueError(f"Frame of {size} bytes exceeds the limit of {max_size} bytes.")
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(payload)
+
+
+class StoreService:
+    """asyncio TCP server exposing catalog lookup, cart building and checkout.
+
+    All requests run on the event loop thread, so the Database is never used
+    concurrently.
+    """
+
+    def __init__(self, database: Database, max_frame_size: int = MAX_FRAME_SIZE):
+        """Initialize a StoreService.
+
+        Args:
+            database (Database): The database to serve.
+            max_frame_size (int): Longest request frame in bytes; a longer one drops the connection.
+
+        Raises:
+            TypeError: If database is not a Database instance.
+            ValueError: If max_frame_size is not a positive integer.
+        """
+        if not isinstance(database, Database):
+            raise TypeError(f"Expected Database instance, got {type(database).__name__}")
+        if not isinstance(max_frame_size, int) or max_frame_size <= 0:
+            raise ValueError("max_frame_size must be a positive integer.")
+        self._database = database
+        self._max_frame_size = max_frame_size
+        self._carts = {}
+        self._failed = set()
+        self._cart_ids = itertools.count(1)
+        self._server = None
+
+    @property
+    def database(self) -> Database:
+        """Database: The served database."""
+        return self._database
+
+    def _product(self, product_id: int | None = None, sku: str | None = None) -> Product:
+        """Resolve a product by ID or SKU."""
+        product = (self._database.find_product_by_id(product_id) if sku is None
+                   else self._database.find_product_by_sku(sku))
+        if not product:
+            raise ValueError("Product not found.")
+        return product
+
+    def op_product(self, product_id: int | None = None, sku: str | None = None) -> dict:
+        """Return a product by ID or SKU."""
+        return self._product(product_id, sku).to_dict()
+
+    def op_search(self, store_id: int, query: str, mode: str = "prefix", limit: int = 20) -> list:
+        """Search the products of a store by name."""
+        store = self._database.find_store_by_id(store_id)
+        if not store:
+            raise ValueError("Store not found.")
+        return [product.to_dict() for product in store.search_products(query, mode, limit=limit)]
+
+    def op_open_cart(self, store_id: int, cashier_id: int, product_id: int | None = None,
+                     sku: str | None = None) -> int:
+        """Open a cart with a first product and return its ID."""
+        cart = ShoppingCart(self._product(product_id, sku), self._database)
+        cart.store = self._database.find_store_by_id(store_id)
+        cart.cashier = self._database.find_cashier_by_id(cashier_id)
+        cart_id = next(self._cart_ids)
+        cart._id = cart_id
+        self._carts[cart_id] = cart
+        return cart_id
+
+    def op_add(self, cart_id: int, product_id: int | None = None, sku: str | None = None) -> int:
+        """Add a product to a cart and return the cart total."""
+        cart = self._carts[cart_id]
+        cart.add_product(self._product(product_id, sku))
+        return cart.total
+
+    def op_quantity(self, cart_id: int, quantity: int, product_id: int | None = None,
+                    sku: str | None = None) -> int:
+        """Change the quantity of a product in a cart and return the cart total."""
+        cart = self._carts[cart_id]
+        cart.set_quantity(self._product(product_id, sku), quantity)
+        return cart.total
+
+    def op_void(self, cart_id: int) -> bool:
+        """Cancel and close a cart."""
+        self._carts[cart_id].void()
+        self._close_cart(cart_id)
+        return True
+
+    def _close_cart(self, cart_id: int) -> None:
+        """Forget a paid or voided cart."""
+        del self._carts[cart_id]
+        self._failed.discard(cart_id)
+
+    def op_customer(self, cart_id: int, phone: int) -> bool:
+        """Assign a customer to a cart by phone number."""
+        return self._carts[cart_id].add_customer(phone)
+
+    def op_cashback(self, cart_id: int, amount: int) -> bool:
+        """Apply cashback of the cart customer."""
+        return self._carts[cart_id].withdraw_cashback(amount)
+
+    def op_checkout(self, cart_id: int, card_number: int, expiration_date: list, cvv: int) -> dict:
+        """Pay for a cart and close it once paid; a failed cart stays open for a retry.
+
+        The checkout is refused if an operation on the cart failed since the
+        last checkout, e.g. an add pipelined ahead of it; the next checkout is accepted.
+        """
+        cart = self._carts[cart_id]
+        if cart_id in self._failed:
+            self._failed.discard(cart_id)
+            raise ValueError("An operation on the cart failed since the last checkout.")
+        if cart.make_payment(card_number, expiration_date, cvv):
+            self._close_cart(cart_id)
+        return {'status': cart.status, 'total': cart.total}
+
+    def op_receipt(self, purchase_id: int, format: str = "text") -> str:
+        """Return the receipt of a purchase as text or JSON."""
+        purchase = self._database.find_purchase_by_id(purchase_id)
+        if not purchase:
+            raise ValueError("Purchase not found.")
+        return purchase.render(format)
+
+    def dispatch(self, request: dict) -> dict:
+        """Execute one decoded request and build its reply.
+
+        A failed operation on an open cart, other than checkout, marks the cart
+        so that its next checkout is refused.
+        """
+        args = request.get('args', {})
+        try:
+            handler = getattr(self, f"op_{request['op']}", None)
+            if handler is None:
+                raise ValueError(f"Unknown operation {request['op']!r}.")
+            return {'id': request.get('id'), 'ok': True, 'result': handler(**args)}
+        except Exception as e:
+            cart_id = args.get('cart_id') if isinstance(args, dict) else None
+            if request.get('op') != "checkout" and cart_id in self._carts:
+                self._failed.add(cart_id)
+            return {'id': request.get('id'), 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    def _evict(self, cart_ids) -> None:
+        """Void the carts of a closed connection that are still open."""
+        for cart_id in cart_ids:
+            if cart_id in self._carts:
+                self._carts[cart_id].void()
+                self._close_cart(cart_id)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve one client connection until it is closed, then void the carts it left open.
+
+        A frame over the size limit or a malformed frame drops the connection.
+        """
+        opened = set()
+        try:
+            while (request := await _read(reader, self._max_frame_size)) is not None:
+                reply = self.dispatch(request)
+                if reply['ok'] and request.get('op') == "open_cart":
+                    opened.add(reply['result'])
+                elif request.get('op') in ("checkout", "void"):
+                    opened.intersection_update(self._carts)
+                writer.write(_encode(reply))
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._evict(opened)
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        """Start listening for connections."""
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        """Start the server and serve until cancelled."""
+        await self.start(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        """Stop listening and wait for the server to close."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class _Connection:
+    """One client connection with pipelined requests matched to replies by ID."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Initialize a _Connection and start reading replies."""
+        self._reader = reader
+        self._writer = writer
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._reader_task = asyncio.create_task(self._read_replies())
+
+    async def _read_replies(self) -> None:
+        """Resolve pending requests as their replies arrive."""
+        try:
+            while (reply := await _read(self._reader)) is not None:
+                future = self._pending.pop(reply['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+            error = ConnectionError("Connection closed by the server.")
+        except Exception as e:
+            error = e
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    def send(self, op: str, args: dict) -> asyncio.Future:
+        """Write a request without waiting and return a future for its reply."""
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(_encode({'id': request_id, 'op': op, 'args': args}))
+        return future
+
+    async def close(self) -> None:
+        """Close the connection."""
+        self._writer.close()
+        await self._reader_task
+
+
+class ServiceClient:
+    """asyncio client for StoreService with a pool of pipelined connections.
+
+    Requests are spread over the pool round-robin; concurrent requests on a
+    connection are pipelined rather than waiting for each other.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, pool_size: int = 4):
+        """Initialize a ServiceClient; connections are opened on first use.
+
+        Args:
+            host (str): Server host.
+            port (int): Server port.
+            pool_size (int): Number of pooled connections.
+
+        Raises:
+            ValueError: If pool_size is not a positive integer.
+        """
+        if not isinstance(pool_size, int) or pool_size <= 0:
+            raise ValueError("pool_size must be a positive integer.")
+        self._host = host
+        self._port = port
+        self._pool = [None] * pool_size
+        self._next = itertools.cycle(range(pool_size))
+        self._lock = None
+
+    async def __aenter__(self) -> 'ServiceClient':
+        """Return the client for use in an async with statement."""
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Close the pool when leaving an async with statement."""
+        await self.close()
+
+    async def _connection(self) -> _Connection:
+        """Return the next pooled connection, opening it if needed."""
+        slot = next(self._next)
+        if self._pool[slot] is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._pool[slot] is None:
+                    self._pool[slot] = _Connection(*await asyncio.open_connection(self._host, self._port))
+        return self._pool[slot]
+
+    @staticmethod
+    def _result(reply: dict):
+        """Return the result of a reply or raise its error."""
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    async def call(self, op: str, **args):
+        """Send one request and return its result.
+
+        Raises:
+            RuntimeError: If the service reports an error.
+        """
+        connection = await self._connection()
+        return self._result(await connection.send(op, args))
+
+    async def pipeline(self, requests: list) -> list:
+        """Send several (op, args) requests on one connection back to back and return their results in order.
+
+        Raises:
+            RuntimeError: If the service reports an error for any request.
+        """
+        connection = await self._connection()
+        futures = [connection.send(op, args) for op, args in requests]
+        return [self._result(reply) for reply in await asyncio.gather(*futures)]
+
+    async def product(self, product_id: int | None = None, sku: str | None = None) -> dict:
+        """Look up a product by ID or SKU."""
+        return await self.call("product", product_id=product_id, sku=sku)
+
+    async def search(self, store_id: int, query: str, mode: str = "prefix", limit: int = 20) -> list:
+        """Search the products of a store by name."""
+        return await self.call("search", store_id=store_id, query=query, mode=mode, limit=limit)
+
+    async def open_cart(self, store_id: int, cashier_id: int, product_id: int | None = None,
+                        sku: str | None = None) -> int:
+        """Open a cart and return its ID."""
+        return await self.call("open_cart", store_id=store_id, cashier_id=cashier_id,
+                               product_id=product_id, sku=sku)
+
+    async def add(self, cart_id: int, product_id: int | None = None, sku: str | None = None) -> int:
+        """Add a product to a cart and return the cart total."""
+        return await self.call("add", cart_id=cart_id, product_id=product_id, sku=sku)
+
+    async def receipt(self, purchase_id: int, format: str = "text") -> str:
+        """Return the receipt of a purchase as text or JSON."""
+        return await self.call("receipt", purchase_id=purchase_id, format=format)
+
+    async def checkout(self, cart_id: int, card_number: int, expiration_date: list, cvv: int,
+                       phone: int | None = None, skus: tuple = ()) -> dict:
+        """Add the remaining items and the customer, then pay, in one pipelined round trip.
+
+        The service refuses the checkout if any of the operations sent ahead of
+        it failed, so a partial cart is never paid; the cart stays open.
+
+        Raises:
+            RuntimeError: With the error of the first failed operation.
+        """
+        requests = [("add", {'cart_id': cart_id, 'sku': sku}) for sku in skus]
+        if phone is not None:
+            requests.append(("customer", {'cart_id': cart_id, 'phone': phone}))
+        requests.append(("checkout", {'cart_id': cart_id, 'card_number': card_number,
+                                      'expiration_date': expiration_date, 'cvv': cvv}))
+        return (await self.pipeline(requests))[-1]
+
+    async def close(self) -> None:
+        """Close every pooled connection."""
+        for connection in self._pool:
+            if connection is not None:
+                await connection.close()
+        self._pool = [None] * len(self._pool)
+
+
+def demo_database(stores: int = 4, products: int = 1000, customers: int = 100) -> Database:
+    """Build a database with demo stores, products, a cashier and customers.
+
+    Product SKUs are "SKU<product id>" and customer phones are 380990000000 + customer id.
+    """
+    database = Database("demo")
+    database.add_cashiers(Cashier("Demo", "Cashier", "380990000000"))
+    for number in range(stores):
+        store = Store(f"Store {number + 1}", f"{number + 1} Demo street")
+        category = Category("General")
+        database.add_stores(store)
+        database.add_categories(category)
+        store.add_category(category)
+    for number in range(products):
+        store = database.stores[number % stores]
+        product = Product(f"Product {number + 1}", 10 + number % 500, 10 ** 9, f"SKU{number + 1}")
+        database.add_products(product)
+        store.add_product(product)
+        store.categories[0].add_product(product)
+    database.add_customers(*(Customer("Demo", f"Customer{number + 1}", 380990000001 + number)
+                             for number in range(customers)))
+    return database
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a store_management database over TCP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--demo", action="store_true", help="serve a generated demo catalog")
+    options = parser.parse_args()
+    service = StoreService(demo_database() if options.demo else Database("service"))
+    print(f"Serving on {options.host}:{options.port}", flush=True)
+    try:
+        asyncio.run(service.serve_forever(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
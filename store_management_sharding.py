@@ -0,0 +1,453 @@
+"""Sharded deployment of store_management across worker processes.
+
+Stores are partitioned across shards by store ID; each shard is a separate
+process owning a regular Database with the stores, categories, products and
+carts of its partition. ShardedDatabase is the router front-end: it assigns
+chain-wide IDs, dispatches cart operations to the shard owning the store and
+answers chain-wide questions by scatter-gather over all shards.
+
+Customers and cashiers are replicated to every shard. The cashback balance
+of a customer rests on their home shard (customer ID modulo the number of
+shards): the router moves it to the shard of a cart before it is spent there
+and moves whatever is left or earned back after the operation. Purchases get
+chain-wide IDs from the router.
+"""
+import multiprocessing
+import os
+import threading
+
+from store_management import Cashier, Category, Customer, Database, Product, SalesSketches, ShoppingCart, Store
+
+
+class Shard:
+    """Partition of the chain living inside one worker process."""
+
+    def __init__(self, index: int):
+        """Initialize an empty Shard.
+
+        Args:
+            index (int): Position of the shard in the router.
+        """
+        self._database = Database(f"shard-{index}")
+        self._carts = {}
+
+    @property
+    def database(self) -> Database:
+        """Database: The database holding the partition."""
+        return self._database
+
+    def add_store(self, store_id: int, name: str, address: str) -> None:
+        """Create a store with a chain-wide ID."""
+        store = Store(name, address)
+        store._id = store_id
+        self._database.add_stores(store)
+
+    def add_category(self, category_id: int, store_id: int, name: str) -> None:
+        """Create a category in a store of the shard."""
+        category = Category(name)
+        category._id = category_id
+        self._database.add_categories(category)
+        self._database.find_store_by_id(store_id).add_category(category)
+
+    def add_product(self, product_id: int, store_id: int, name: str, price: int, quantity: int,
+                    sku: str | None, category_id: int | None) -> None:
+        """Create a product in a store (and optionally a category) of the shard."""
+        product = Product(name, price, quantity, sku)
+        product._id = product_id
+        self._database.add_products(product)
+        self._database.find_store_by_id(store_id).add_product(product)
+        if category_id is not None:
+            self._database.find_category_by_id(category_id).add_product(product)
+
+    def add_customer(self, customer_id: int, name: str, surname: str, phone: int) -> None:
+        """Register a replica of a customer."""
+        customer = Customer(name, surname, phone)
+        customer._id = customer_id
+        self._database.add_customers(customer)
+
+    def add_cashier(self, cashier_id: int, name: str, surname: str, phone: str) -> None:
+        """Register a replica of a cashier."""
+        cashier = Cashier(name, surname, phone)
+        cashier._id = cashier_id
+        self._database.add_cashiers(cashier)
+
+    def open_cart(self, cart_id: int, store_id: int, product_id: int, cashier_id: int) -> None:
+        """Open a cart in a store of the shard."""
+        cart = ShoppingCart(self._database.find_product_by_id(product_id), self._database)
+        cart._id = cart_id
+        cart.store = self._database.find_store_by_id(store_id)
+        cart.cashier = self._database.find_cashier_by_id(cashier_id)
+        self._carts[cart_id] = cart
+
+    def add_to_cart(self, cart_id: int, product_id: int) -> int:
+        """Add a product to a cart and return the cart total."""
+        cart = self._carts[cart_id]
+        cart.add_product(self._database.find_product_by_id(product_id))
+        return cart.total
+
+    def scan(self, cart_id: int, code: str) -> int:
+        """Add a scanned product to a cart and return the cart total."""
+        cart = self._carts[cart_id]
+        cart.scan(code)
+        return cart.total
+
+    def set_customer(self, cart_id: int, phone: int) -> bool:
+        """Assign a customer to a cart by phone number."""
+        return self._carts[cart_id].add_customer(phone)
+
+    def withdraw_cashback(self, cart_id: int, amount: int) -> bool:
+        """Apply cashback of the cart customer."""
+        return self._carts[cart_id].withdraw_cashback(amount)
+
+    def make_payment(self, cart_id: int, purchase_id: int, card_number: int, expiration_date: list,
+                     cvv: int) -> bool:
+        """Check out a cart, giving the purchase a chain-wide ID; the cart is closed only on success."""
+        cart = self._carts[cart_id]
+        self._database._last_ids["purchases"] = purchase_id - 1
+        if not cart.make_payment(card_number, expiration_date, cvv):
+            return False
+        del self._carts[cart_id]
+        return True
+
+    def cashback(self, phone: int) -> int:
+        """Return the shard-local cashback balance of a customer."""
+        customer = self._database.find_customer_by_phone(phone)
+        return customer.cashback if customer else 0
+
+    def take_cashback(self, phone: int, amount: int | None) -> list:
+        """Take shard-local cashback of a customer to move it to another shard.
+
+        Args:
+            phone (int): Phone number of the customer.
+            amount (int | None): Amount to take, capped at the balance; None takes the whole balance.
+
+        Returns:
+            list: (datetime, amount) lots taken, dated when they were credited.
+        """
+        customer = self._database.find_customer_by_phone(phone)
+        return customer.take_cashback(amount) if customer else []
+
+    def give_cashback(self, phone: int, lots: list) -> None:
+        """Add cashback lots taken on another shard to a customer, keeping their dates."""
+        customer = self._database.find_customer_by_phone(phone)
+        if customer:
+            customer.give_cashback(lots)
+
+    def call(self, function, args: tuple):
+        """Run a picklable function against the shard database."""
+        return function(self._database, *args)
+
+
+def _serve(index: int, connection) -> None:
+    """Worker process loop: execute (method, args) requests until None is received."""
+    shard = Shard(index)
+    while True:
+        request = connection.recv()
+        if request is None:
+            connection.close()
+            return
+        method, args = request
+        try:
+            connection.send((True, getattr(shard, method)(*args)))
+        except Exception as e:
+            connection.send((False, e))
+
+
+def _receipts(database: Database, since, until) -> list:
+    """Return the receipts of a shard within a purchase date range."""
+    return [purchase.get_receipt() for purchase in database.purchases
+            if (since is None or purchase.purchase_date >= since)
+            and (until is None or purchase.purchase_date < until)]
+
+
+def _revenue(database: Database) -> dict:
+    """Return the purchase total per store ID of a shard."""
+    revenue = {}
+    for purchase in database.purchases:
+        revenue[purchase.store.id] = revenue.get(purchase.store.id, 0) + purchase.total
+    return revenue
+
+
+def _enable_sketches(database: Database, settings: dict) -> None:
+    """Start maintaining sales sketches on a shard."""
+    database.set_sales_sketches(SalesSketches(**settings))
+
+
+def _sketches(database: Database) -> SalesSketches | None:
+    """Return the sales sketches of a shard."""
+    return database.sales_sketches
+
+
+class ShardedDatabase:
+    """Router front-end distributing a store chain across worker processes.
+
+    Every public method is safe to call from several threads; requests to one
+    shard are serialized, requests to different shards run in parallel.
+    """
+
+    def __init__(self, shards: int | None = None, context: str | None = None):
+        """Start the shard worker processes.
+
+        Args:
+            shards (int | None): Number of shards, defaulting to the number of CPU cores.
+            context (str | None): multiprocessing start method, e.g. "spawn".
+
+        Raises:
+            ValueError: If shards is not a positive integer.
+        """
+        if shards is None:
+            shards = os.cpu_count() or 1
+        if not isinstance(shards, int) or shards <= 0:
+            raise ValueError("shards must be a positive integer.")
+        context = multiprocessing.get_context(context)
+        self._connections = []
+        self._locks = []
+        self._processes = []
+        for index in range(shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(index, child), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._locks.append(threading.Lock())
+            self._processes.append(process)
+        self._last_ids = {"stores": 0, "categories": 0, "products": 0,
+                          "customers": 0, "cashiers": 0, "carts": 0, "purchases": 0}
+        self._id_lock = threading.Lock()
+        self._carts = {}
+        self._customers = {}
+        self._cart_customers = {}
+
+    def __enter__(self) -> 'ShardedDatabase':
+        """Return the router for use in a with statement."""
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Stop the shard workers when leaving a with statement."""
+        self.close()
+
+    @property
+    def shards(self) -> int:
+        """int: Number of shards."""
+        return len(self._connections)
+
+    def shard_of(self, store_id: int) -> int:
+        """Return the index of the shard owning a store.
+
+        Args:
+            store_id (int): ID of the store.
+
+        Returns:
+            int: Shard index.
+        """
+        return store_id % len(self._connections)
+
+    def home_of(self, phone: int) -> int | None:
+        """Return the index of the shard holding the cashback balance of a customer.
+
+        Args:
+            phone (int): Phone number of the customer.
+
+        Returns:
+            int | None: Shard index, or None if the customer is unknown.
+        """
+        customer_id = self._customers.get(phone)
+        return None if customer_id is None else customer_id % len(self._connections)
+
+    def _next_id(self, kind: str) -> int:
+        """Return the next chain-wide ID of an entity kind."""
+        with self._id_lock:
+            self._last_ids[kind] += 1
+            return self._last_ids[kind]
+
+    def _call(self, shard: int, method: str, *args):
+        """Send a request to one shard and return its reply, re-raising shard errors."""
+        with self._locks[shard]:
+            self._connections[shard].send((method, args))
+            ok, result = self._connections[shard].recv()
+        if not ok:
+            raise result
+        return result
+
+    def _broadcast(self, method: str, *args) -> list:
+        """Send a request to every shard first, then collect the replies in shard order."""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            for connection in self._connections:
+                connection.send((method, args))
+            replies = [connection.recv() for connection in self._connections]
+        finally:
+            for lock in self._locks:
+                lock.release()
+        for ok, result in replies:
+            if not ok:
+                raise result
+        return [result for _, result in replies]
+
+    def add_store(self, name: str, address: str) -> int:
+        """Create a store on its shard and return its ID."""
+        store_id = self._next_id("stores")
+        self._call(self.shard_of(store_id), "add_store", store_id, name, address)
+        return store_id
+
+    def add_category(self, store_id: int, name: str) -> int:
+        """Create a category in a store and return its ID."""
+        category_id = self._next_id("categories")
+        self._call(self.shard_of(store_id), "add_category", category_id, store_id, name)
+        return category_id
+
+    def add_product(self, store_id: int, name: str, price: int, quantity: int,
+                    sku: str | None = None, category_id: int | None = None) -> int:
+        """Create a product in a store (and optionally one of its categories) and return its ID."""
+        product_id = self._next_id("products")
+        self._call(self.shard_of(store_id), "add_product",
+                   product_id, store_id, name, price, quantity, sku, category_id)
+        return product_id
+
+    def add_customer(self, name: str, surname: str, phone: int) -> int:
+        """Register a customer on every shard and return their ID."""
+        customer_id = self._next_id("customers")
+        self._broadcast("add_customer", customer_id, name, surname, phone)
+        self._customers[phone] = customer_id
+        return customer_id
+
+    def add_cashier(self, name: str, surname: str, phone: str) -> int:
+        """Register a cashier on every shard and return their ID."""
+        cashier_id = self._next_id("cashiers")
+        self._broadcast("add_cashier", cashier_id, name, surname, phone)
+        return cashier_id
+
+    def open_cart(self, store_id: int, product_id: int, cashier_id: int) -> int:
+        """Open a cart on the shard owning the store and return its ID."""
+        cart_id = self._next_id("carts")
+        self._call(self.shard_of(store_id), "open_cart", cart_id, store_id, product_id, cashier_id)
+        self._carts[cart_id] = self.shard_of(store_id)
+        return cart_id
+
+    def add_to_cart(self, cart_id: int, product_id: int) -> int:
+        """Add a product to a cart and return the new cart total."""
+        return self._call(self._carts[cart_id], "add_to_cart", cart_id, product_id)
+
+    def scan(self, cart_id: int, code: str) -> int:
+        """Add a scanned product to a cart and return the new cart total."""
+        return self._call(self._carts[cart_id], "scan", cart_id, code)
+
+    def set_customer(self, cart_id: int, phone: int) -> bool:
+        """Assign a customer to a cart by phone number."""
+        assigned = self._call(self._carts[cart_id], "set_customer", cart_id, phone)
+        if assigned:
+            self._cart_customers[cart_id] = phone
+        return assigned
+
+    def _settle(self, cart_id: int) -> None:
+        """Move the cashback of the cart customer held by the cart's shard back to their home shard."""
+        shard = self._carts[cart_id]
+        phone = self._cart_customers.get(cart_id)
+        home = self.home_of(phone)
+        if home is not None and home != shard:
+            lots = self._call(shard, "take_cashback", phone, None)
+            if lots:
+                self._call(home, "give_cashback", phone, lots)
+
+    def withdraw_cashback(self, cart_id: int, amount: int) -> bool:
+        """Apply cashback of the cart customer, taken from their home shard."""
+        shard = self._carts[cart_id]
+        phone = self._cart_customers.get(cart_id)
+        home = self.home_of(phone)
+        if home is not None and home != shard:
+            lots = self._call(home, "take_cashback", phone, amount)
+            if lots:
+                self._call(shard, "give_cashback", phone, lots)
+        try:
+            return self._call(shard, "withdraw_cashback", cart_id, amount)
+        finally:
+            self._settle(cart_id)
+
+    def make_payment(self, cart_id: int, card_number: int, expiration_date: list, cvv: int) -> bool:
+        """Check out a cart on its shard; the cart is closed only if the payment succeeds."""
+        shard = self._carts[cart_id]
+        try:
+            paid = self._call(shard, "make_payment", cart_id, self._next_id("purchases"),
+                              card_number, expiration_date, cvv)
+        finally:
+            self._settle(cart_id)
+        if paid:
+            del self._carts[cart_id]
+            self._cart_customers.pop(cart_id, None)
+        return paid
+
+    def scatter(self, function, *args) -> list:
+        """Run function(database, *args) on every shard in parallel.
+
+        Args:
+            function (Callable): A module-level (picklable) function.
+            *args (Any): Extra picklable arguments.
+
+        Returns:
+            list: One result per shard, in shard order.
+        """
+        return self._broadcast("call", function, args)
+
+    def receipts(self, since=None, until=None) -> list:
+        """Return chain-wide receipts within a purchase date range, oldest first."""
+        merged = [receipt for part in self.scatter(_receipts, since, until) for receipt in part]
+        return sorted(merged, key=lambda receipt: receipt['purchase_date'])
+
+    def revenue(self) -> dict:
+        """Return the purchase total per store ID over the whole chain."""
+        merged = {}
+        for part in self.scatter(_revenue):
+            merged.update(part)
+        return dict(sorted(merged.items()))
+
+    def enable_sales_sketches(self, **settings) -> None:
+        """Maintain sales sketches on every shard; settings are SalesSketches arguments."""
+        self.scatter(_enable_sketches, settings)
+
+    def sales_sketches(self) -> SalesSketches:
+        """Return the chain-wide sales sketches, merged from every shard.
+
+        Raises:
+            ValueError: If sketches were not enabled.
+        """
+        parts = self.scatter(_sketches)
+        if any(part is None for part in parts):
+            raise ValueError("Sales sketches are not enabled.")
+        merged = parts[0]
+        for part in parts[1:]:
+            merged.merge(part)
+        return merged
+
+    def cashback(self, phone: int) -> int:
+        """Return the chain-wide cashback balance of a customer, the sum of the shard balances."""
+        return sum(self._broadcast("cashback", phone))
+
+    def close(self) -> None:
+        """Stop the shard worker processes."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+
+if __name__ == "__main__":
+    with ShardedDatabase(4) as chain:
+        cashier = chain.add_cashier("Maks", "Vovk", "380991234000")
+        chain.add_customer("Anna", "Block", 380991234001)
+        for number in range(8):
+            store = chain.add_store(f"Store {number}", f"{number} avenue")
+            bread = chain.add_product(store, "Bread", 25, 100, sku=f"482{store:010d}")
+            cart = chain.open_cart(store, bread, cashier)
+            chain.scan(cart, f"482{store:010d}")
+            chain.set_customer(cart, 380991234001)
+            chain.make_payment(cart, 1234567812345678, [11, 2030], 123)
+        print("Revenue per store:", chain.revenue())
+        print("Receipts:", len(chain.receipts()))
+        print("Cashback:", chain.cashback(380991234001))
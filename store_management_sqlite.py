@@ -0,0 +1,262 @@
+"""SQLite persistence for the store_management catalog with lazy loading.
+
+SQLiteCatalog saves the stores, categories and products of a Database to an
+SQLite file and opens them back lazily: opening reads the stores only, and
+every Store is a proxy whose categories and products are fetched the first
+time one of its child collections is accessed. Children are fetched for a
+batch of pending stores at once, so walking the stores of a dashboard costs
+one round trip per batch instead of one per store (the N+1 problem).
+Database-wide lookups of the opened database (products, categories and their
+find_*_by_id / find_product_by_sku) load the stores they need themselves.
+
+    catalog = SQLiteCatalog("catalog.db")
+    catalog.save(database)
+    database = catalog.open()
+    store = database.find_store_by_id(1)    # no categories or products loaded yet
+    store.find_product_by_sku("4820000000017")    # loads the store's batch
+"""
+import sqlite3
+
+from store_management import Category, Database, Product, Store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stores (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL, address TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY, store_id INTEGER, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY, store_id INTEGER, category_id INTEGER, name TEXT NOT NULL,
+    price INTEGER NOT NULL, quantity INTEGER NOT NULL, sku TEXT, low_stock_threshold INTEGER);
+CREATE INDEX IF NOT EXISTS categories_store ON categories (store_id);
+CREATE INDEX IF NOT EXISTS products_store ON products (store_id);
+CREATE INDEX IF NOT EXISTS products_sku ON products (sku);
+"""
+
+
+def _id(entity) -> int | None:
+    """Return the ID of an optional entity."""
+    return None if entity is None else entity.id
+
+
+class SQLiteCatalog:
+    """Stores and lazily loads the catalog (stores, categories, products) of a Database."""
+
+    def __init__(self, path: str, batch_size: int = 100):
+        """Initialize an SQLiteCatalog.
+
+        Args:
+            path (str): Path of the SQLite file, created on first save.
+            batch_size (int): Number of pending stores whose children are fetched together.
+
+        Raises:
+            TypeError: If path is not a string.
+            ValueError: If batch_size is not a positive integer.
+        """
+        if not isinstance(path, str):
+            raise TypeError("Path must be a string.")
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer.")
+        self._path = path
+        self._batch_size = batch_size
+        self._connection = None
+        self._database = None
+        self._pending = {}
+        self._links = None
+        self._queries = 0
+
+    @property
+    def queries(self) -> int:
+        """int: Number of queries run to load the opened database."""
+        return self._queries
+
+    @property
+    def database(self) -> Database | None:
+        """Database | None: The database opened last."""
+        return self._database
+
+    @property
+    def pending(self) -> int:
+        """int: Number of opened stores whose children are not loaded yet."""
+        return len(self._pending)
+
+    def save(self, database: Database) -> None:
+        """Replace the saved catalog with the stores, categories and products of a database.
+
+        Deferred stores of a database opened from this catalog are loaded first.
+
+        Args:
+            database (Database): The database to save.
+
+        Raises:
+            TypeError: If database is not a Database instance.
+        """
+        if not isinstance(database, Database):
+            raise TypeError(f"Expected Database instance, got {type(database).__name__}")
+        if database is self._database:
+            self.load_all()
+        connection = sqlite3.connect(self._path)
+        try:
+            with connection:
+                connection.executescript(_SCHEMA)
+                connection.execute("DELETE FROM stores")
+                connection.execute("DELETE FROM categories")
+                connection.execute("DELETE FROM products")
+                connection.executemany("INSERT INTO stores VALUES (?, ?, ?)",
+                                       ((store.id, store.name, store.address) for store in database.stores))
+                connection.executemany("INSERT INTO categories VALUES (?, ?, ?)",
+                                       ((category.id, _id(category.store), category.name)
+                                        for category in database.categories))
+                connection.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       ((product.id, _id(product.store), _id(product.category), product.name,
+                                         product.price, product.quantity, product.sku, product.low_stock_threshold)
+                                        for product in database.products))
+        finally:
+            connection.close()
+
+    def open(self, name: str = "catalog") -> Database:
+        """Open the saved catalog as a new Database.
+
+        Stores are created right away; their categories and products are loaded on first access.
+        Categories and products without a store are loaded right away. New categories and
+        products get IDs after the saved ones.
+
+        Args:
+            name (str): Name of the new database.
+
+        Returns:
+            Database: The opened database.
+        """
+        self.close()
+        self._connection = sqlite3.connect(self._path)
+        self._database = Database(name)
+        self._links = None
+        self._queries = 0
+        for store_id, store_name, address in self._execute("SELECT id, name, address FROM stores ORDER BY id"):
+            store = Store(store_name, address)
+            store._id = store_id
+            self._database.add_stores(store)
+            store._defer(self._load)
+            self._pending[store_id] = store
+        (categories, products), = self._execute(
+            "SELECT (SELECT MAX(id) FROM categories), (SELECT MAX(id) FROM products)")
+        self._database._last_ids['categories'] = categories or 0
+        self._database._last_ids['products'] = products or 0
+        self._materialize([None])
+        if self._pending:
+            self._database._catalog = self
+        return self._database
+
+    def close(self) -> None:
+        """Close the connection to the SQLite file; deferred stores of the opened database stay empty."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._database is not None and self._database._catalog is self:
+            self._database._catalog = None
+        for store in self._pending.values():
+            store.__dict__.pop("_loader", None)
+            store._categories = {}
+            store._clear_products()
+        self._pending = {}
+
+    def load_all(self) -> None:
+        """Load the children of every deferred store of the opened database."""
+        while self._pending:
+            self._materialize(list(self._pending)[:self._batch_size])
+
+    def find_product_by_sku(self, sku: str):
+        """Search the opened database for a product by SKU, loading the stores that hold it.
+
+        Args:
+            sku (str): SKU or barcode to search for.
+
+        Returns:
+            Product | bool: The matching Product instance if found, otherwise False.
+        """
+        if self._database is None:
+            return False
+        return self._database.find_product_by_sku(sku)
+
+    def _load_holding(self, collection: str, key: str, value) -> None:
+        """Load the deferred stores holding the categories or products whose key ("id" or "sku") equals value."""
+        if self._connection is None:
+            return
+        pending = [store_id for store_id, in self._execute(f"SELECT store_id FROM {collection} WHERE {key} = ?",
+                                                           (value,))
+                   if store_id in self._pending]
+        if pending:
+            self._materialize(pending)
+
+    def _execute(self, sql: str, parameters=()) -> list:
+        """Run a query on the open connection and return all rows."""
+        self._queries += 1
+        return self._connection.execute(sql, parameters).fetchall()
+
+    def _load(self, store: Store) -> None:
+        """Load a deferred store together with the next pending stores of its batch."""
+        batch = [store.id]
+        for store_id in self._pending:
+            if len(batch) >= self._batch_size:
+                break
+            if store_id != store.id:
+                batch.append(store_id)
+        self._materialize(batch)
+
+    def _linked(self, keys: list) -> set:
+        """Close a set of store IDs over categories holding products of another store."""
+        if self._links is None:
+            self._links = {}
+            for product_store, category_store in self._execute(
+                    "SELECT DISTINCT p.store_id, c.store_id FROM products p JOIN categories c "
+                    "ON p.category_id = c.id WHERE p.store_id IS NOT c.store_id"):
+                self._links.setdefault(product_store, set()).add(category_store)
+                self._links.setdefault(category_store, set()).add(product_store)
+        closed = set()
+        stack = list(keys)
+        while stack:
+            key = stack.pop()
+            if key in closed:
+                continue
+            closed.add(key)
+            stack.extend(self._links.get(key, ()))
+        return {key for key in closed if key in self._pending or key is None and None in keys}
+
+    def _materialize(self, keys: list) -> None:
+        """Fetch and link the categories and products of some stores; None stands for no store."""
+        keys = self._linked(keys)
+        if not self._pending.keys() - keys and self._database._catalog is self:
+            self._database._catalog = None
+        stores = {}
+        for key in keys:
+            if key is not None:
+                store = self._pending.pop(key)
+                store.__dict__.pop("_loader", None)
+                store._categories = {}
+                store._clear_products()
+                stores[key] = store
+        ids = [key for key in keys if key is not None]
+        where = f"store_id IN ({', '.join('?' * len(ids))})" if ids else "0"
+        if None in keys:
+            where += " OR store_id IS NULL"
+        categories = {}
+        for category_id, store_id, name in self._execute(
+                f"SELECT id, store_id, name FROM categories WHERE {where} ORDER BY id", ids):
+            category = Category(name)
+            category._id = category_id
+            self._database.add_categories(category)
+            if store_id is not None:
+                category.set_store(stores[store_id])
+            categories[category_id] = category
+        for product_id, store_id, category_id, name, price, quantity, sku, threshold in self._execute(
+                "SELECT id, store_id, category_id, name, price, quantity, sku, low_stock_threshold "
+                f"FROM products WHERE {where} ORDER BY id", ids):
+            product = Product(name, price, quantity, sku)
+            product._id = product_id
+            product._low_stock_threshold = threshold
+            self._database.add_products(product)
+            if store_id is not None:
+                product.set_store(stores[store_id])
+            if category_id is not None:
+                category = categories.get(category_id) or self._database._find_by_id("categories", category_id)
+                if category:
+                    product.set_category(category)
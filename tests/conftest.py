@@ -0,0 +1,42 @@
+"""Shared fixtures for the store_management tests."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store_management import Cashier, Customer, Database, Product, ShoppingCart, Store  # noqa: E402
+
+CARD = (1234567812345678, [12, 2030], 123)
+
+
+def make_database():
+    """Build a database with one store, one product (price 100, 10 units), a customer and a cashier."""
+    database = Database("test")
+    store = Store("Store", "Street 1")
+    database.add_stores(store)
+    product = Product("Milk", 100, 10, "SKU1")
+    database.add_products(product)
+    store.add_product(product)
+    database.add_customers(Customer("Ann", "Lee", 380990000001))
+    database.add_cashiers(Cashier("Bob", "Kay", "380990000002"))
+    return database
+
+
+@pytest.fixture
+def database():
+    """The database of make_database()."""
+    return make_database()
+
+
+def open_cart(database, *products):
+    """Open a cart in the first store with the first customer and cashier."""
+    products = products or (database.products[0],)
+    cart = ShoppingCart(products[0], database)
+    for product in products[1:]:
+        cart.add_product(product)
+    cart.store = database.stores[0]
+    cart.cashier = database.cashiers[0]
+    cart.add_customer(database.customers[0].phone)
+    return cart
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from store_management import Database, Purchase, PurchaseArchive
+
+from conftest import CARD, make_database, open_cart
+
+LATER = datetime.now() + timedelta(days=5)
+
+
+def buy(database, quantity=1):
+    cart = open_cart(database)
+    cart.set_quantity(database.products[0], quantity)
+    assert cart.make_payment(*CARD)
+    return database.purchases[-1]
+
+
+def test_archived_purchase_is_rehydrated(database, tmp_path):
+    database.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=1))
+    purchase = buy(database, 2)
+    assert database.archive_purchases(LATER) == 1
+    assert database.purchases == ()
+    rebuilt = database.find_purchase_by_id(purchase.id)
+    assert rebuilt.total == 200
+    assert rebuilt.products == purchase.products
+
+
+def test_only_purchases_before_the_cutoff_are_archived(database, tmp_path):
+    database.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=1))
+    old, new = buy(database), buy(database)
+    old._purchase_date -= timedelta(days=3)
+    database._purchase_dates.update(old)
+    assert database.archive_purchases() == 1
+    assert database.purchases == (new,)
+
+
+def test_resumed_archive_keeps_segments_and_ids(database, tmp_path):
+    database.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=1, segment_size=1))
+    first = buy(database)
+    buy(database, 3)
+    assert database.archive_purchases(LATER) == 2
+
+    database = make_database()
+    resumed = PurchaseArchive(str(tmp_path), retention_days=1, segment_size=1)
+    assert len(resumed) == 2
+    assert resumed.last_id == 2
+    database.set_purchase_archive(resumed)
+    later = buy(database)
+    assert later.id == 3
+    assert database.archive_purchases(LATER) == 1
+    assert resumed.stub(first.id).total == 100
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_purchase_with_an_archived_id_is_rejected(database, tmp_path):
+    database.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=1))
+    purchase = buy(database)
+    database.archive_purchases(LATER)
+    clash = Purchase(database.stores[0], list(database.products), database.cashiers[0], database.customers[0], 0)
+    clash._id = purchase.id
+    with pytest.raises(ValueError):
+        database.add_purchases(clash)
+
+    other = Database("other")
+    other.add_purchases(clash)
+    with pytest.raises(ValueError):
+        other.set_purchase_archive(database.purchase_archive)
+
+
+def test_amend_of_archived_purchase_survives_eviction(database, tmp_path):
+    database.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=1, cache_size=1))
+    first, second = buy(database), buy(database)
+    database.archive_purchases(LATER)
+    database.find_purchase_by_id(first.id).amend(total=40)
+    database.find_purchase_by_id(second.id)
+    assert database.find_purchase_by_id(first.id).total == 40
+    assert PurchaseArchive(str(tmp_path)).stub(first.id).total == 40
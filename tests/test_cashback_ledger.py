@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from store_management import CashbackLedger, Customer
+
+from conftest import CARD, open_cart
+
+JANUARY = datetime(2026, 1, 10)
+FEBRUARY = datetime(2026, 2, 1)
+
+
+def test_balances_at_points_in_time():
+    ledger = CashbackLedger()
+    ledger.append(100, CashbackLedger.ACCRUAL, JANUARY)
+    ledger.append(-30, CashbackLedger.WITHDRAWAL, FEBRUARY)
+    assert ledger.balance == 70
+    assert ledger.balance_at(JANUARY) == 100
+    assert ledger.balance_at(JANUARY - timedelta(days=1)) == 0
+    with pytest.raises(ValueError):
+        ledger.append(5, CashbackLedger.ACCRUAL, JANUARY)
+
+
+def test_debits_take_the_oldest_lots():
+    ledger = CashbackLedger()
+    ledger.append(100, CashbackLedger.ACCRUAL, JANUARY)
+    ledger.append(50, CashbackLedger.ACCRUAL, FEBRUARY)
+    assert ledger.append(-120, CashbackLedger.WITHDRAWAL, FEBRUARY) == [(JANUARY, 100), (FEBRUARY, 20)]
+    assert ledger.expiring(JANUARY) == 0
+    assert ledger.expiring(FEBRUARY) == 30
+
+
+def test_voided_cashback_still_expires(database):
+    customer = database.customers[0]
+    customer.credit_cashback(100, when=JANUARY)
+    cart = open_cart(database)
+    assert cart.withdraw_cashback(100)
+    cart.void()
+    assert customer.cashback == 100
+    assert database.expire_cashback(FEBRUARY) == 100
+    assert customer.cashback == 0
+
+
+def test_excess_refund_keeps_the_credit_date(database):
+    customer = database.customers[0]
+    customer.credit_cashback(150, when=JANUARY)
+    cart = open_cart(database)
+    cart.set_quantity(database.products[0], 2)
+    assert cart.withdraw_cashback(150)
+    cart.set_quantity(database.products[0], 1)
+    assert (cart.used_cashback, customer.cashback) == (100, 50)
+    assert database.expire_cashback(FEBRUARY) == 50
+
+
+def test_transferred_cashback_keeps_its_date():
+    home, shard = Customer("Ann", "Lee", 380990000001), Customer("Ann", "Lee", 380990000001)
+    home.credit_cashback(100, when=JANUARY)
+    shard.give_cashback(home.take_cashback(60))
+    assert (home.cashback, shard.cashback) == (40, 60)
+    assert shard.cashback_ledger.expiring(FEBRUARY) == 60
+    home.give_cashback(shard.take_cashback())
+    assert home.cashback_ledger.expiring(FEBRUARY) == 100
+
+
+def test_withdrawal_after_a_future_entry(database):
+    database.batch_cashback = True
+    customer = database.customers[0]
+    customer.credit_cashback(100)
+    cart = open_cart(database)
+    assert cart.make_payment(*CARD)
+    database.accrue_pending_cashback(datetime.now() + timedelta(days=1))
+    cart = open_cart(database)
+    assert cart.withdraw_cashback(50)
+    customer.cashback = 10
+    assert customer.cashback == 10
+
+
+def test_expiry_with_a_past_time_changes_nothing(database):
+    first = database.customers[0]
+    second = Customer("Sam", "Fox", 380990000003)
+    database.add_customers(second)
+    first.credit_cashback(100, when=JANUARY)
+    second.credit_cashback(100, when=FEBRUARY)
+    with pytest.raises(ValueError):
+        database.expire_cashback(FEBRUARY, when=JANUARY + timedelta(days=1))
+    assert (first.cashback, second.cashback) == (100, 100)
+    assert database.expire_cashback(JANUARY, when=FEBRUARY) == 100
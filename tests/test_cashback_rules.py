@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from store_management import CashbackRules
+
+from conftest import CARD, open_cart
+
+
+@pytest.fixture
+def rules(database):
+    rules = CashbackRules()
+    rules.add_tier(0, 1)
+    rules.add_tier(500, 10)
+    database.cashback_rules = rules
+    return rules
+
+
+def pay(database, quantity):
+    cart = open_cart(database)
+    cart.set_quantity(database.products[0], quantity)
+    assert cart.make_payment(*CARD)
+
+
+def test_purchase_crossing_a_tier_earns_it(database, rules):
+    pay(database, 5)
+    assert database.customers[0].cashback == 50
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_batch_and_immediate_accrual_agree(database, rules, batch):
+    database.batch_cashback = batch
+    pay(database, 4)
+    pay(database, 1)
+    pay(database, 1)
+    if batch:
+        database.accrue_pending_cashback()
+    assert database.customers[0].cashback == 4 + 10 + 10
+
+
+def test_batch_uses_the_spend_as_of_each_purchase(database, rules):
+    database.batch_cashback = True
+    pay(database, 1)
+    pay(database, 5)
+    database.accrue_pending_cashback()
+    assert database.customers[0].cashback == 1 + 50
+
+
+def test_promotion_applies_at_the_purchase_date(database, rules):
+    now = datetime.now()
+    rules.add_promotion(5, now - timedelta(hours=1), now + timedelta(hours=1), products=database.products)
+    database.batch_cashback = True
+    pay(database, 1)
+    database.accrue_pending_cashback(now + timedelta(days=1))
+    assert database.customers[0].cashback == 6
@@ -0,0 +1,81 @@
+import pytest
+
+from store_management import Category, Database, Product, Store
+from store_management_catalog import CatalogCache
+from store_management_sqlite import SQLiteCatalog
+
+
+def catalog_database():
+    database = Database("catalog")
+    stores = [Store("North", "Street 1"), Store("South", "Street 2")]
+    database.add_stores(*stores)
+    for number, store in enumerate(stores):
+        category = Category(f"Dairy {number}")
+        database.add_categories(category)
+        store.add_category(category)
+        products = [Product(f"Milk {number}", 100 + number, 10, f"SKU{number}"),
+                    Product(f"Cheese {number}", 300, 4, None)]
+        database.add_products(*products)
+        for product in products:
+            store.add_product(product)
+            category.add_product(product)
+    loose = Product("Loose", 5, 1, "LOOSE")
+    database.add_products(loose)
+    return database
+
+
+def rows(database):
+    return sorted((product.id, product.name, product.price, product.quantity, product.sku,
+                   product.store and product.store.id, product.category and product.category.id)
+                  for product in database.products)
+
+
+@pytest.fixture(params=[SQLiteCatalog, CatalogCache], ids=["sqlite", "cache"])
+def catalog(request, tmp_path):
+    catalog = request.param(str(tmp_path / "catalog"))
+    yield catalog
+    catalog.close()
+
+
+def test_round_trip_keeps_every_product(catalog):
+    saved = catalog_database()
+    catalog.save(saved)
+    opened = catalog.open()
+    assert [(store.id, store.name, store.address) for store in opened.stores] == \
+           [(store.id, store.name, store.address) for store in saved.stores]
+    assert rows(opened) == rows(saved)
+    assert catalog.pending == 0
+
+
+def test_open_defers_the_stores(catalog):
+    catalog.save(catalog_database())
+    opened = catalog.open()
+    assert catalog.pending == 2
+    product = catalog.find_product_by_sku("SKU1")
+    assert product.name == "Milk 1"
+    assert product.store is opened.stores[1]
+    assert catalog.pending == 1
+
+
+def test_loaded_store_indexes_its_products(catalog):
+    catalog.save(catalog_database())
+    store = catalog.open().stores[0]
+    assert [product.name for product in store.search_products("mil")] == ["Milk 0"]
+    assert store.find_product_by_sku("SKU0").price == 100
+    assert [product.name for product in store.products_by_price(high=200)] == ["Milk 0"]
+
+
+def test_new_products_get_ids_after_the_saved_ones(catalog):
+    saved = catalog_database()
+    catalog.save(saved)
+    opened = catalog.open()
+    product = Product("Bread", 50, 5, "SKU9")
+    opened.add_products(product)
+    assert product.id == max(product.id for product in saved.products) + 1
+
+
+def test_resaving_an_opened_catalog_round_trips(catalog):
+    saved = catalog_database()
+    catalog.save(saved)
+    catalog.save(catalog.open())
+    assert rows(catalog.open()) == rows(saved)
@@ -0,0 +1,44 @@
+import pytest
+
+from store_management import Category, Product
+
+
+@pytest.fixture
+def store(database):
+    store = database.stores[0]
+    products = [Product("Oat Milk", 120, 5, "SKU2"), Product("Cheddar  cheese", 300, 3, "SKU3")]
+    database.add_products(*products)
+    store.add_product(*products)
+    return store
+
+
+def names(products):
+    return sorted(product.name for product in products)
+
+
+def test_prefix_ignores_case_and_repeated_spaces(store):
+    assert names(store.search_products("MIL")) == ["Milk"]
+    assert names(store.search_products("cheddar ch")) == ["Cheddar  cheese"]
+
+
+def test_substring_and_fuzzy_modes(store):
+    assert names(store.search_products("ilk", "substring")) == ["Milk", "Oat Milk"]
+    assert names(store.search_products("oat mlk", "fuzzy")) == ["Oat Milk"]
+
+
+def test_index_follows_renames_and_removals(database, store):
+    milk = database.find_product_by_sku("SKU1")
+    milk.name = "Kefir"
+    assert store.search_products("mil") == []
+    assert names(store.search_products("kef")) == ["Kefir"]
+    store.remove_product(milk)
+    assert store.search_products("kef") == []
+
+
+def test_category_filter_and_limit(database, store):
+    category = Category("Dairy")
+    database.add_categories(category)
+    store.add_category(category)
+    category.add_product(database.find_product_by_sku("SKU2"))
+    assert names(store.search_products("ilk", "substring", category=category)) == ["Oat Milk"]
+    assert len(store.search_products("ilk", "substring", limit=1)) == 1
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from store_management import Product, ReorderQueue, StockEvent, Store
+
+
+def event(product, store, quantity):
+    return StockEvent(product, "low", quantity, 5, store, datetime(2026, 1, 1))
+
+
+def test_events_of_different_stores_are_queued_separately():
+    product = Product("Milk", 100, 10, "SKU1")
+    first, second = Store("A", "Street 1"), Store("B", "Street 2")
+    queue = ReorderQueue()
+    queue.push(event(product, first, 4))
+    queue.push(event(product, second, 3))
+    queue.push(event(product, first, 2))
+    assert len(queue) == 2
+    assert queue.pop() == event(product, first, 2)
+    assert product in queue
+    assert queue.pop() == event(product, second, 3)
+    assert product not in queue
+
+
+def test_discard_drops_one_store_or_every_store():
+    product = Product("Milk", 100, 10, "SKU1")
+    first, second = Store("A", "Street 1"), Store("B", "Street 2")
+    queue = ReorderQueue()
+    queue.push(event(product, first, 4))
+    queue.push(event(product, second, 3))
+    queue.discard(product, first)
+    assert len(queue) == 1
+    queue.discard(product)
+    assert len(queue) == 0
+    assert product not in queue
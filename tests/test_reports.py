@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from store_management import PurchaseArchive
+from store_management_reports import ReportEngine
+
+from conftest import CARD, open_cart
+
+NOW = datetime.now()
+
+
+def buy(database, quantity, days_ago=0):
+    cart = open_cart(database)
+    cart.set_quantity(database.products[0], quantity)
+    assert cart.make_payment(*CARD)
+    purchase = database.purchases[-1]
+    purchase._purchase_date -= timedelta(days=days_ago)
+    database._purchase_dates.update(purchase)
+    return purchase
+
+
+@pytest.fixture
+def history(database):
+    buy(database, 1, days_ago=3)
+    buy(database, 2, days_ago=2)
+    buy(database, 3, days_ago=1)
+    return database
+
+
+def store_revenue(report):
+    return report['revenue_per_store'][1]['gross']
+
+
+@pytest.mark.parametrize("context", ["fork", "spawn"])
+@pytest.mark.parametrize("partition", ReportEngine.PARTITIONS)
+def test_report_does_not_depend_on_workers(history, partition, context):
+    serial = ReportEngine(history, workers=1, partition=partition).run()
+    parallel = ReportEngine(history, workers=2, partition=partition, context=context).run()
+    assert parallel == serial
+    assert store_revenue(serial) == 600
+
+
+def test_time_partitions_are_date_ranges(history):
+    engine = ReportEngine(history, workers=2)
+    purchases = engine._select(None, None, False)
+    first, second = engine._time_partitions(purchases, 2)
+    assert max(purchase.purchase_date for purchase in first) < min(purchase.purchase_date for purchase in second)
+
+
+def test_window_selects_only_its_purchases(history):
+    engine = ReportEngine(history, workers=2)
+    since, until = NOW - timedelta(days=2, hours=12), NOW - timedelta(hours=12)
+    assert [purchase.total for purchase in engine._select(since, until, False)] == [200, 300]
+    assert store_revenue(engine.run(since=since, until=until)) == 500
+
+
+def test_archived_purchases_are_included_on_request(history, tmp_path):
+    history.set_purchase_archive(PurchaseArchive(str(tmp_path), retention_days=2))
+    assert history.archive_purchases(NOW) == 1
+    engine = ReportEngine(history, workers=1)
+    assert store_revenue(engine.run()) == 500
+    assert store_revenue(engine.run(archived=True)) == 600
@@ -0,0 +1,33 @@
+import pytest
+
+from store_management import Product, ShoppingCart, Store
+
+from conftest import open_cart
+
+
+def test_scan_resolves_in_the_cart_store(database):
+    cart = open_cart(database)
+    assert cart.scan("SKU1") is database.products[0]
+    assert cart.total == 200
+
+
+def test_scan_without_a_store_resolves_in_the_database(database):
+    cart = ShoppingCart(database.products[0], database)
+    assert cart.scan("SKU1") is database.products[0]
+
+
+def test_unknown_code_raises_naming_the_code(database):
+    cart = open_cart(database)
+    with pytest.raises(ValueError, match="'NOPE'"):
+        cart.scan("NOPE")
+
+
+def test_code_of_another_store_is_not_found(database):
+    other = Store("Other", "Street 2")
+    database.add_stores(other)
+    product = Product("Bread", 50, 5, "SKU2")
+    database.add_products(product)
+    other.add_product(product)
+    cart = open_cart(database)
+    with pytest.raises(ValueError, match="'SKU2'"):
+        cart.scan("SKU2")
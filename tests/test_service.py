@@ -0,0 +1,97 @@
+import asyncio
+import struct
+
+import pytest
+
+from store_management_service import ServiceClient, StoreService, _encode, _read
+
+from conftest import CARD
+
+CHECKOUT = {'card_number': CARD[0], 'expiration_date': CARD[1], 'cvv': CARD[2]}
+
+
+def request(op, **args):
+    return {'id': 1, 'op': op, 'args': args}
+
+
+def open_cart(service):
+    reply = service.dispatch(request("open_cart", store_id=1, cashier_id=1, sku="SKU1"))
+    assert reply['ok']
+    return reply['result']
+
+
+def test_checkout_is_refused_after_a_failed_operation(database):
+    service = StoreService(database)
+    cart_id = open_cart(service)
+    assert service.dispatch(request("customer", cart_id=cart_id, phone=380990000001))['ok']
+    assert not service.dispatch(request("add", cart_id=cart_id, sku="NOPE"))['ok']
+    refused = service.dispatch(request("checkout", cart_id=cart_id, **CHECKOUT))
+    assert not refused['ok']
+    assert database.products[0].quantity == 10
+    retried = service.dispatch(request("checkout", cart_id=cart_id, **CHECKOUT))
+    assert retried['ok']
+    assert database.products[0].quantity == 9
+
+
+async def serve(database, **options):
+    service = StoreService(database, **options)
+    await service.start(port=0)
+    return service, service._server.sockets[0].getsockname()[1]
+
+
+def test_pipelined_checkout_does_not_pay_a_partial_cart(database):
+    async def scenario():
+        service, port = await serve(database)
+        async with ServiceClient(port=port, pool_size=1) as client:
+            cart_id = await client.open_cart(1, 1, sku="SKU1")
+            with pytest.raises(RuntimeError, match="Product not found"):
+                await client.checkout(cart_id, *CARD, skus=("SKU1", "NOPE"))
+            assert cart_id in service._carts
+            assert database.products[0].quantity == 10
+        await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_oversized_frame_drops_the_connection(database):
+    async def scenario():
+        service, port = await serve(database, max_frame_size=64)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(struct.pack(">I", 65) + b" " * 65)
+        assert await reader.read() == b""
+        writer.close()
+        await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_read_rejects_an_oversized_frame():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(struct.pack(">I", 10) + b"0123456789")
+        with pytest.raises(ValueError):
+            await _read(reader, max_size=9)
+        reader = asyncio.StreamReader()
+        reader.feed_data(_encode({'id': 1}))
+        reader.feed_eof()
+        assert await _read(reader) == {'id': 1}
+        assert await _read(reader) is None
+
+    asyncio.run(scenario())
+
+
+def test_carts_of_a_closed_connection_are_voided(database):
+    async def scenario():
+        service, port = await serve(database)
+        async with ServiceClient(port=port, pool_size=1) as client:
+            cart_id = await client.open_cart(1, 1, sku="SKU1")
+            cart = service._carts[cart_id]
+        for _ in range(100):
+            if cart_id not in service._carts:
+                break
+            await asyncio.sleep(0.01)
+        assert cart_id not in service._carts
+        assert cart.status == "voided"
+        await service.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+import pytest
+
+from store_management import Database, Product, SharedInventory, Store
+
+from conftest import CARD, open_cart
+
+
+@pytest.fixture
+def inventory():
+    inventory = SharedInventory(capacity=16, stripes=4)
+    yield inventory
+    inventory.close()
+    inventory.unlink()
+
+
+def test_late_product_seeds_an_unstocked_slot(database, inventory):
+    database.set_shared_inventory(inventory, load=True)
+    product = Product("Bread", 50, 7, "SKU2")
+    database.add_products(product)
+    assert inventory.get(product.id) == 7
+    assert product.quantity == 7
+
+
+def test_second_till_does_not_overwrite_shared_stock(database, inventory):
+    database.set_shared_inventory(inventory, load=True)
+    product = database.products[0]
+    cart = open_cart(database)
+    cart.set_quantity(product, 7)
+    assert cart.make_payment(*CARD)
+    assert inventory.get(product.id) == 3
+
+    till = Database("till")
+    till.set_shared_inventory(inventory)
+    store = Store("Store", "Street 1")
+    till.add_stores(store)
+    stale = Product("Milk", 100, 10, "SKU1")
+    till.add_products(stale)
+    store.add_product(stale)
+    assert stale.id == product.id
+    assert inventory.get(product.id) == 3
+    assert stale.quantity == 3
+    assert list(store.products_by_quantity(high=3)) == [stale]
+
+
+def test_product_above_capacity_is_rejected(database):
+    inventory = SharedInventory(capacity=1)
+    try:
+        with pytest.raises(ValueError):
+            database.set_shared_inventory(inventory)
+    finally:
+        inventory.close()
+        inventory.unlink()
+
+
+def test_reservation_is_all_or_nothing(inventory):
+    inventory.set(1, 5)
+    inventory.set(2, 1)
+    assert inventory.reserve({1: 2, 2: 2}) is None
+    assert (inventory.get(1), inventory.get(2)) == (5, 1)
+    assert inventory.reserve({1: 2, 2: 1}) == {1: 5, 2: 1}
+    assert (inventory.get(1), inventory.get(2)) == (3, 0)
@@ -0,0 +1,75 @@
+import pytest
+
+from store_management import Product, Store
+
+from conftest import CARD, open_cart
+
+
+@pytest.fixture
+def branch(database):
+    branch = Store("Branch", "Street 2")
+    database.add_stores(branch)
+    database.stock_ledger.set(database.products[0], branch, 4)
+    return branch
+
+
+def test_ledger_stock_is_listed_in_the_store(database, branch):
+    product = database.products[0]
+    assert product.store is database.stores[0]
+    assert product in branch.products
+    assert branch.find_product_by_sku("SKU1") is product
+    assert branch.search_products("mil") == [product]
+
+
+def test_ledger_stock_can_be_scanned_and_sold(database, branch):
+    product = database.products[0]
+    cart = open_cart(database)
+    cart.store = branch
+    cart.set_quantity(product, 3)
+    assert cart.scan("SKU1") is product
+    assert cart.make_payment(*CARD)
+    assert database.stock_ledger.get(product, branch) == 0
+    assert product.quantity == 10
+
+
+def test_store_quantity_index_follows_the_ledger(database, branch):
+    product = database.products[0]
+    assert list(branch.products_by_quantity(high=4)) == [product]
+    database.stock_ledger.adjust(product, branch, 6)
+    assert list(branch.products_by_quantity(high=4)) == []
+    assert list(branch.products_by_quantity(low=10)) == [product]
+    assert branch.quantity_of(product) == 10
+
+
+def test_renamed_product_is_found_in_the_listing_store(database, branch):
+    product = database.products[0]
+    product.name = "Oat drink"
+    product.sku = "SKU9"
+    assert branch.search_products("oat") == [product]
+    assert branch.find_product_by_sku("SKU9") is product
+    assert not branch.find_product_by_sku("SKU1")
+
+
+def test_ledger_refuses_a_clashing_sku(database, branch):
+    other = Product("Kefir", 80, 5, "SKU1")
+    other_store = Store("Corner", "Street 3")
+    database.add_stores(other_store)
+    other_store.add_product(other)
+    with pytest.raises(ValueError):
+        database.stock_ledger.add_store(other_store)
+    assert other_store not in database.stock_ledger.stores
+
+
+def test_remove_stores_drops_the_ledger_column(database, branch):
+    database.remove_stores(branch)
+    assert branch not in database.stock_ledger.stores
+    assert branch.products == ()
+    assert not branch.find_product_by_sku("SKU1")
+
+
+def test_remove_products_drops_the_ledger_row(database, branch):
+    product = database.products[0]
+    database.remove_products(product)
+    assert product not in database.stock_ledger.products
+    assert branch.products == ()
+    assert list(branch.products_by_quantity()) == []